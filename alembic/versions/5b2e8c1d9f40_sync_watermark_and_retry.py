@@ -0,0 +1,39 @@
+"""sync watermark and retry queue
+
+Revision ID: 5b2e8c1d9f40
+Revises: 31535a02650a
+Create Date: 2020-06-01 10:12:44.518203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8c1d9f40'
+down_revision = '31535a02650a'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # last_call_id starts empty, so the first sync after upgrading reads every unsynced call once
+    with op.batch_alter_table('sync_campaign', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_call_id', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('sync_call', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('retry', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_sync_call_call_id'), ['call_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_sync_call_retry'), ['retry'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sync_call', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sync_call_retry'))
+        batch_op.drop_index(batch_op.f('ix_sync_call_call_id'))
+        batch_op.drop_column('attempts')
+        batch_op.drop_column('retry')
+
+    with op.batch_alter_table('sync_campaign', schema=None) as batch_op:
+        batch_op.drop_column('last_call_id')
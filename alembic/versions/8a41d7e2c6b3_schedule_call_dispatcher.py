@@ -0,0 +1,28 @@
+"""schedule call dispatcher
+
+Revision ID: 8a41d7e2c6b3
+Revises: 5b2e8c1d9f40
+Create Date: 2020-06-01 14:03:27.881942
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a41d7e2c6b3'
+down_revision = '5b2e8c1d9f40'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('schedule_call', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('location', sa.String(length=100), nullable=True))
+        batch_op.create_index(batch_op.f('ix_schedule_call_time_to_call'), ['time_to_call'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('schedule_call', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_schedule_call_time_to_call'))
+        batch_op.drop_column('location')
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.sql import func
+
+from ..extensions import db, cache, rq
+
+from ..campaign.models import Campaign
+from ..call.models import Call
+
+DASHBOARD_METRICS_KEY = 'admin:dashboard_metrics'
+
+
+def month_bounds(today):
+    """
+    @return  (this_month_start, this_month_end, last_month_start, last_month_end) for the given day
+    """
+    this_month_start = today.replace(day=1)  # first day of the current month
+    last_month = this_month_start - timedelta(days=28) # a day in last month
+    next_month = today.replace(day=28) + timedelta(days=4)  # a day in next month (for months with 28,29,30,31)
+
+    this_month_end = next_month - timedelta(days=next_month.day)  # the last day of the current month
+    this_month_end = this_month_end.replace(hour=23, minute=59)
+    last_month_start = last_month - timedelta(days=(last_month.day-1))
+    last_month_end = this_month_start - timedelta(days=this_month_start.day)
+    last_month_end = last_month_end.replace(hour=23, minute=59)
+    return (this_month_start, this_month_end, last_month_start, last_month_end)
+
+
+def compute_dashboard_metrics():
+    """
+    Run the aggregate call queries for the admin dashboard and campaign list
+    """
+    today = datetime.today().replace(hour=0, minute=0, second=0)
+    (this_month_start, this_month_end, last_month_start, last_month_end) = month_bounds(today)
+
+    calls_by_campaign = (db.session.query(Campaign.id, func.count(Call.id))
+            .filter(Call.status == 'completed')
+            .join(Call).group_by(Campaign.id))
+
+    calls_this_month = (db.session.query(func.count(Call.id))
+            .filter(Call.status == 'completed')
+            .filter(Call.timestamp >= this_month_start)
+            .filter(Call.timestamp <= this_month_end)
+        ).scalar()
+
+    calls_last_month = (db.session.query(func.count(Call.id))
+            .filter(Call.status == 'completed')
+            .filter(Call.timestamp >= last_month_start)
+            .filter(Call.timestamp <= last_month_end)
+        ).scalar()
+
+    calls_by_day = (db.session.query(func.date(Call.timestamp), func.count(Call.id))
+            .filter(Call.status == 'completed')
+            .filter(Call.timestamp >= this_month_start)
+            .filter(Call.timestamp <= this_month_end)
+            .group_by(func.date(Call.timestamp))
+            .order_by(func.date(Call.timestamp))
+        )
+
+    return {
+        'calls_by_campaign': dict(calls_by_campaign.all()),
+        'calls_by_day': [tuple(row) for row in calls_by_day.all()],
+        'calls_this_month': calls_this_month,
+        'calls_last_month': calls_last_month,
+        'computed_at': datetime.utcnow(),
+    }
+
+
+@rq.job(timeout=10*60)
+def refresh_dashboard_metrics():
+    metrics = compute_dashboard_metrics()
+    cache.set(DASHBOARD_METRICS_KEY, metrics)
+    return metrics
+
+
+def get_dashboard_metrics():
+    """
+    Returns materialized dashboard metrics from the cache
+    Only computes them in the request if the refresh job has not run yet
+    """
+    metrics = cache.get(DASHBOARD_METRICS_KEY)
+    if metrics is None:
+        current_app.logger.info('dashboard metrics not in cache, computing now')
+        metrics = refresh_dashboard_metrics()
+    return metrics
+
+
+def schedule_dashboard_metrics():
+    # cron jobs are named, so rescheduling replaces the existing job
+    interval = current_app.config.get('DASHBOARD_METRICS_INTERVAL', 5)
+    return refresh_dashboard_metrics.cron('*/{} * * * *'.format(interval), DASHBOARD_METRICS_KEY)
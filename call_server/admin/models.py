@@ -1,11 +1,72 @@
 import hashlib
 from datetime import datetime
 import pytz
+import time
+import uuid
 
-from ..extensions import db
+from flask import current_app, has_app_context
+from ..extensions import db, cache
 from ..utils import utc_now
+from ..user.models import User
 
 from sqlalchemy_utils.types import phone_number
+from sqlalchemy_utils.types.phone_number import phonenumbers
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+# changed whenever users are saved, so every process reloads its admin phones
+KEY_ADMIN_PHONES_VERSION = 'admin:phones_version'
+
+
+def is_admin_phone(user_phone, user_country='US'):
+    """
+    Takes a phone number in any format, checks it against the admin users' national numbers
+    """
+    if not user_phone:
+        return False
+    try:
+        national_number = str(phonenumbers.parse(user_phone, user_country).national_number)
+    except phonenumbers.NumberParseException:
+        return False
+    return national_number in admin_phones()
+
+
+def admin_phones():
+    """
+    Set of admin users' national numbers, cached in this process to avoid a db hit for each call
+    Loaded on first use instead of at startup, and reloaded every ADMIN_PHONES_TTL seconds
+    or when the version in the shared cache changes
+    """
+    app = current_app._get_current_object()
+    loaded_at = getattr(app, 'ADMIN_PHONES_LOADED_AT', None)
+    version = cache.get(KEY_ADMIN_PHONES_VERSION)
+    if (loaded_at is None or time.time() - loaded_at > app.config.get('ADMIN_PHONES_TTL', 300)
+            or version != getattr(app, 'ADMIN_PHONES_VERSION', None)):
+        try:
+            app.ADMIN_PHONES_LIST = set(str(phone.national_number)
+                for (phone,) in db.session.query(User.phone).filter(User.phone != None))
+        except sqlalchemy.exc.SQLAlchemyError:
+            # this may throw an error when creating the database from scratch
+            app.ADMIN_PHONES_LIST = getattr(app, 'ADMIN_PHONES_LIST', set())
+        app.ADMIN_PHONES_LOADED_AT = time.time()
+        app.ADMIN_PHONES_VERSION = version
+    return app.ADMIN_PHONES_LIST
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    object_session(target).info['admin_phones_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _update_admin_phones_version(session):
+    # only once the change is visible to other processes
+    if session.info.pop('admin_phones_changed', False) and has_app_context():
+        cache.set(KEY_ADMIN_PHONES_VERSION, uuid.uuid4().hex, timeout=0)
+
 
 class Blocklist(db.Model):
     # stops
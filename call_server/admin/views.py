@@ -1,21 +1,23 @@
 from datetime import datetime, timedelta
 
-from flask import Blueprint, render_template, current_app, flash, url_for, redirect, request, session
+from flask import Blueprint, render_template, current_app, flash, url_for, redirect, request, session, jsonify
 from flask_login import login_required, current_user
 from flask_babel import gettext as _
 
 from ..extensions import db, cache
-from sqlalchemy.sql import func, desc
+from sqlalchemy.sql import desc
 
-from .models import Blocklist
+from .models import Blocklist, is_admin_phone
 from .forms import BlocklistForm
+from .jobs import get_dashboard_metrics
 
 from ..campaign.models import TwilioPhoneNumber, Campaign
-from ..call.models import Call
 from ..sync.models import SyncCampaign
+from ..sync.metrics import get_sync_metrics
 from ..campaign.constants import STATUS_PAUSED
 from ..api.constants import API_TIMESPANS
 from ..utils import get_one_or_create
+from .. import caching, instrumentation
 from ..user.models import User
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
@@ -35,48 +37,16 @@ def dashboard():
         .filter(Campaign.status_code >= STATUS_PAUSED)
         .order_by(desc(Campaign.status_code), desc(Campaign.id))
     )
-    calls_by_campaign = (db.session.query(Campaign.id, func.count(Call.id))
-            .filter(Campaign.status_code >= STATUS_PAUSED)
-            .filter(Call.status == 'completed')
-            .join(Call).group_by(Campaign.id))
-
-    today = datetime.today().replace(hour=0, minute=0, second=0)
-    this_month_start = today.replace(day=1)  # first day of the current month
-    last_month = this_month_start - timedelta(days=28) # a day in last month
-    next_month = today.replace(day=28) + timedelta(days=4)  # a day in next month (for months with 28,29,30,31)
-
-    this_month_end = next_month - timedelta(days=next_month.day)  # the last day of the current month
-    this_month_end = this_month_end.replace(hour=23, minute=59)
-    last_month_start = last_month - timedelta(days=(last_month.day-1))
-    last_month_end = this_month_start - timedelta(days=this_month_start.day)
-    last_month_end = last_month_end.replace(hour=23, minute=59)
-
-    calls_this_month = (db.session.query(func.count(Call.id))
-            .filter(Call.status == 'completed')
-            .filter(Call.timestamp >= this_month_start)
-            .filter(Call.timestamp <= this_month_end)
-        ).scalar()
-
-    calls_last_month = (db.session.query(func.count(Call.id))
-            .filter(Call.status == 'completed')
-            .filter(Call.timestamp >= last_month_start)
-            .filter(Call.timestamp <= last_month_end)
-        ).scalar()
-
-    calls_by_day = (db.session.query(func.date(Call.timestamp), func.count(Call.id))
-            .filter(Call.status == 'completed')
-            .filter(Call.timestamp >= this_month_start)
-            .filter(Call.timestamp <= this_month_end)
-            .group_by(func.date(Call.timestamp))
-            .order_by(func.date(Call.timestamp))
-        )
+    # aggregate call counts are materialized by the refresh_dashboard_metrics job
+    metrics = get_dashboard_metrics()
 
     return render_template('admin/dashboard.html',
         campaigns=campaigns,
-        calls_by_campaign=dict(calls_by_campaign.all()),
-        calls_by_day=calls_by_day.all(),
-        calls_this_month=calls_this_month,
-        calls_last_month=calls_last_month,
+        calls_by_campaign=metrics['calls_by_campaign'],
+        calls_by_day=metrics['calls_by_day'],
+        calls_this_month=metrics['calls_this_month'],
+        calls_last_month=metrics['calls_last_month'],
+        metrics_computed_at=metrics['computed_at'],
     )
 
 
@@ -103,6 +73,8 @@ def system():
     admin_api_key = current_app.config.get('ADMIN_API_KEY')
     twilio_account = current_app.config.get('TWILIO_CLIENT').auth[0]
     crm_sync_campaigns = SyncCampaign.query.all()
+    crm_sync_metrics = dict((c.campaign_id, (get_sync_metrics(c.campaign_id) or [None])[0])
+                            for c in crm_sync_campaigns)
 
     political_data_cache = {'US': cache.get('political_data:us'),
                             'CA': cache.get('political_data:ca')}
@@ -115,10 +87,28 @@ def system():
                            twilio_account=twilio_account,
                            admin_api_key=admin_api_key,
                            crm_sync_campaigns=crm_sync_campaigns,
+                           crm_sync_metrics=crm_sync_metrics,
                            political_data_cache=political_data_cache,
                            blocked=blocked)
 
 
+@admin.route('/system/dial_queue.json')
+def dial_queue_metrics():
+    # imported here, because call.views imports admin_phone from this module
+    from ..call.dial_queue import dial_queue
+    return jsonify(dial_queue.metrics())
+
+
+@admin.route('/system/cache.json')
+def cache_metrics():
+    return jsonify(caching.metrics())
+
+
+@admin.route('/metrics')
+def request_metrics():
+    return jsonify(instrumentation.metrics.summary())
+
+
 @admin.route('/system/blocklist/create', methods=['GET', 'POST'])
 @admin.route('/system/blocklist/<int:blocklist_id>/edit', methods=['GET', 'POST'])
 def blocklist(blocklist_id=None):
@@ -152,8 +142,7 @@ def admin_phone():
         return True
 
     # if calling from embedded website, check list of admin users
-    phone = request.values.get('userPhone')
-    return phone in current_app.ADMIN_PHONES_LIST
+    return is_admin_phone(request.values.get('userPhone'), request.values.get('userCountry', 'US'))
 
 @admin.route('/twilio/resync', methods=['POST'])
 def twilio_resync():
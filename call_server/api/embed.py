@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from hashlib import sha1
+
+from flask import current_app, render_template, url_for, request, Response, abort, has_app_context
+from flask_caching.backends import SimpleCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ..extensions import cache
+from ..caching import single_flight, record
+from ..campaign.models import Campaign
+
+# rendered embed assets for a campaign, kept until the campaign is saved again
+KEY_EMBED = 'embed:{campaign_id}:{name}'
+
+# template and content type for each asset, rendered in this order
+# so the iframe can link to the current version of embed.js
+EMBED_ASSETS = OrderedDict([
+    ('CallPowerForm.js', ('api/CallPowerForm.js', 'application/javascript')),
+    ('embed.js', ('api/embed.js', 'application/javascript')),
+    ('embed_iframe.html', ('api/embed_iframe.html', 'text/html; charset=utf-8')),
+])
+# assets served from versioned urls, the html is always fetched from its stable url
+VERSIONED_ASSETS = ('CallPowerForm.js', 'embed.js')
+
+IMMUTABLE_MAX_AGE = 60*60*24*365
+
+
+def embed_cache_timeout():
+    if isinstance(getattr(cache, 'cache', None), SimpleCache):
+        return current_app.config.get('EMBED_LOCAL_CACHE_TIMEOUT', 600)
+    return current_app.config.get('EMBED_CACHE_TIMEOUT')
+
+
+def render_embed(campaign, name):
+    """Render an embed asset for campaign, and save it to the cache with its content hash"""
+    (template, content_type) = EMBED_ASSETS[name]
+    body = render_template(template, campaign=campaign, embed_url=embed_url,
+        DSN_PUBLIC_KEY=current_app.config.get('SENTRY_DSN_PUBLIC_KEY', ''))
+    asset = {
+        'body': body,
+        'etag': sha1(body.encode('utf-8')).hexdigest()[:20],
+        'content_type': content_type,
+    }
+    cache.set(KEY_EMBED.format(campaign_id=campaign.id, name=name), asset, timeout=embed_cache_timeout())
+    return asset
+
+
+def render_embeds(campaign):
+    """Render all of a campaign's embed assets into the cache, when it is saved"""
+    return dict((name, render_embed(campaign, name)) for name in EMBED_ASSETS)
+
+
+def clear_embeds(campaign_id):
+    # one at a time, some backends' delete_many stop at the first missing key
+    for name in EMBED_ASSETS:
+        cache.delete(KEY_EMBED.format(campaign_id=campaign_id, name=name))
+
+
+def get_embed(campaign_id, name, campaign=None):
+    """Rendered asset from the cache, or rendered now by one thread, without a database query on a hit"""
+    key = KEY_EMBED.format(campaign_id=campaign_id, name=name)
+    asset = cache.get(key)
+    if asset is not None:
+        record('embed', 'hit')
+        return asset
+
+    record('embed', 'miss')
+    # before taking the lock, so requests for unknown campaigns 404 at once instead of waiting on each other
+    if campaign is None:
+        campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
+    return single_flight(key, lambda: render_embed(campaign, name), name='embed')
+
+
+def embed_url(campaign, name, _external=True):
+    """Versioned url for an embed asset, which can be cached forever"""
+    version = get_embed(campaign.id, name, campaign)['etag']
+    return url_for('api.campaign_embed_versioned', campaign_id=campaign.id, version=version, name=name,
+                   _external=_external)
+
+
+def embed_response(asset, max_age=None, immutable=False):
+    """Response for an asset, with its ETag and cache headers, or 304 if the client has it already"""
+    response = Response(asset['body'], content_type=asset['content_type'])
+    response.set_etag(asset['etag'])
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age or current_app.config.get('EMBED_MAX_AGE', 300)
+    return response.make_conditional(request)
+
+
+def serve_embed(campaign_id, name, version=None):
+    if name not in EMBED_ASSETS:
+        abort(404)
+    asset = get_embed(campaign_id, name)
+    # an old version gets the current asset, but only cached briefly
+    return embed_response(asset, immutable=(version is not None and version == asset['etag']))
+
+
+@event.listens_for(Campaign, 'after_insert')
+@event.listens_for(Campaign, 'after_update')
+@event.listens_for(Campaign, 'after_delete')
+def _campaign_changed(mapper, connection, target):
+    object_session(target).info.setdefault('embed_campaign_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_changed_embeds(session):
+    campaign_ids = session.info.pop('embed_campaign_ids', None)
+    if campaign_ids and has_app_context():
+        for campaign_id in campaign_ids:
+            clear_embeds(campaign_id)
@@ -11,8 +11,11 @@ from flask_talisman import ALLOW_FROM
 
 from .decorators import api_key_or_auth_required, admin_user_required, restless_api_auth
 from .constants import API_TIMESPANS
+from .embed import serve_embed, VERSIONED_ASSETS
 
-from ..extensions import csrf, cors, rest, db, cache, talisman, CALLPOWER_CSP
+from ..extensions import csrf, cors, rest, db, talisman, CALLPOWER_CSP
+from ..caching import cached
+from ..instrumentation import metrics as request_metrics, pool_status
 from ..campaign.models import Campaign, Target, AudioRecording
 from ..political_data.adapters import adapt_by_key, UnitedStatesData
 from ..call.models import Call, Session
@@ -321,12 +324,19 @@ def campaign_target_calls(campaign_id):
     targets = defaultdict(dict)
     political_data = campaign.get_campaign_data().data_provider
 
-    for (target_title, target_name, target_uid) in query_call_targets:
-        # get more target_data from political_data cache
+    call_targets = query_call_targets.all()
+    # get more target_data from political_data cache, in a single round trip
+    try:
+        cached_targets = political_data.cache_get_many([target_uid for (_, _, target_uid) in call_targets])
+    except Exception as e:
+        current_app.logger.error('unable to cache_get_many for campaign %s: %s' % (campaign.id, e))
+        cached_targets = [None] * len(call_targets)
+
+    for ((target_title, target_name, target_uid), cached_data) in zip(call_targets, cached_targets):
         try:
-            target_data = political_data.cache_get(target_uid)[0]
+            target_data = cached_data[0]
         except (KeyError,IndexError):
-            target_data = political_data.cache_get(target_uid)
+            target_data = cached_data
         except Exception as e:
             current_app.logger.error('unable to cache_get for %s: %s' % (target_uid, e))
             target_data = None
@@ -485,32 +495,30 @@ def call_info(sid):
 
 
 # embed js campaign routes, should be public
-# make accessible crossdomain, and cache for 10 min
+# make accessible crossdomain, rendered on save and served with ETags
+# stable urls are cached for EMBED_MAX_AGE, versioned urls forever
 @api.route('/campaign/<int:campaign_id>/embed.js', methods=['GET'])
-@cache.cached(timeout=600)
 def campaign_embed_js(campaign_id):
-    campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
-    dsn_public_key = current_app.config.get('SENTRY_DSN_PUBLIC_KEY', '')
-    return Response(render_template('api/embed.js',
-        campaign=campaign, DSN_PUBLIC_KEY=dsn_public_key
-    ), content_type='application/javascript')
+    return serve_embed(campaign_id, 'embed.js')
 
 
 @api.route('/campaign/<int:campaign_id>/CallPowerForm.js', methods=['GET'])
 @talisman(content_security_policy=CALLPOWER_CSP.copy().update({'script-src':['\'self\'', '\'unsafe-eval\'']}))
 # add unsafe-eval, to execute campaign.embed.custom_js
-@cache.cached(timeout=600)
 def campaign_form_js(campaign_id):
-    campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
-    return Response(render_template('api/CallPowerForm.js', campaign=campaign), content_type='application/javascript')
+    return serve_embed(campaign_id, 'CallPowerForm.js')
 
 
 @api.route('/campaign/<int:campaign_id>/embed_iframe.html', methods=['GET'])
-@cache.cached(timeout=600)
 @talisman(frame_options=None) # allow iframe'ing on this route only
 def campaign_embed_iframe(campaign_id):
-    campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
-    return render_template('api/embed_iframe.html', campaign=campaign)
+    return serve_embed(campaign_id, 'embed_iframe.html')
+
+
+@api.route('/campaign/<int:campaign_id>/v/<version>/<any(%s):name>' % ', '.join(VERSIONED_ASSETS), methods=['GET'])
+@talisman(content_security_policy=CALLPOWER_CSP.copy().update({'script-src':['\'self\'', '\'unsafe-eval\'']}))
+def campaign_embed_versioned(campaign_id, version, name):
+    return serve_embed(campaign_id, name, version)
 
 
 @api.route('/campaign/<int:campaign_id>/embed_code.html', methods=['GET'])
@@ -538,8 +546,13 @@ def campaign_embed_code(campaign_id):
 # simple call count per campaign as json
 # make accessible crossdomain, and cache for 10 min
 @api.route('/campaign/<int:campaign_id>/count.json', methods=['GET'])
-@cache.cached(timeout=600)
 def campaign_count(campaign_id):
+    return jsonify(campaign_counts(campaign_id=campaign_id))
+
+
+# recomputed by one thread at a time, so a popular campaign page doesn't stampede the database on expiry
+@cached(timeout=600, key='campaign_count:{campaign_id}')
+def campaign_counts(campaign_id):
     campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
 
     # number of calls completed in campaign
@@ -561,12 +574,18 @@ def campaign_count(campaign_id):
     ).group_by(Session.referral_code)\
     .having(func.count(Call.id) > 2)
 
-    return jsonify({
+    return {
         'completed': calls_completed.scalar(),
         'last_24h': calls_completed.filter(Call.timestamp >= datetime.now() - timedelta(hours=24)).scalar(),
         'last_week': calls_completed.filter(Call.timestamp >= datetime.now() - timedelta(days=7)).scalar(),
         'referral_codes': dict(referrers)
-    })
+    }
+
+# request latency histograms and database pool use in prometheus text format, for scrapers with the admin api key
+@api.route('/metrics', methods=['GET'])
+@api_key_or_auth_required
+def prometheus_metrics():
+    return Response(request_metrics.prometheus(pool=pool_status(db.engine)), content_type='text/plain; version=0.0.4')
 
 # route for twilio to get twiml response
 # must be publicly accessible to post
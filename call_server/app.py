@@ -8,13 +8,12 @@ except ImportError:
 
 from flask import Flask, g, request, session, render_template
 from flask_assets import Bundle
-import sqlalchemy
 
-from .utils import json_markup, OrderedDictYAMLLoader
-import yaml
+from .utils import json_markup, load_instance_yaml
 from datetime import datetime
 
 from .config import DefaultConfig
+from .instrumentation import init_instrumentation
 from .site import site
 from .admin import admin
 from .sync import sync
@@ -71,6 +70,7 @@ def create_app(configuration=None, app_name=None, blueprints=None):
 
     # init extensions once we have app context
     init_extensions(app)
+    init_instrumentation(app)
     # then blueprints, for url/view routing
     register_blueprints(app, blueprints)
 
@@ -153,18 +153,11 @@ def init_extensions(app):
     for handler in app.logger.handlers:
         limiter.logger.addHandler(handler)
 
-    # stable list of admin phone numbers, cached in memory to avoid db hit for each call
+    # admin phone numbers are loaded on first use, see admin.models.admin_phones
     # disable in testing
     if app.config.get('TESTING', False):
-        app.ADMIN_PHONES_LIST = []
-    else:
-        try:
-            app.ADMIN_PHONES_LIST = filter(bool, 
-                [str(u.phone.national_number) if u.phone else None for u in User.query.all()]
-            )
-        except sqlalchemy.exc.SQLAlchemyError:
-            # this may throw an error when creating the database from scratch
-            pass
+        app.ADMIN_PHONES_LIST = set()
+        app.ADMIN_PHONES_LOADED_AT = float('inf')
 
     if app.config.get('DEBUG'):
         from flask_debugtoolbar import DebugToolbarExtension
@@ -295,10 +288,8 @@ def context_processors(app):
 
 
 def instance_defaults(app):
-    with app.open_instance_resource('campaign_field_descriptions.yaml') as f:
-        app.config.CAMPAIGN_FIELD_DESCRIPTIONS = yaml.load(f.read(), Loader=OrderedDictYAMLLoader)
-    with app.open_instance_resource('campaign_msg_defaults.yaml') as f:
-        app.config.CAMPAIGN_MESSAGE_DEFAULTS = yaml.load(f.read(), Loader=OrderedDictYAMLLoader)
+    app.config.CAMPAIGN_FIELD_DESCRIPTIONS = load_instance_yaml(app, 'campaign_field_descriptions.yaml')
+    app.config.CAMPAIGN_MESSAGE_DEFAULTS = load_instance_yaml(app, 'campaign_msg_defaults.yaml')
 
 
 def configure_logging(app):
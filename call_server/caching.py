@@ -0,0 +1,178 @@
+# Stampede-safe caching for public endpoints, where many threads can miss the same key at once
+from flask import current_app
+from flask_caching.backends.rediscache import RedisCache
+from functools import wraps
+import random
+import threading
+import time
+import uuid
+
+from .extensions import cache
+
+# value and soft expiry time for a cached function, kept past expiry to serve while it is recomputed
+KEY_CACHED = 'cached:{key}'
+# held by the one thread recomputing a key
+KEY_LOCK = 'cached:lock:{key}'
+# counts by cache name
+KEY_METRIC = 'cached:metrics:{name}:{metric}'
+METRICS = ('hit', 'miss', 'stale', 'wait')
+
+# names that have recorded metrics in this process
+_metric_names = set()
+
+
+def _redis_backend():
+    backend = getattr(cache, 'cache', None)
+    if isinstance(backend, RedisCache):
+        return backend
+    return None
+
+
+def _lock_timeout():
+    return current_app.config.get('CACHE_LOCK_TIMEOUT', 30)
+
+
+def record(name, metric):
+    """Count a hit, miss, stale or wait for the cache called name"""
+    _metric_names.add(name)
+    # counters go straight to the backend, Cache doesn't proxy inc
+    backend = getattr(cache, 'cache', cache)
+    backend.inc(KEY_METRIC.format(name=name, metric=metric))
+
+
+def metrics():
+    """Counts since the counters started, and hit ratio, by cache name"""
+    result = {}
+    for name in sorted(_metric_names):
+        counts = dict((metric, cache.get(KEY_METRIC.format(name=name, metric=metric)) or 0)
+                      for metric in METRICS)
+        lookups = counts['hit'] + counts['miss'] + counts['stale']
+        counts['hit_ratio'] = (float(counts['hit'] + counts['stale']) / lookups) if lookups else 0
+        result[name] = counts
+    return result
+
+
+def acquire_lock(key, timeout):
+    """Take the recompute lock for key, returns a token to release it with, or None if another thread has it"""
+    token = uuid.uuid4().hex
+    lock_key = KEY_LOCK.format(key=key)
+    redis_backend = _redis_backend()
+    if redis_backend:
+        taken = redis_backend._write_client.set(redis_backend.key_prefix + lock_key, token, nx=True, ex=timeout)
+    else:
+        taken = cache.add(lock_key, token, timeout=timeout)
+    return token if taken else None
+
+
+def release_lock(key, token):
+    # only release our own lock, it may have timed out and been taken by another thread
+    lock_key = KEY_LOCK.format(key=key)
+    redis_backend = _redis_backend()
+    if redis_backend:
+        redis_key = redis_backend.key_prefix + lock_key
+        if (redis_backend._write_client.get(redis_key) or b'').decode('utf-8') == token:
+            redis_backend._write_client.delete(redis_key)
+    elif cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def single_flight(key, compute, load=None, wait=None, name=None):
+    """
+    Run compute(), which saves its value to the cache, in one thread at a time for key
+    Other threads poll load() for up to `wait` seconds for the value to appear, then compute it themselves
+    """
+    if load is None:
+        load = lambda: cache.get(key)
+    if wait is None:
+        wait = current_app.config.get('CACHE_LOCK_WAIT', 5)
+
+    token = acquire_lock(key, _lock_timeout())
+    if token:
+        try:
+            return compute()
+        finally:
+            release_lock(key, token)
+
+    if name:
+        record(name, 'wait')
+    waited = 0
+    while waited < wait:
+        time.sleep(0.05)
+        waited += 0.05
+        value = load()
+        if value is not None:
+            return value
+    return compute()
+
+
+def jittered(timeout):
+    """timeout moved randomly by up to CACHE_TTL_JITTER of itself"""
+    jitter = current_app.config.get('CACHE_TTL_JITTER', 0.1)
+    return timeout * (1 + random.uniform(-jitter, jitter))
+
+
+def cached(timeout, key, stale_timeout=None, name=None):
+    """
+    Cache a function's return value for about `timeout` seconds, recomputed by one thread at a time
+
+    key is formatted with the function's keyword arguments, like 'campaign_count:{campaign_id}'.
+    Expiry is jittered by CACHE_TTL_JITTER, so keys cached together don't all expire together.
+    An expired value is served for up to stale_timeout more seconds while one thread refreshes it,
+    in the background unless CACHE_REFRESH_IN_BACKGROUND is off.
+    On a miss one thread computes the value while the others wait for it.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    def decorator(func):
+        metric_name = name or func.__name__
+
+        def refresh(cache_key, args, kwargs):
+            value = func(*args, **kwargs)
+            cache.set(KEY_CACHED.format(key=cache_key), (value, time.time() + jittered(timeout)),
+                      timeout=int(timeout + stale_timeout))
+            return value
+
+        def refresh_in_background(cache_key, token, args, kwargs):
+            app = current_app._get_current_object()
+
+            def run():
+                with app.app_context():
+                    try:
+                        refresh(cache_key, args, kwargs)
+                    except Exception:
+                        app.logger.exception('unable to refresh cached %s' % cache_key)
+                    finally:
+                        release_lock(cache_key, token)
+
+            if app.config.get('CACHE_REFRESH_IN_BACKGROUND', True):
+                threading.Thread(target=run, name='cached:%s' % cache_key, daemon=True).start()
+            else:
+                run()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key.format(**kwargs)
+            entry = cache.get(KEY_CACHED.format(key=cache_key))
+            if entry is not None:
+                (value, expires) = entry
+                if time.time() < expires:
+                    record(metric_name, 'hit')
+                    return value
+                record(metric_name, 'stale')
+                token = acquire_lock(cache_key, _lock_timeout())
+                if token:
+                    refresh_in_background(cache_key, token, args, kwargs)
+                return value
+
+            record(metric_name, 'miss')
+
+            def load():
+                entry = cache.get(KEY_CACHED.format(key=cache_key))
+                return entry[0] if entry is not None else None
+            return single_flight(cache_key, lambda: refresh(cache_key, args, kwargs), load, name=metric_name)
+
+        wrapper.uncached = func
+        wrapper.clear = lambda **kwargs: cache.delete(KEY_CACHED.format(key=key.format(**kwargs)))
+        return wrapper
+    return decorator
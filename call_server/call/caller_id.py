@@ -0,0 +1,97 @@
+from flask import current_app
+from flask_caching.backends.rediscache import RedisCache
+import random
+import threading
+import time
+
+from ..extensions import cache
+
+# sorted set of session ids dialing from a number, scored by when they were dialed
+KEY_IN_FLIGHT = 'caller_id:in_flight:{number}'
+
+# twilio call statuses that end a call, and free its number
+FINAL_STATUSES = ('completed', 'busy', 'failed', 'no-answer', 'canceled')
+
+
+class CallerIdAllocator(object):
+    """
+    Orders a campaign's outbound numbers least loaded first, by the calls in flight from each
+
+    In-flight calls are kept in redis when it is the cache backend, so web and worker dynos see the same load,
+    otherwise in this process. Calls whose final status callback never arrives age out after TWILIO_TIME_LIMIT.
+    """
+    # local in-flight calls, for non-redis caches
+    _local_in_flight = {}
+    _local_lock = threading.Lock()
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    @property
+    def _redis_backend(self):
+        backend = getattr(self._cache, 'cache', None)
+        if isinstance(backend, RedisCache):
+            return backend
+        return None
+
+    def _max_age(self):
+        return int(current_app.config.get('TWILIO_TIME_LIMIT', 60*60))
+
+    def in_flight(self, numbers):
+        """Count of calls in flight from each number"""
+        now = time.time()
+        oldest = now - self._max_age()
+        redis_backend = self._redis_backend
+        if redis_backend:
+            pipe = redis_backend._write_client.pipeline()
+            for number in numbers:
+                key = redis_backend.key_prefix + KEY_IN_FLIGHT.format(number=number)
+                pipe.zremrangebyscore(key, '-inf', oldest)
+                pipe.zcard(key)
+            counts = pipe.execute()[1::2]
+            return dict(zip(numbers, counts))
+
+        with self._local_lock:
+            counts = {}
+            for number in numbers:
+                calls = self._local_in_flight.get(number, {})
+                for (session_id, started) in list(calls.items()):
+                    if started <= oldest:
+                        del calls[session_id]
+                counts[number] = len(calls)
+            return counts
+
+    def by_load(self, numbers):
+        """Numbers ordered by calls in flight, ties in random order"""
+        numbers = list(numbers)
+        random.shuffle(numbers)
+        counts = self.in_flight(numbers)
+        return sorted(numbers, key=lambda number: counts[number])
+
+    def start(self, number, session_id):
+        now = time.time()
+        redis_backend = self._redis_backend
+        if redis_backend:
+            key = redis_backend.key_prefix + KEY_IN_FLIGHT.format(number=number)
+            pipe = redis_backend._write_client.pipeline()
+            pipe.zadd(key, {session_id: now})
+            pipe.expire(key, self._max_age())
+            pipe.execute()
+            return
+
+        with self._local_lock:
+            self._local_in_flight.setdefault(number, {})[session_id] = now
+
+    def finish(self, number, session_id):
+        if not number:
+            return
+        redis_backend = self._redis_backend
+        if redis_backend:
+            redis_backend._write_client.zrem(redis_backend.key_prefix + KEY_IN_FLIGHT.format(number=number), session_id)
+            return
+
+        with self._local_lock:
+            self._local_in_flight.get(number, {}).pop(session_id, None)
+
+
+caller_ids = CallerIdAllocator(cache)
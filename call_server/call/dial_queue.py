@@ -0,0 +1,188 @@
+from flask import current_app
+from flask_caching.backends.rediscache import RedisCache
+import threading
+import time
+
+from ..extensions import cache
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_SCHEDULED = 'scheduled'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_SCHEDULED)
+
+KEY_BUCKET = 'dial_queue:bucket:{name}'
+KEY_DEPTH = 'dial_queue:depth:{priority}'
+KEY_DIALED = 'dial_queue:dialed:{priority}'
+KEY_DELAYED = 'dial_queue:delayed:{priority}'
+KEY_WAIT_MS = 'dial_queue:wait_ms:{priority}'
+KEY_TIMEOUTS = 'dial_queue:timeouts:{priority}'
+
+# takes a token from every bucket in KEYS, or none of them
+# ARGV is now, then the tokens needed, rate and capacity for each key
+# returns the seconds to wait before trying again, as a string, "0" if the tokens were taken
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local needed = tonumber(ARGV[3*i - 1])
+    local rate = tonumber(ARGV[3*i])
+    local capacity = tonumber(ARGV[3*i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < needed then
+        wait = math.max(wait, (needed - available) / rate)
+    end
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('HMSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+        redis.call('EXPIRE', key, 60)
+    end
+end
+return tostring(wait)
+"""
+
+
+class DialQueueTimeout(Exception):
+    def __init__(self, retry_after):
+        super(DialQueueTimeout, self).__init__('dial queue wait exceeded, retry after %.1fs' % retry_after)
+        self.retry_after = retry_after
+
+
+class DialQueue(object):
+    """
+    Smooths outbound calls to Twilio's calls-per-second limits,
+    with a token bucket for the account and one for each from_number
+
+    Interactive callers can dip into DIAL_INTERACTIVE_RESERVE tokens that scheduled calls leave in each bucket,
+    so a burst of scheduled calls doesn't delay people waiting on a web page.
+    Priority is only this reserve, not an ordering: interactive callers wait at most DIAL_QUEUE_MAX_WAIT
+    in the web thread before they are asked to retry, scheduled calls wait longer in the worker.
+    Buckets are kept in redis when it is the cache backend, so they are shared by web and worker dynos,
+    otherwise in this process.
+    """
+    # local buckets, for non-redis caches
+    _local_buckets = {}
+    _local_lock = threading.Lock()
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._take_script = None
+
+    @property
+    def _redis_backend(self):
+        backend = getattr(self._cache, 'cache', None)
+        if isinstance(backend, RedisCache):
+            return backend
+        return None
+
+    def _buckets(self, from_number, priority):
+        # (key, tokens needed, rate, capacity) for each bucket a call takes from
+        reserve = current_app.config.get('DIAL_INTERACTIVE_RESERVE', 0.5)
+        needed = 1 if priority == PRIORITY_INTERACTIVE else 1 + reserve
+        buckets = []
+        for (name, rate) in [('account', current_app.config.get('TWILIO_CPS', 1)),
+                             (from_number, current_app.config.get('TWILIO_NUMBER_CPS', 1))]:
+            buckets.append((KEY_BUCKET.format(name=name), needed, float(rate), rate + reserve))
+        return buckets
+
+    def _inc(self, key, delta=1):
+        # counters go straight to the backend, Cache doesn't proxy inc
+        backend = getattr(self._cache, 'cache', self._cache)
+        backend.inc(key, delta)
+
+    def _take(self, buckets):
+        now = time.time()
+        redis_backend = self._redis_backend
+        if redis_backend:
+            if not self._take_script:
+                self._take_script = redis_backend._write_client.register_script(TAKE_SCRIPT)
+            args = [now]
+            for (key, needed, rate, capacity) in buckets:
+                args.extend([needed, rate, capacity])
+            keys = [redis_backend.key_prefix + key for (key, needed, rate, capacity) in buckets]
+            return float(self._take_script(keys=keys, args=args))
+
+        with self._local_lock:
+            wait = 0
+            tokens = []
+            for (key, needed, rate, capacity) in buckets:
+                (available, ts) = self._local_buckets.get(key, (capacity, now))
+                available = min(capacity, available + max(0, now - ts) * rate)
+                tokens.append(available)
+                if available < needed:
+                    wait = max(wait, (needed - available) / rate)
+            if wait == 0:
+                for ((key, needed, rate, capacity), available) in zip(buckets, tokens):
+                    self._local_buckets[key] = (available - 1, now)
+            return wait
+
+    def acquire(self, from_number, priority=PRIORITY_INTERACTIVE, max_wait=None):
+        """
+        Wait for a token to dial from_number, up to max_wait seconds
+        Returns the seconds waited, or raises DialQueueTimeout
+        """
+        if max_wait is None:
+            if priority == PRIORITY_INTERACTIVE:
+                max_wait = current_app.config.get('DIAL_QUEUE_MAX_WAIT', 1)
+            else:
+                max_wait = current_app.config.get('DIAL_QUEUE_MAX_WAIT_SCHEDULED', 60)
+        buckets = self._buckets(from_number, priority)
+
+        started = time.time()
+        slept = 0
+        self._inc(KEY_DEPTH.format(priority=priority))
+        try:
+            while True:
+                wait = self._take(buckets)
+                # count time slept too, so a stalled clock can't keep us waiting forever
+                waited = max(time.time() - started, slept)
+                if not wait:
+                    self._record_wait(priority, waited)
+                    return waited
+                if waited + wait > max_wait:
+                    self._inc(KEY_TIMEOUTS.format(priority=priority))
+                    raise DialQueueTimeout(wait)
+                time.sleep(wait)
+                slept += wait
+        finally:
+            self._inc(KEY_DEPTH.format(priority=priority), -1)
+
+    def acquire_any(self, from_numbers, priority=PRIORITY_INTERACTIVE, max_wait=None):
+        """
+        Take a token for the first of from_numbers that has one without waiting,
+        otherwise wait for the first number, up to max_wait seconds
+        Returns (from_number, seconds waited), or raises DialQueueTimeout
+        """
+        for from_number in from_numbers:
+            if not self._take(self._buckets(from_number, priority)):
+                self._record_wait(priority, 0)
+                return (from_number, 0)
+        return (from_numbers[0], self.acquire(from_numbers[0], priority, max_wait))
+
+    def _record_wait(self, priority, waited):
+        self._inc(KEY_DIALED.format(priority=priority))
+        if waited >= 0.001:
+            self._inc(KEY_DELAYED.format(priority=priority))
+            self._inc(KEY_WAIT_MS.format(priority=priority), int(waited * 1000))
+
+    def metrics(self):
+        """Current queue depth, and wait times since the counters started, by priority"""
+        metrics = {}
+        for priority in PRIORITIES:
+            (depth, dialed, delayed, wait_ms, timeouts) = [self._cache.get(key.format(priority=priority)) or 0
+                for key in (KEY_DEPTH, KEY_DIALED, KEY_DELAYED, KEY_WAIT_MS, KEY_TIMEOUTS)]
+            metrics[priority] = {
+                'depth': depth,
+                'dialed': dialed,
+                'delayed': delayed,
+                'timeouts': timeouts,
+                'mean_wait': (wait_ms / 1000.0 / dialed) if dialed else 0,
+            }
+        return metrics
+
+
+dial_queue = DialQueue(cache)
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from flask import current_app
+
+from ..extensions import rq
+from ..campaign.models import Campaign
+
+from .service import place_call, CallError, CallDeferred
+
+
+@rq.job(timeout=10*60)
+def place_deferred_call(campaign_id, params, referral_code=None, record=False, rate_limit_exempt=False):
+    """
+    Places a call from /call/create that the dial queue deferred
+    Waits its turn in the worker for up to DIAL_QUEUE_MAX_WAIT_SCHEDULED, keeping the interactive reserve,
+    and puts itself back for later if the queue is still too long
+    Returns the call status, or None if it was deferred again or couldn't be placed
+    """
+    campaign = Campaign.query.get(campaign_id)
+    if not campaign:
+        current_app.logger.error('unable to place deferred call, campaign %s not found' % campaign_id)
+        return None
+
+    try:
+        placed = place_call(campaign, params,
+            referral_code=referral_code,
+            record=record,
+            rate_limit_exempt=rate_limit_exempt,
+            max_wait=current_app.config.get('DIAL_QUEUE_MAX_WAIT_SCHEDULED', 60))
+    except CallDeferred as e:
+        current_app.logger.info('deferring call for campaign %s for %.1fs' % (campaign_id, e.retry_after))
+        place_deferred_call.schedule(timedelta(seconds=e.retry_after), campaign_id, params,
+            referral_code=referral_code, record=record, rate_limit_exempt=rate_limit_exempt)
+        return None
+    except CallError as e:
+        current_app.logger.error('unable to place deferred call for campaign %s: %s' % (campaign_id, e.message))
+        return None
+    return placed.status
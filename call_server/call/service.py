@@ -0,0 +1,214 @@
+import random
+
+from flask import current_app, url_for
+from limits import parse_many
+from sqlalchemy_utils.types.phone_number import PhoneNumber, phonenumbers
+from twilio.base.exceptions import TwilioRestException
+
+from ..extensions import db, limiter
+from ..campaign.constants import SEGMENT_BY_CUSTOM
+from ..admin.models import Blocklist
+
+from .models import Session
+from .decorators import stripANSI
+from .dial_queue import dial_queue, DialQueueTimeout, PRIORITY_INTERACTIVE
+from .caller_id import caller_ids
+
+# shared by /call/create and scheduled calls, so both count against the same limit for a phone
+RATE_LIMIT_SCOPE = 'call.create'
+
+
+class CallError(Exception):
+    """Raised when a call can't be placed, with the status for /call/create to return"""
+    status_code = 400
+
+    def __init__(self, message, status_code=None):
+        super(CallError, self).__init__(message)
+        self.message = message
+        if status_code:
+            self.status_code = status_code
+
+
+class CallBlocked(CallError):
+    status_code = 429
+
+
+class CallRateLimited(CallError):
+    status_code = 429
+
+
+class CallDeferred(CallError):
+    """The dial queue is too long right now, try again after retry_after seconds
+    targets are those selected for the caller, to show while they wait"""
+    status_code = 503
+
+    def __init__(self, message, retry_after, targets=None):
+        super(CallDeferred, self).__init__(message)
+        self.retry_after = retry_after
+        self.targets = targets
+
+
+class PlacedCall(object):
+    def __init__(self, session, twilio_call, from_number, targets):
+        self.session = session
+        self.twilio_call = twilio_call
+        self.from_number = from_number
+        self.targets = targets
+
+    @property
+    def status(self):
+        return self.twilio_call.status
+
+
+def call_params(campaign, user_phone, user_country='US', user_location=None, **kwargs):
+    """Build the params dict parse_params would return for a request to /call/create"""
+    params = {
+        'campaignId': str(campaign.id),
+        'scheduled': None,
+        'scheduleSkip': None,
+        'sessionId': None,
+        'targetIds': [],
+        'userPhone': user_phone,
+        'userCountry': user_country.upper(),
+        'userLocation': user_location,
+        'userIPAddress': None
+    }
+    params.update(kwargs)
+    return params
+
+
+def _rate_limit_key(user_phone):
+    key = [user_phone, RATE_LIMIT_SCOPE]
+    if current_app.config.get('RATELIMIT_KEY_PREFIX'):
+        key.insert(0, current_app.config['RATELIMIT_KEY_PREFIX'])
+    return key
+
+
+def hit_rate_limit(user_phone, count=True):
+    """Count a call to user_phone in the limiter storage
+    Raises CallRateLimited if it is over CALL_RATE_LIMIT
+    With count=False, only checks the limit without using up a hit"""
+    rate_limit = current_app.config.get('CALL_RATE_LIMIT')
+    if not (limiter.enabled and rate_limit and user_phone):
+        return
+
+    key = _rate_limit_key(user_phone)
+    for limit in parse_many(rate_limit):
+        check = limiter.limiter.hit if count else limiter.limiter.test
+        if not check(limit, *key):
+            current_app.logger.warning('ratelimit %s (%s) exceeded at %s' % (limit, user_phone, RATE_LIMIT_SCOPE))
+            raise CallRateLimited(str(limit))
+
+
+def select_targets(campaign, params):
+    """
+    Compute campaign targeting now, to return to the calling page
+    Shuffled custom targets are saved to params['targetIds'], so the order persists for this caller
+    and a deferred call placed again keeps the order it was given
+    """
+    if campaign.segment_by == SEGMENT_BY_CUSTOM:
+        targets_list = [t for t in campaign.target_set]
+        if campaign.target_ordering == 'shuffle' and params.get('targetIds'):
+            by_key = dict((t.key, t) for t in targets_list)
+            targets_list = [by_key[key] for key in params['targetIds'] if key in by_key]
+        elif campaign.target_ordering == 'shuffle':
+            # do randomization now
+            random.shuffle(targets_list)
+            # limit to maximum
+            if campaign.call_maximum:
+                targets_list = targets_list[:campaign.call_maximum]
+            params['targetIds'] = [t.key for t in targets_list]
+        return {
+            'segment': 'custom',
+            'objects': [{'name': t.name, 'title': t.title, 'phone': t.number.e164} for t in targets_list if t.number]
+        }
+    else:
+        return {
+            'segment': campaign.segment_by,
+            'display': campaign.targets_display()
+        }
+
+
+def place_call(campaign, params, referral_code=None, record=False, rate_limit_exempt=False,
+               priority=PRIORITY_INTERACTIVE, max_wait=None):
+    """
+    Places an outbound call to params['userPhone'] for campaign
+    Used directly by /call/create and by the scheduled call workers
+
+    Checks the blocklist and rate limit, takes a turn in the dial queue, starts a call session and dials the user with Twilio
+    A call deferred by the dial queue does not count against the rate limit
+    max_wait is how long to wait in the dial queue, the default for the priority if None
+    Returns a PlacedCall, or raises CallError
+    """
+    # find outgoing phone number in same country as user
+    phone_numbers = campaign.phone_numbers(params['userCountry'])
+    if not phone_numbers:
+        raise CallError("no numbers available for campaign %(campaignId)s in %(userCountry)s" % params)
+
+    # validate phonenumber for country
+    try:
+        parsed = PhoneNumber(params['userPhone'], params['userCountry'])
+        user_phone = parsed.e164
+    except phonenumbers.NumberParseException:
+        current_app.logger.error('Unable to parse %(userPhone)s for %(userCountry)s' % params)
+        # press onward, but we may not be able to actually dial
+        user_phone = params['userPhone']
+
+    if not rate_limit_exempt:
+        # only checked here, the hit is counted once the call gets through the dial queue
+        hit_rate_limit(params['userPhone'], count=False)
+
+    if Blocklist.user_blocked(params['userPhone'], params['userIPAddress'], user_country=params['userCountry']):
+        raise CallBlocked({'kthx': 'bai'})  # submission tripped blocklist
+
+    targets = select_targets(campaign, params)
+
+    # dial from the least loaded number that can take a call now,
+    # or wait our turn within the account and from_number calls per second
+    try:
+        (from_number, waited) = dial_queue.acquire_any(caller_ids.by_load(phone_numbers), priority, max_wait)
+    except DialQueueTimeout as e:
+        raise CallDeferred('too many calls right now, try again shortly', e.retry_after, targets)
+
+    if not rate_limit_exempt:
+        hit_rate_limit(params['userPhone'])
+
+    # start call session for user
+
+    call_session_data = {
+        'campaign_id': campaign.id,
+        'location': params['userLocation'],
+        'from_number': from_number,
+        'direction': 'outbound'
+    }
+    if current_app.config['LOG_PHONE_NUMBERS']:
+        call_session_data['phone_number'] = params['userPhone']
+        # user phone numbers are hashed by the init method
+        # but some installations may not want to log at all
+
+    call_session = Session(**call_session_data)
+    if referral_code:
+        call_session.referral_code = referral_code[:64]
+    db.session.add(call_session)
+    # take the id before committing, so it isn't reloaded
+    db.session.flush()
+    params['sessionId'] = call_session.id
+    db.session.commit()
+
+    caller_ids.start(from_number, params['sessionId'])
+
+    # initiate outbound call
+    try:
+        twilio_call = current_app.config['TWILIO_CLIENT'].calls.create(
+            to=user_phone,
+            from_=from_number,
+            url=url_for('call.connection', _external=True, **params),
+            timeout=current_app.config['TWILIO_TIMEOUT'],
+            status_callback=url_for("call.status_callback", _external=True, **params),
+            status_callback_event=['ringing','completed'],
+            record=record)
+    except TwilioRestException as err:
+        caller_ids.finish(from_number, params['sessionId'])
+        raise CallError(stripANSI(err.msg))
+
+    return PlacedCall(call_session, twilio_call, from_number, targets)
@@ -5,15 +5,17 @@ from sqlalchemy_utils.types.phone_number import PhoneNumber, phonenumbers
 
 from flask import abort, Blueprint, request, url_for, current_app
 from flask_jsonpify import jsonify
-from twilio.base.exceptions import TwilioRestException
 from sqlalchemy.sql import desc
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 
-from ..extensions import csrf, cors, db, limiter
+from ..extensions import csrf, cors, db
 
 from .models import Call, Session
 from .constants import TWILIO_TTS_LANGUAGES
+from .service import place_call, CallError, CallDeferred
+from .jobs import place_deferred_call
+from .caller_id import caller_ids, FINAL_STATUSES
 from ..campaign.constants import (LOCATION_POSTAL, LOCATION_DISTRICT,
     SEGMENT_BY_LOCATION, SEGMENT_BY_CUSTOM,
     TARGET_OFFICE_DISTRICT, TARGET_OFFICE_BUSY)
@@ -22,11 +24,11 @@ from ..political_data.lookup import locate_targets, validate_location
 from ..political_data.geocode import LocationError
 from ..schedule.models import ScheduleCall
 from ..schedule.views import schedule_created, schedule_deleted
-from ..admin.models import Blocklist
 from ..admin.views import admin_phone
 from ..utils import parse_target
+from ..instrumentation import timed, query_budget
 
-from .decorators import abortJSON, stripANSI
+from .decorators import abortJSON
 
 call = Blueprint('call', __name__, url_prefix='/call')
 cors(call)
@@ -36,10 +38,6 @@ call.errorhandler(400)(abortJSON)
 call.errorhandler(429)(abortJSON)
 
 
-def rate_limit_from_config():
-    return current_app.config.get("CALL_RATE_LIMIT")
-
-
 def play_or_say(r, audio, voice='alice', lang='en-US', **kwargs):
     """
     Take twilio response and play or say message from an AudioRecording
@@ -55,13 +53,15 @@ def play_or_say(r, audio, voice='alice', lang='en-US', **kwargs):
                 lang = 'en'
 
         if (hasattr(audio, 'text_to_speech') and audio.text_to_speech):
-            msg = pystache.render(audio.text_to_speech, kwargs)
+            with timed('template'):
+                msg = pystache.render(audio.text_to_speech, kwargs)
             r.say(msg, voice=voice, language=lang)
         elif (hasattr(audio, 'file_storage') and (audio.file_storage.fp is not None)):
             r.play(audio.file_url())
         elif type(audio) == str:
             try:
-                msg = pystache.render(audio, kwargs)
+                with timed('template'):
+                    msg = pystache.render(audio, kwargs)
                 r.say(msg, voice=voice, language=lang)
             except pystache.common.PystacheError:
                 current_app.logger.error('Unable to render pystache template %s' % audio)
@@ -314,11 +314,7 @@ def incoming():
 
 
 @call.route('/create', methods=call_methods)
-@limiter.limit(rate_limit_from_config,
-    key_func = lambda : request.values.get('userPhone'),
-    exempt_when=admin_phone,
-    methods=['GET', 'POST']
-)
+@query_budget(6)
 def create():
     """
     Places a phone call to a user, given a country, phone number, and campaign.
@@ -336,100 +332,40 @@ def create():
     # parse the info needed to make the call
     params, campaign = parse_params(request)
 
-    # find outgoing phone number in same country as user
-    phone_numbers = campaign.phone_numbers(params['userCountry'])
-
-    if not phone_numbers:
-        msg = "no numbers available for campaign %(campaignId)s in %(userCountry)s" % params
-        return abort(400, msg)
-
-    # validate phonenumber for country
-    try:
-        parsed = PhoneNumber(params['userPhone'], params['userCountry'])
-        userPhone = parsed.e164
-    except phonenumbers.NumberParseException:
-        current_app.logger.error('Unable to parse %(userPhone)s for %(userCountry)s' % params)
-        # press onward, but we may not be able to actually dial
-        userPhone = params['userPhone']
-
-    if Blocklist.user_blocked(params['userPhone'], params['userIPAddress'], user_country=params['userCountry']):
-        abort(429, {'kthx': 'bai'}) # submission tripped blocklist
-
     if campaign.status == 'archived':
         result = jsonify(campaign=campaign.status)
         return result
 
-    # compute campaign targeting now, to return to calling page
-    if campaign.segment_by == SEGMENT_BY_CUSTOM:
-        targets_list = [t for t in campaign.target_set]
-        if campaign.target_ordering == 'shuffle':
-            # do randomization now
-            random.shuffle(targets_list)
-            # limit to maximum
-            if campaign.call_maximum:
-                targets_list = targets_list[:campaign.call_maximum]
-            # save to params so order persists for this caller
-            params['targetIds'] = [t.key for t in targets_list]
-        target_response = {
-            'segment': 'custom',
-            'objects': [{'name': t.name, 'title': t.title, 'phone': t.number.e164} for t in targets_list if t.number]
-        }
-    else:
-        target_response = {
-            'segment': campaign.segment_by,
-            'display': campaign.targets_display()
-        }
-
-    # start call session for user
+    # rate limited per userPhone by the call service, admin phones are exempt for testing
+    call_kwargs = {
+        'referral_code': request.values.get('ref'),
+        'record': request.values.get('record', False),
+        'rate_limit_exempt': admin_phone(),
+    }
     try:
-        from_number = random.choice(phone_numbers)
-
-        call_session_data = {
-            'campaign_id': campaign.id,
-            'location': params['userLocation'],
-            'from_number': from_number,
-            'direction': 'outbound'
-        }
-        if current_app.config['LOG_PHONE_NUMBERS']:
-            call_session_data['phone_number'] = params['userPhone']
-            # user phone numbers are hashed by the init method
-            # but some installations may not want to log at all
-
-        call_session = Session(**call_session_data)
-        if 'ref' in request.values:
-            call_session.referral_code = request.values.get('ref')[:64]
-        db.session.add(call_session)
-        db.session.commit()
-
-        params['sessionId'] = call_session.id
-
-        # initiate outbound call
-        call = current_app.config['TWILIO_CLIENT'].calls.create(
-            to=userPhone,
-            from_=from_number,
-            url=url_for('call.connection', _external=True, **params),
-            timeout=current_app.config['TWILIO_TIMEOUT'],
-            status_callback=url_for("call.status_callback", _external=True, **params),
-            status_callback_event=['ringing','completed'],
-            record=request.values.get('record', False))
-
-        if campaign.embed:
-            script = campaign.embed.get('script')
-            redirect = campaign.embed.get('redirect')
-        else:
-            script = ''
-            redirect = ''
-        result = jsonify(campaign=campaign.status, call=call.status, script=script, redirect=redirect,
-            fromNumber=from_number, targets=target_response)
-        result.status_code = 200 if call.status != 'failed' else 500
-    except TwilioRestException as err:
-        twilio_error = stripANSI(err.msg)
-        abort(400, twilio_error)
-
+        placed = place_call(campaign, params, **call_kwargs)
+        (status, from_number, targets) = (placed.status, placed.from_number, placed.targets)
+    except CallDeferred as e:
+        # the dial queue is backed up, so a worker waits our turn and the caller is dialed shortly
+        place_deferred_call.queue(campaign.id, params, **call_kwargs)
+        (status, from_number, targets) = ('queued', None, e.targets)
+    except CallError as e:
+        abort(e.status_code, e.message)
+
+    if campaign.embed:
+        script = campaign.embed.get('script')
+        redirect = campaign.embed.get('redirect')
+    else:
+        script = ''
+        redirect = ''
+    result = jsonify(campaign=campaign.status, call=status, script=script, redirect=redirect,
+        fromNumber=from_number, targets=targets)
+    result.status_code = 200 if status != 'failed' else 500
     return result
 
 
 @call.route('/connection', methods=call_methods)
+@query_budget(2)
 def connection():
     """
     Call handler to connect a user with the targets for a given campaign.
@@ -533,6 +469,7 @@ def schedule_parse():
 
 
 @call.route('/make_calls', methods=call_methods)
+@query_budget(3)
 def _make_calls():
     """
     Start to make calls, scheduling daily calls if desired.
@@ -549,6 +486,7 @@ def _make_calls():
 
 
 @call.route('/make_single', methods=call_methods)
+@query_budget(3)
 def make_single():
     params, campaign = parse_params(request)
 
@@ -637,6 +575,7 @@ def make_single():
 
 
 @call.route('/complete', methods=call_methods)
+@query_budget(4)
 def complete():
     params, campaign = parse_params(request)
     i = int(request.values.get('call_index', 0))
@@ -655,12 +594,6 @@ def complete():
         'duration': request.values.get('DialCallDuration', 0)
     }
 
-    try:
-        db.session.add(Call(**call_data))
-        db.session.commit()
-    except SQLAlchemyError:
-        current_app.logger.error('Failed to log call:', exc_info=True)
-
     resp = VoiceResponse()
 
     if call_data['status'] == 'busy':
@@ -688,10 +621,18 @@ def complete():
 
         resp.redirect(url_for('call.make_single', **params))
 
+    # logged once the response is built, so the commit doesn't expire the campaign while we still need it
+    try:
+        db.session.add(Call(**call_data))
+        db.session.commit()
+    except SQLAlchemyError:
+        current_app.logger.error('Failed to log call:', exc_info=True)
+
     return str(resp)
 
 
 @call.route('/status_callback', methods=call_methods)
+@query_budget(4)
 def status_callback():
     # async callback from twilio on call events
     params, _ = parse_params(request)
@@ -707,17 +648,22 @@ def status_callback():
             'campaignId': params['campaignId']
         })
 
+    call_session = Session.query.get(params['sessionId'])
+
     if request.values.get('CallStatus') == 'ringing':
         # update call_session with time interval calculated in Twilio queue
-        call_session = Session.query.get(request.values.get('sessionId'))
         call_session.queue_delay = datetime.utcnow() - call_session.timestamp
         db.session.add(call_session)
         db.session.commit()
 
+    if request.values.get('CallStatus') in FINAL_STATUSES:
+        # free the outbound number for the allocator
+        if call_session:
+            caller_ids.finish(call_session.from_number, call_session.id)
+
     # CallDuration only present when call is complete
     # update call_session with status, duration
     if request.values.get('CallDuration'):
-        call_session = Session.query.get(request.values.get('sessionId'))
         call_session.status = request.values.get('CallStatus', 'unknown')
         call_session.duration = request.values.get('CallDuration', None)
         call_session.close()
@@ -3,7 +3,8 @@ from datetime import datetime
 from flask import current_app, url_for
 from sqlalchemy_utils.types import phone_number, JSONType
 from flask_store.sqla import FlaskStoreType
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, event
+from sqlalchemy.orm import joinedload
 
 from ..extensions import db, cache
 from ..political_data import get_country_data, check_political_data_cache
@@ -14,6 +15,8 @@ from .constants import (STRING_LEN, LONG_STRING_LEN, TWILIO_SID_LENGTH, LANGUAGE
 
 class Campaign(db.Model):
     __tablename__ = 'campaign_campaign'
+    KEY_NUMBERS_BY_REGION = 'campaign:{campaign_id}:numbers_by_region'
+    NUMBERS_BY_REGION_TIMEOUT = 60*5
 
     id = db.Column(db.Integer, primary_key=True)
     created_time = db.Column(db.DateTime, default=datetime.utcnow)
@@ -66,16 +69,24 @@ class Campaign(db.Model):
     def audio_or_default(self, key):
         """Convenience method for getting selected audio recordings for this campaign by key.
         Returns tuple (audio recording or default message, is default message) """
-        campaignAudio = self._audio_query().filter(
-            CampaignAudioRecording.recording.has(key=key)
-        ).first()
+        recording = self._selected_audio().get(key)
 
-        if campaignAudio:
-            return (campaignAudio.recording, False)
+        if recording:
+            return (recording, False)
         else:
             # if not defined by user, return default
             return (current_app.config.CAMPAIGN_MESSAGE_DEFAULTS.get(key), True)
 
+    def _selected_audio(self):
+        # all selected recordings by key, loaded in one query the first time a call flow view asks for one
+        # and kept until the campaign is expired, by a commit or refresh
+        if getattr(self, '_selected_audio_by_key', None) is None:
+            selected = {}
+            for campaign_audio in self._audio_query().options(joinedload(CampaignAudioRecording.recording)):
+                selected.setdefault(campaign_audio.recording.key, campaign_audio.recording)
+            self._selected_audio_by_key = selected
+        return self._selected_audio_by_key
+
     def audio_msgs(self):
         "Convenience method for getting all selected audio recordings for this campaign"
         table = {}
@@ -129,15 +140,30 @@ class Campaign(db.Model):
         "Display method for this campaign's special inclusion"
         return dict(INCLUDE_SPECIAL_CHOCIES).get(self.include_special, '?')
 
+    def numbers_by_region(self):
+        "Map of country calling code to this campaign's phone numbers, cached briefly so calls don't walk the set"
+        key = self.KEY_NUMBERS_BY_REGION.format(campaign_id=self.id)
+        numbers = cache.get(key)
+        if numbers is None:
+            numbers = {}
+            for n in self.phone_number_set:
+                numbers.setdefault(n.number.country_code, []).append(n.number.e164)
+            cache.set(key, numbers, timeout=self.NUMBERS_BY_REGION_TIMEOUT)
+        return numbers
+
+    def clear_numbers_by_region(self):
+        cache.delete(self.KEY_NUMBERS_BY_REGION.format(campaign_id=self.id))
+
     def phone_numbers(self, region_code=None):
         "Phone numbers for this campaign, can be limited to a specified region code (ISO-2)"
+        numbers = self.numbers_by_region()
         if region_code and not self.allow_intl_calls:
             # convert region_code to country_code for comparison
             country_code = phone_number.phonenumbers.country_code_for_region(region_code.upper())
-            return [n.number.e164 for n in self.phone_number_set if n.number.country_code == country_code]
+            return list(numbers.get(country_code, []))
         else:
             # return all numbers in set
-            return [n.number.e164 for n in self.phone_number_set]
+            return [n for country_numbers in numbers.values() for n in country_numbers]
 
     def required_fields(self):
         """API convenience method for rendering campaigns externally
@@ -194,6 +220,12 @@ class Campaign(db.Model):
         return country_data.get_campaign_type(self.campaign_type)
 
 
+@event.listens_for(Campaign, 'expire')
+@event.listens_for(Campaign, 'refresh')
+def _clear_selected_audio(target, *args):
+    target._selected_audio_by_key = None
+
+
 class CampaignTarget(db.Model):
     __tablename__ = 'campaign_target_sets'
 
@@ -236,16 +268,19 @@ class Target(db.Model):
         return self.number.e164
 
     @classmethod
-    def get_or_create(cls, uid, prefix=None, update_offices=True, commit=True, cache=cache):
+    def get_or_create(cls, uid, prefix=None, update_offices=True, commit=True, cache=cache, data=None):
         if prefix:
             key = '%s:%s' % (prefix, uid)
         else:
             key = uid
-        t = Target.query.filter(Target.key == key) \
-            .order_by(Target.id.desc()).first()
+        # offices loaded with the target, most keys match one row so there's no need for a limit
+        t = next(iter(Target.query.filter(Target.key == key).options(joinedload(Target.offices))
+                      .order_by(Target.id.desc()).all()), None)
         created = False
 
-        data = check_political_data_cache(key, cache)
+        if data is None:
+            # may be prefetched with check_political_data_cache_many
+            data = check_political_data_cache(key, cache)
         offices = data.pop('offices')
         if 'uid' in data:
             del data['uid']
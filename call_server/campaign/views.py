@@ -13,17 +13,18 @@ from sqlalchemy.orm.exc import NoResultFound
 from twilio.jwt.client import ClientCapabilityToken
 
 from ..extensions import db
-from ..political_data import COUNTRY_CHOICES
+from ..political_data import COUNTRY_CHOICES, check_political_data_cache_many
 from ..utils import choice_items, choice_keys, choice_values_flat, duplicate_object, parse_target, get_one_or_create
 
 from .constants import EMPTY_CHOICES, STATUS_LIVE
 from .models import (Campaign, Target, CampaignTarget,
                      AudioRecording, CampaignAudioRecording,
                      TwilioPhoneNumber)
-from ..call.models import Call
 from ..sync.models import SyncCampaign
 from ..sync.constants import SCHEDULE_CHOICES, SCHEDULE_HOURLY
 from ..schedule.models import ScheduleCall
+from ..admin.jobs import get_dashboard_metrics
+from ..api.embed import render_embeds
 
 
 from .forms import (CountryTypeForm, CampaignForm, CampaignAudioForm,
@@ -43,11 +44,10 @@ def before_request():
 @campaign.route('/')
 def index():
     campaigns = Campaign.query.order_by(desc(Campaign.status_code), desc(Campaign.id)).all()
-    calls = (db.session.query(Campaign.id, func.count(Call.id))
-            .filter(Call.status == 'completed')
-            .join(Call).group_by(Campaign.id))
+    metrics = get_dashboard_metrics()
     return render_template('campaign/list.html',
-        campaigns=campaigns, calls=dict(calls.all()))
+        campaigns=campaigns, calls=metrics['calls_by_campaign'],
+        metrics_computed_at=metrics['computed_at'])
 
 
 @campaign.route('/create', methods=['GET', 'POST'])
@@ -152,6 +152,8 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
 
         # handle target_set nested data
         target_list = []
+        # look up political data for all targets in a single round trip
+        target_political_data = check_political_data_cache_many([t['key'] for t in form.target_set.data])
         for index, target_data in enumerate(form.target_set.data):        
             # get key from the data fields
             target_key = target_data.pop('key')
@@ -159,7 +161,8 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
             (uid, prefix) = parse_target(target_key)
 
             # get or create Target, without commiting to session
-            (target, created) = Target.get_or_create(uid, prefix, update_offices=campaign.target_offices, commit=False)
+            (target, created) = Target.get_or_create(uid, prefix, update_offices=campaign.target_offices, commit=False,
+                data=target_political_data[index])
             # set other fields on it
             for (field, val) in target_data.items():
                 setattr(target, field, val)
@@ -184,6 +187,7 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
         setattr(campaign, 'target_set', target_list)
         db.session.add(campaign)
         db.session.commit()
+        campaign.clear_numbers_by_region()
 
         # if allow_call_in, set call_in_allowed on phone_number_set
         if campaign.allow_call_in:
@@ -193,6 +197,9 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
             db.session.commit()
         # TODO, allow_call_in on just one number?
 
+        # saving cleared the embed, render it again now so partner sites don't wait on it
+        render_embeds(campaign)
+
         if edit:
             flash('Campaign updated.', 'success')
         else:
@@ -475,6 +482,8 @@ def launch(campaign_id):
                 # don't create one...
         
         db.session.commit()
+        # render the embed now, so partner sites never wait on it
+        render_embeds(campaign)
 
         flash('Campaign launched!', 'success')
         return redirect(url_for('campaign.index'))
@@ -539,6 +548,7 @@ def status(campaign_id):
         elif campaign.status == 'archived':
             # release twilio numbers
             campaign.phone_number_set = []
+            campaign.clear_numbers_by_region()
             flash('Campaign archived. Incoming calls will not connect.', 'danger')
         else:
             flash('Campaign status updated.', 'success')
@@ -1,5 +1,41 @@
 import os
-import twilio.rest
+
+
+class LazyTwilioClient(object):
+    """
+    Builds the twilio.rest.Client on first use, so loading config doesn't import the REST stack
+    With a base_url, requests for the twilio API go there instead, like to a local fake for load tests
+    With fake, it builds a FakeTwilioClient that keeps calls in memory, to run the call flow without twilio
+    """
+    def __init__(self, account_sid, auth_token, base_url=None, fake=False):
+        self._credentials = (account_sid, auth_token)
+        self._base_url = base_url
+        self._fake = fake
+        self._client = None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self.__dict__.get('_client') is None and self._fake:
+            from .fake_twilio import FakeTwilioClient
+            self.__dict__['_client'] = FakeTwilioClient(*self._credentials)
+        elif self.__dict__.get('_client') is None:
+            import twilio.rest
+            http_client = _redirected_http_client(self._base_url) if self._base_url else None
+            self.__dict__['_client'] = twilio.rest.Client(*self._credentials, http_client=http_client)
+        return getattr(self._client, name)
+
+
+def _redirected_http_client(base_url):
+    import re
+    from twilio.http.http_client import TwilioHttpClient
+
+    class RedirectedHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            url = re.sub(r'^https://[a-z.-]+\.twilio\.com', base_url.rstrip('/'), url)
+            return super(RedirectedHttpClient, self).request(method, url, *args, **kwargs)
+    return RedirectedHttpClient()
+
 
 class DefaultConfig(object):
     PROJECT = 'CallPower'
@@ -24,6 +60,28 @@ class DefaultConfig(object):
     CACHE_TYPE = 'simple'
     CACHE_THRESHOLD = 100000  # because we're caching political data
     CACHE_DEFAULT_TIMEOUT = 60*60*24*365*2  # there's no infinite timeout, so default to 2 year election cycle
+    # embed assets are rendered when a campaign is saved, and kept until it changes in a shared cache
+    # a cache in each process can't be cleared by another worker's save, so there they expire after a while
+    EMBED_CACHE_TIMEOUT = None
+    EMBED_LOCAL_CACHE_TIMEOUT = 600
+    # seconds browsers and CDNs may cache the stable embed urls, versioned urls are cached forever
+    EMBED_MAX_AGE = int(os.environ.get('EMBED_MAX_AGE', 300))
+    # cached public endpoints: expiry jitter as a fraction of the timeout,
+    # seconds one thread may hold a recompute lock, and seconds the others wait for it
+    CACHE_TTL_JITTER = 0.1
+    CACHE_LOCK_TIMEOUT = 30
+    CACHE_LOCK_WAIT = 5
+    CACHE_REFRESH_IN_BACKGROUND = True
+
+    # per-endpoint latency histograms, at /admin/metrics and /api/metrics for prometheus
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'true').lower() != 'false'
+    # fraction of requests to run under cProfile, and seconds after which their profile is saved to PROFILE_DIR
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_REQUEST = float(os.environ.get('PROFILE_SLOW_REQUEST', 1))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # X-Query-Count and X-Query-Time response headers, and whether views going over their query_budget fail
+    QUERY_COUNT_HEADER = False
+    QUERY_BUDGETS_STRICT = False
 
     CSRF_ENABLED = False
 
@@ -33,21 +91,36 @@ class DefaultConfig(object):
     STORE_PROVIDER = 'flask_store.providers.local.LocalProvider'
     STORE_DOMAIN = 'http://localhost:5000' # requires url scheme for Flask-store.absolute_url to work
 
-    TWILIO_CLIENT = twilio.rest.Client(
+    TWILIO_CLIENT = LazyTwilioClient(
         os.environ.get('TWILIO_ACCOUNT_SID'),
-        os.environ.get('TWILIO_AUTH_TOKEN'))
+        os.environ.get('TWILIO_AUTH_TOKEN'),
+        os.environ.get('TWILIO_API_BASE_URL'),
+        fake=os.environ.get('TWILIO_FAKE', 'false').lower() == 'true')
     TWILIO_PLAYBACK_APP = os.environ.get('TWILIO_PLAYBACK_APP')
     # limit on the length of the call
     TWILIO_TIME_LIMIT = os.environ.get('TWILIO_TIME_LIMIT', 60 * 60)  # one hour max
     # limit on the amount of time to ring before giving up
     TWILIO_TIMEOUT = os.environ.get('TWILIO_TIMEOUT', 60)  # seconds
+    # outbound calls per second for the account and for each number, callers wait in the dial queue for their turn
+    TWILIO_CPS = float(os.environ.get('TWILIO_CPS', 1))
+    TWILIO_NUMBER_CPS = float(os.environ.get('TWILIO_NUMBER_CPS', 1))
+    # tokens in each bucket kept for interactive callers, scheduled calls wait for the rest
+    DIAL_INTERACTIVE_RESERVE = 0.5
+    # kept short, because /call/create waits in a web thread, then hands the call to a worker to wait its turn
+    DIAL_QUEUE_MAX_WAIT = 1  # seconds
+    DIAL_QUEUE_MAX_WAIT_SCHEDULED = 60  # seconds, in a worker, before scheduled and deferred calls are put back for later
 
     # maximum number of outbound calls to the same phone number, from the same campaign
     # admin phones numbers are exempt, for testing
     CALL_RATE_LIMIT = os.environ.get('CALL_RATE_LIMIT', '2/hour')
+    # seconds before each process reloads admin phone numbers
+    ADMIN_PHONES_TTL = int(os.environ.get('ADMIN_PHONES_TTL', 300))
     # limit string must match notation like "[count] [per|/] [n (optional)] [second|minute|hour|day|month|year]""
     # from https://flask-limiter.readthedocs.io/en/stable/#rate-limit-string-notation
 
+    # minutes between refreshes of the materialized admin dashboard call counts
+    DASHBOARD_METRICS_INTERVAL = int(os.environ.get('DASHBOARD_METRICS_INTERVAL', 5))
+
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
     GEOCODE_API_KEY = os.environ.get('GEOCODE_API_KEY')
@@ -56,6 +129,10 @@ class DefaultConfig(object):
         OPENSTATES_API_KEY = os.environ.get('OPENSTATES_API_KEY')
 
     LOG_PHONE_NUMBERS = True
+    # if phone numbers are logged, CRM sync can keep them encrypted in the cache with this Fernet key
+    # instead of looking them up from Twilio on every sync (requires cryptography)
+    PHONE_ENCRYPTION_KEY = os.environ.get('PHONE_ENCRYPTION_KEY')
+    PHONE_ENCRYPTION_TIMEOUT = 60*60*24*30
 
     MAIL_SERVER = 'localhost'
 
@@ -72,6 +149,18 @@ class DefaultConfig(object):
         MOBILE_COMMONS_USERNAME = os.environ.get('MOBILE_COMMONS_USERNAME')
         MOBILE_COMMONS_PASSWORD = os.environ.get('MOBILE_COMMONS_PASSWORD')
         MOBILE_COMMONS_COMPANY = os.environ.get('MOBILE_COMMONS_COMPANY')
+    # unsynced calls are read in batches, and saved to the CRM by a pool of worker threads
+    CRM_SYNC_BATCH_SIZE = int(os.environ.get('CRM_SYNC_BATCH_SIZE', 100))
+    CRM_SYNC_WORKERS = int(os.environ.get('CRM_SYNC_WORKERS', 4))
+    # calls that fail to sync are retried on later runs, up to this many times
+    CRM_SYNC_MAX_ATTEMPTS = int(os.environ.get('CRM_SYNC_MAX_ATTEMPTS', 5))
+    # unsynced calls this many ids below the last synced call are read again, in case they committed late
+    CRM_SYNC_WATERMARK_WINDOW = int(os.environ.get('CRM_SYNC_WATERMARK_WINDOW', 500))
+
+    # recurring calls are enqueued each minute in batches, spread over up to SCHEDULE_DISPATCH_JITTER seconds
+    SCHEDULE_DISPATCH_BATCH_SIZE = int(os.environ.get('SCHEDULE_DISPATCH_BATCH_SIZE', 50))
+    SCHEDULE_DISPATCH_JITTER = int(os.environ.get('SCHEDULE_DISPATCH_JITTER', 30))
+    SCHEDULE_DISPATCH_CATCHUP = 10  # minutes
 
     if 'STORE_S3_BUCKET' in os.environ:
         STORE_PROVIDER = 'flask_store.providers.s3.S3Provider'
@@ -160,6 +249,7 @@ class DevelopmentConfig(DefaultConfig):
     DEBUG = os.environ.get('FLASK_DEBUG', True)
     DEBUG_MORE = True
     TESTING = False
+    QUERY_COUNT_HEADER = True
 
     CACHE_TYPE = 'redis'
     CACHE_REDIS_URL = 'redis://localhost:6379'
@@ -196,6 +286,12 @@ class TestingConfig(DefaultConfig):
 
     TESTING = True
     WTF_CSRF_ENABLED = False
+    # don't wait in the dial queue, unless a test asks for it
+    TWILIO_CPS = 1000
+    TWILIO_NUMBER_CPS = 1000
     SQLALCHEMY_DATABASE_URI = 'sqlite://'  # keep testing db in memory
     CACHE_TYPE = 'simple'
     CACHE_NO_NULL_WARNING = True
+    CACHE_REFRESH_IN_BACKGROUND = False
+    QUERY_COUNT_HEADER = True
+    QUERY_BUDGETS_STRICT = True
@@ -0,0 +1,280 @@
+# An in-process stand-in for the Twilio REST client, and a driver that answers its calls the way Twilio would
+# so the call flow can be tested and benchmarked without a Twilio account
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from urllib.parse import urljoin, urlsplit
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+
+class FakeResource(object):
+    """A Twilio instance resource, fetched and updated in place"""
+    SID_PREFIX = 'XX'
+
+    def __init__(self, **kwargs):
+        self.sid = '%s%032x' % (self.SID_PREFIX, random.getrandbits(128))
+        self.date_created = datetime.utcnow()
+        self.__dict__.update(kwargs)
+
+    def fetch(self):
+        return self
+
+    def update(self, **kwargs):
+        self.__dict__.update(kwargs)
+        return self
+
+    def to_json(self):
+        """Fields as the REST api names them"""
+        data = {}
+        for (name, value) in self.__dict__.items():
+            if isinstance(value, datetime):
+                value = value.strftime('%a, %d %b %Y %H:%M:%S +0000')
+            data['from' if name == 'from_' else name] = value
+        return data
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.sid)
+
+
+class FakeCall(FakeResource):
+    SID_PREFIX = 'CA'
+
+    def __init__(self, **kwargs):
+        defaults = {
+            'to': None, 'from_': None, 'url': None, 'status': 'queued', 'direction': 'outbound-api',
+            'status_callback': None, 'status_callback_event': None, 'parent_call_sid': None,
+            'start_time': None, 'end_time': None, 'duration': None,
+        }
+        defaults.update(kwargs)
+        super(FakeCall, self).__init__(**defaults)
+
+
+class FakeIncomingPhoneNumber(FakeResource):
+    SID_PREFIX = 'PN'
+
+    def __init__(self, **kwargs):
+        defaults = {'phone_number': None, 'friendly_name': None, 'voice_application_sid': None}
+        defaults.update(kwargs)
+        super(FakeIncomingPhoneNumber, self).__init__(**defaults)
+
+
+class FakeApplication(FakeResource):
+    SID_PREFIX = 'AP'
+
+
+class FakeList(object):
+    """
+    A Twilio list resource, with create, list and get by sid
+    Calling it with a sid gets that instance, like the real client
+    """
+    resource = FakeResource
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self.instances = OrderedDict()
+
+    def create(self, **kwargs):
+        self._client.wait()
+        return self._add(self.resource(account_sid=self._client.account_sid, **kwargs))
+
+    def _add(self, instance):
+        with self._lock:
+            self.instances[instance.sid] = instance
+        return instance
+
+    def list(self, limit=None, **filters):
+        """Instances with attributes equal to filters, newest first"""
+        self._client.wait()
+        with self._lock:
+            found = [i for i in reversed(self.instances.values())
+                     if all(getattr(i, name, None) == value for (name, value) in filters.items())]
+        return found[:limit] if limit else found
+
+    def get(self, sid):
+        self._client.wait()
+        instance = self.instances.get(sid)
+        if instance is None:
+            from twilio.base.exceptions import TwilioRestException
+            raise TwilioRestException(404, '/%s' % sid, 'The requested resource %s was not found' % sid, code=20404)
+        return instance
+
+    def __call__(self, sid):
+        return self.get(sid)
+
+
+class FakeCalls(FakeList):
+    resource = FakeCall
+
+    def __init__(self, client):
+        super(FakeCalls, self).__init__(client)
+        # created and not yet answered by a driver
+        self.queued = []
+
+    def create(self, to, from_, url=None, status_callback=None, status_callback_event=None, **kwargs):
+        call = super(FakeCalls, self).create(to=to, from_=from_, url=url, status_callback=status_callback,
+                                             status_callback_event=status_callback_event, **kwargs)
+        if call.status == 'queued':
+            with self._lock:
+                self.queued.append(call)
+        return call
+
+    def dialed(self, parent, **kwargs):
+        """A child call of parent, like Twilio makes for a Dial"""
+        return self._add(self.resource(account_sid=parent.account_sid, parent_call_sid=parent.sid,
+                                       direction='outbound-dial', start_time=datetime.utcnow(), **kwargs))
+
+    def pop_queued(self, to=None):
+        """The first call nobody has answered yet, to a number if given"""
+        with self._lock:
+            for (i, call) in enumerate(self.queued):
+                if to is None or call.to == to:
+                    return self.queued.pop(i)
+        return None
+
+
+class FakeIncomingPhoneNumbers(FakeList):
+    resource = FakeIncomingPhoneNumber
+
+
+class FakeApplications(FakeList):
+    resource = FakeApplication
+
+
+class FakeTwilioClient(object):
+    """
+    Keeps calls, phone numbers and applications in memory, for the parts of twilio.rest.Client we use
+    latency is seconds added to each REST request, a single value or a (low, high) range
+    """
+
+    def __init__(self, account_sid=None, auth_token=None, phone_numbers=(), latency=0):
+        self.account_sid = account_sid or 'AC' + '0' * 32
+        self.auth = (self.account_sid, auth_token or 'fake')
+        self.latency = latency if isinstance(latency, (tuple, list)) else (latency, latency)
+        self.calls = FakeCalls(self)
+        self.incoming_phone_numbers = FakeIncomingPhoneNumbers(self)
+        self.applications = FakeApplications(self)
+        for number in phone_numbers:
+            self.incoming_phone_numbers.create(phone_number=number, friendly_name=number)
+
+    def wait(self):
+        if self.latency[1]:
+            time.sleep(random.uniform(*self.latency))
+
+
+class TwilioDriverError(Exception):
+    pass
+
+
+class TwilioDriver(object):
+    """
+    Answers calls from a FakeTwilioClient the way Twilio would, following the TwiML the app returns
+    Gathers get digits, Dials are connected and completed, Redirects are followed,
+    and the status callback gets the events the call asked for
+
+    http is a Flask test client, or a requests.Session for an app running elsewhere
+    Each webhook's time is kept in timings, by the last part of its path
+    """
+    # most webhooks one call follows, in case the app loops
+    MAX_STEPS = 50
+
+    def __init__(self, http, twilio=None, digits='1', location='94110', dial_status='completed',
+                 dial_duration=30):
+        self.http = http
+        self.twilio = twilio
+        self.digits = digits
+        self.location = location
+        self.dial_status = dial_status
+        self.dial_duration = dial_duration
+        self.timings = defaultdict(list)
+
+    def wait(self):
+        """Called where Twilio would take a while, before a dialed call ends and before the final status callback"""
+        pass
+
+    @staticmethod
+    def webhook_name(url):
+        return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+    def post(self, url, data):
+        """Post a webhook, returning its body, timed by name"""
+        name = self.webhook_name(url)
+        started = time.perf_counter()
+        response = self.http.post(url, data=data)
+        self.timings[name].append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise TwilioDriverError('%s returned %s' % (url, response.status_code))
+        return response.data if hasattr(response, 'data') else response.content
+
+    def gather_input(self, action):
+        """Digits entered at a prompt, the location for location prompts"""
+        return self.location if 'location' in action else self.digits
+
+    def run_queued(self):
+        """Answer every call the app has created and no driver has answered yet, returns how many"""
+        answered = 0
+        call = self.twilio.calls.pop_queued()
+        while call is not None:
+            self.run(call)
+            answered += 1
+            call = self.twilio.calls.pop_queued()
+        return answered
+
+    def run(self, call):
+        """Ring, answer and follow one call to the end"""
+        events = call.status_callback_event or ['completed']
+        params = dict((name, value) for (name, value) in (
+            ('CallSid', call.sid), ('AccountSid', call.account_sid), ('From', call.from_), ('To', call.to),
+            ('Direction', call.direction)) if value is not None)
+
+        call.update(status='ringing')
+        if call.status_callback and 'ringing' in events:
+            self.post(call.status_callback, dict(params, CallStatus='ringing'))
+
+        call.update(status='in-progress', start_time=datetime.utcnow())
+        self.follow(call.url, dict(params, CallStatus='in-progress'), call)
+
+        self.wait()
+        call.update(status='completed', end_time=datetime.utcnow())
+        call.update(duration=str(int((call.end_time - call.start_time).total_seconds())))
+        if call.status_callback and 'completed' in events:
+            self.post(call.status_callback, dict(params, CallStatus='completed', CallDuration=call.duration))
+
+    def follow(self, url, params, call=None):
+        data = params
+        for n in range(self.MAX_STEPS):
+            body = self.post(url, data)
+            try:
+                twiml = ET.fromstring(body)
+            except ET.ParseError:
+                raise TwilioDriverError('%s did not return TwiML' % url)
+
+            gather = twiml.find('Gather')
+            dial = twiml.find('Dial')
+            redirect = twiml.find('Redirect')
+            if gather is not None and gather.get('action'):
+                (url, data) = (urljoin(url, gather.get('action')),
+                               dict(params, Digits=self.gather_input(gather.get('action'))))
+            elif dial is not None and dial.get('action'):
+                dial_sid = self.dial(dial, call)
+                self.wait()
+                (url, data) = (urljoin(url, dial.get('action')),
+                               dict(params, DialCallSid=dial_sid, DialCallStatus=self.dial_status,
+                                    DialCallDuration=str(self.dial_duration)))
+            elif redirect is not None:
+                (url, data) = (urljoin(url, redirect.text), params)
+            else:
+                return
+        raise TwilioDriverError('call did not end after %d webhooks' % self.MAX_STEPS)
+
+    def dial(self, dial, call):
+        """The child call made to the number in Dial, returns its sid"""
+        number = dial.find('Number')
+        if self.twilio is None or call is None:
+            return 'CA%032x' % random.getrandbits(128)
+        child = self.twilio.calls.dialed(call, to=number.text.strip() if number is not None else None,
+                                         from_=dial.get('callerId'), status=self.dial_status,
+                                         duration=str(self.dial_duration))
+        return child.sid
@@ -0,0 +1,381 @@
+# Request timings by endpoint, split into time spent in sql, redis, http, twilio, geocoding and templates
+# and SQL query budgets for views, and database pool checkouts
+from flask import current_app, request, g, has_request_context
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import os
+import random
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+COMPONENTS = ('sql', 'redis', 'http', 'twilio', 'geocode', 'template')
+
+
+class Histogram(object):
+    """Counts of observations in fixed latency buckets, with their sum"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for (i, bound) in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q'th fraction of observations"""
+        if not self.count:
+            return 0
+        seen = 0
+        for (bound, n) in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return bound if bound != float('inf') else BUCKETS[-2]
+        return BUCKETS[-2]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': (self.sum / self.count) if self.count else 0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class EndpointMetrics(object):
+    """
+    Per-endpoint histograms of request time and of the time each request spent in each component
+
+    Kept in this process, so each gunicorn worker reports its own requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # connections checked out of database pools, which outlive a reset
+        self.pool_checked_out = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(Histogram)
+            self.components = defaultdict(lambda: defaultdict(Histogram))
+            self.queries = defaultdict(int)
+            self.errors = defaultdict(int)
+            # calls to each component, like redis commands, by endpoint
+            self.calls = defaultdict(lambda: defaultdict(int))
+            self.pool_peak = self.pool_checked_out
+
+    def record(self, endpoint, duration, timings, queries, error=False, calls=None):
+        with self._lock:
+            self.requests[endpoint].observe(duration)
+            for component in COMPONENTS:
+                self.components[endpoint][component].observe(timings.get(component, 0))
+            for (component, n) in (calls or {}).items():
+                self.calls[endpoint][component] += n
+            self.queries[endpoint] += queries
+            if error:
+                self.errors[endpoint] += 1
+
+    def pool_checkout(self, n):
+        with self._lock:
+            self.pool_checked_out = max(0, self.pool_checked_out + n)
+            self.pool_peak = max(self.pool_peak, self.pool_checked_out)
+
+    def summary(self):
+        with self._lock:
+            endpoints = {}
+            for (endpoint, histogram) in self.requests.items():
+                summary = histogram.summary()
+                summary['errors'] = self.errors[endpoint]
+                summary['queries_mean'] = float(self.queries[endpoint]) / histogram.count
+                summary['components'] = dict((component, self.components[endpoint][component].summary())
+                                             for component in COMPONENTS)
+                summary['calls_mean'] = dict((component, float(n) / histogram.count)
+                                             for (component, n) in self.calls[endpoint].items())
+                endpoints[endpoint] = summary
+            return endpoints
+
+    def prometheus(self, pool=None):
+        """Histograms in the Prometheus text exposition format, with the pool_status of the database if given"""
+        lines = []
+        with self._lock:
+            lines.append('# HELP callpower_request_seconds Request time by endpoint')
+            lines.append('# TYPE callpower_request_seconds histogram')
+            for (endpoint, histogram) in sorted(self.requests.items()):
+                lines.extend(_histogram_lines('callpower_request_seconds', {'endpoint': endpoint}, histogram))
+
+            lines.append('# HELP callpower_request_component_seconds Time requests spent in each component')
+            lines.append('# TYPE callpower_request_component_seconds histogram')
+            for (endpoint, components) in sorted(self.components.items()):
+                for component in COMPONENTS:
+                    lines.extend(_histogram_lines('callpower_request_component_seconds',
+                                                  {'endpoint': endpoint, 'component': component},
+                                                  components[component]))
+
+            lines.append('# HELP callpower_request_queries_total SQL queries run by requests')
+            lines.append('# TYPE callpower_request_queries_total counter')
+            for (endpoint, queries) in sorted(self.queries.items()):
+                lines.append('callpower_request_queries_total{endpoint="%s"} %d' % (endpoint, queries))
+
+            lines.append('# HELP callpower_request_errors_total Requests that raised an exception')
+            lines.append('# TYPE callpower_request_errors_total counter')
+            for (endpoint, errors) in sorted(self.errors.items()):
+                lines.append('callpower_request_errors_total{endpoint="%s"} %d' % (endpoint, errors))
+
+            lines.append('# HELP callpower_request_component_calls_total Calls requests made to each component')
+            lines.append('# TYPE callpower_request_component_calls_total counter')
+            for (endpoint, calls) in sorted(self.calls.items()):
+                for (component, n) in sorted(calls.items()):
+                    lines.append('callpower_request_component_calls_total{component="%s",endpoint="%s"} %d'
+                                 % (component, endpoint, n))
+
+        for (name, value) in sorted((pool or {}).items()):
+            if value is not None:
+                lines.append('# TYPE callpower_db_pool_%s gauge' % name)
+                lines.append('callpower_db_pool_%s %d' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(name, labels, histogram):
+    label_text = ','.join('%s="%s"' % item for item in sorted(labels.items()))
+    cumulative = 0
+    for (bound, n) in zip(BUCKETS, histogram.buckets):
+        cumulative += n
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        yield '%s_bucket{%s,le="%s"} %d' % (name, label_text, le, cumulative)
+    yield '%s_sum{%s} %f' % (name, label_text, histogram.sum)
+    yield '%s_count{%s} %d' % (name, label_text, histogram.count)
+
+
+metrics = EndpointMetrics()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL queries run in this thread while it is active, and their time
+
+        with QueryCounter() as queries:
+            ...
+        queries.count, queries.duration
+    """
+    # statements kept for budget error messages
+    MAX_STATEMENTS = 50
+    _local = threading.local()
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    @classmethod
+    def active(cls):
+        if not hasattr(cls._local, 'counters'):
+            cls._local.counters = []
+        return cls._local.counters
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.duration += elapsed
+        if len(self.statements) < self.MAX_STATEMENTS:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self.active().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        if self in self.active():
+            self.active().remove(self)
+
+
+def query_budget(max_queries):
+    """
+    Declare the most SQL queries a view should run for one request
+    Put it below the route decorator. Going over fails the request when QUERY_BUDGETS_STRICT is set, as it is
+    for tests, and logs a warning otherwise
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def add_time(component, seconds):
+    """Count a call taking seconds against the current request's component, outside a request this does nothing"""
+    if has_request_context() and hasattr(g, '_timings'):
+        g._timings[component] += seconds
+        g._calls[component] += 1
+
+
+@contextmanager
+def timed(component):
+    started = time.time()
+    try:
+        yield
+    finally:
+        add_time(component, time.time() - started)
+
+
+def timed_function(component):
+    """Decorator to count a function's time against component"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(component):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.time() - conn.info['_query_started'].pop()
+    for counter in QueryCounter.active():
+        counter.add(statement, elapsed)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # after_cursor_execute doesn't run for a failed query
+    started = context.connection.info.get('_query_started') if context.connection else None
+    if started:
+        started.pop()
+
+
+@event.listens_for(Pool, 'checkout')
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    metrics.pool_checkout(1)
+
+
+@event.listens_for(Pool, 'checkin')
+def _pool_checkin(dbapi_connection, connection_record):
+    metrics.pool_checkout(-1)
+
+
+def pool_status(engine):
+    """
+    Connections checked out of the pool now and at the peak since the metrics were reset, and how many it can give out
+    A peak at capacity means requests waited for a connection, so the pool is too small for the worker's threads
+    """
+    pool = engine.pool
+    capacity = None
+    if isinstance(pool, QueuePool) and pool._max_overflow >= 0:
+        capacity = pool.size() + pool._max_overflow
+    return {
+        'checked_out': metrics.pool_checked_out,
+        'checked_out_peak': metrics.pool_peak,
+        'capacity': capacity,
+    }
+
+
+_patched = False
+
+
+def _patch_clients():
+    # redis and requests have no event hooks, so wrap the methods every command and request goes through
+    global _patched
+    if _patched:
+        return
+    _patched = True
+
+    import redis.client
+    redis.client.Redis.execute_command = timed_function('redis')(redis.client.Redis.execute_command)
+    redis.client.Pipeline.execute = timed_function('redis')(redis.client.Pipeline.execute)
+
+    import requests.sessions
+    send = requests.sessions.Session.send
+
+    @wraps(send)
+    def timed_send(self, prepared_request, **kwargs):
+        with timed('twilio' if 'twilio.com' in (prepared_request.url or '') else 'http'):
+            return send(self, prepared_request, **kwargs)
+    requests.sessions.Session.send = timed_send
+
+
+def _before_request():
+    g._request_started = time.time()
+    g._timings = defaultdict(float)
+    g._calls = defaultdict(int)
+    g._query_counter = QueryCounter().__enter__()
+    g._profile = None
+    if random.random() < current_app.config.get('PROFILE_SAMPLE_RATE', 0):
+        g._profile = cProfile.Profile()
+        g._profile.enable()
+
+
+def _teardown_request(exc=None):
+    if not hasattr(g, '_request_started'):
+        return
+    duration = time.time() - g._request_started
+    endpoint = request.endpoint or 'unmatched'
+    counter = g._query_counter
+    counter.__exit__()
+    g._timings['sql'] = counter.duration
+    g._calls['sql'] = counter.count
+    metrics.record(endpoint, duration, g._timings, counter.count, error=exc is not None, calls=g._calls)
+
+    profile = getattr(g, '_profile', None)
+    if profile:
+        profile.disable()
+        if duration >= current_app.config.get('PROFILE_SLOW_REQUEST', 1):
+            _dump_profile(profile, endpoint, duration)
+
+
+def _after_request(response):
+    counter = getattr(g, '_query_counter', None)
+    if counter is None:
+        return response
+    if current_app.config.get('QUERY_COUNT_HEADER'):
+        response.headers['X-Query-Count'] = str(counter.count)
+        response.headers['X-Query-Time'] = '%.1fms' % (counter.duration * 1000)
+
+    budget = getattr(current_app.view_functions.get(request.endpoint), 'query_budget', None)
+    if budget is not None and counter.count > budget:
+        message = '%s ran %d queries, over its budget of %d:\n%s' % (
+            request.endpoint, counter.count, budget, '\n'.join(counter.statements))
+        if current_app.config.get('QUERY_BUDGETS_STRICT'):
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def _dump_profile(profile, endpoint, duration):
+    profile_dir = current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    path = os.path.join(profile_dir, '%s-%d-%dms.prof' % (endpoint, time.time() * 1000, duration * 1000))
+    profile.dump_stats(path)
+    current_app.logger.info('slow request to %s took %.3fs, profile saved to %s' % (endpoint, duration, path))
+
+
+def init_instrumentation(app):
+    """Time every request, unless INSTRUMENTATION is turned off"""
+    if not app.config.get('INSTRUMENTATION', True):
+        return
+    _patch_clients()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
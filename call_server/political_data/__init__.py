@@ -62,4 +62,4 @@ def _get_data_provider_class(country_code):
 
 # import this at the end, because it depends on get_country_data above
 from .views import political_data
-from .data_cache import check_political_data_cache
+from .data_cache import check_political_data_cache, check_political_data_cache_many
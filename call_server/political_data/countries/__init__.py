@@ -1,14 +1,13 @@
-from flask import current_app
 from flask_babel import gettext as _
-import flask_caching
-import pickle
+
+from ..search_index import SearchIndex, fold
+
+import collections
 
 class DataProvider(object):
     country_name = None
     campaign_types = []
 
-    SORTED_SETS = []
-
     def __init__(self, **kwargs):
         pass
 
@@ -39,6 +38,21 @@ class DataProvider(object):
         """
         return self._cache.get(key) or default
 
+    def cache_get_many(self, keys, default=list()):
+        """
+        Checks for multiple keys in cache, returns a list of values in the same order
+        Missing keys are replaced with default, like cache_get
+        Uses a single MGET round trip for redis, and falls back to dict lookups otherwise
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        if hasattr(self._cache, 'get_many'):
+            values = self._cache.get_many(*keys)
+        else:
+            values = [self._cache.get(k) for k in keys]
+        return [v or default for v in values]
+
     def cache_set(self, key, value):
         """ Add a new key/value to the cache """
         if hasattr(self._cache, 'set'):
@@ -60,48 +74,60 @@ class DataProvider(object):
         else:
             raise AttributeError('cache does not appear to be dict-like')
 
-    def cache_search(self, key_starts_with):
+    @property
+    def search_index(self):
+        return SearchIndex(self._cache, self.country_code)
+
+    def cache_set_indexed(self, key, value):
+        """ Add a new key/value to the cache, and to the search index """
+        self.cache_set(key, value)
+        self.search_index.add([(key, value)])
+
+    def cache_search(self, key_starts_with, filters=None):
         """
-        Searches for keys starting with a name
-        Handles difference between flask-cache and mock-dictionary
+        Searches for records with keys starting with a name, using the index built by load_data
+        Returns all matching records, see cache_search_page
         """
-        result = []
-        if isinstance(self._cache.cache, flask_caching.backends.rediscache.RedisCache):
-            redis = self._cache.cache._read_clients
-
-            # check sorted sets first
-            for s in self.SORTED_SETS:
-                if key_starts_with.startswith(s):
-                    # weird redis syntax for min/max
-                    min_val = u'[' + key_starts_with
-                    max_val = u'(' + key_starts_with + u'\xff'
-                    matching_keys = redis.zrangebylex(s, min_val, max_val)
-                    for key in matching_keys:
-                        key = key.decode('ascii')
-                        result.extend(self.cache_get(key))
-
-            # fall back on key scan
-            # can be fairly slow (3-4s for full scan)
-            if not result:
-                key_scan = current_app.config['CACHE_KEY_PREFIX'] + key_starts_with + '*'
-                for prefixed_key in redis.scan_iter(match=key_scan):
-                    prefixed_key = prefixed_key.decode('ascii')
-                    key = prefixed_key.replace(current_app.config['CACHE_KEY_PREFIX'], '')
-                    result.extend(self.cache_get(key))
-        elif isinstance(self._cache.cache, flask_caching.backends.simple.SimpleCache) \
-            or isinstance(self._cache.cache, dict):
-            # naively search across all the keys
-            for (k,v) in self._cache.cache._cache.items():
-                if k.startswith(key_starts_with):
-                    wet_value = pickle.loads(v[1])
-                    if isinstance(wet_value, list):
-                        result.extend(wet_value)
-                    else:
-                        result.append(wet_value)
-        else:
-            raise AttributeError('cannot search cache. it should be a redis connection or a dict')
+        (result, _) = self.cache_search_page([key_starts_with], filters)
         return result
 
+    def cache_search_page(self, keys, filters=None, limit=None, cursor=None, fuzzy=False):
+        """
+        Searches for records with keys starting with any of keys, using the index built by load_data
+        filters is a list of (field, value) pairs, matched as case and accent insensitive prefixes
+        Indexed fields are filtered in the index, others only against the matching records
+        A name filter matches any name token, or similar names if fuzzy is set
+        Returns a list of at most limit records, and a cursor for the next page or None
+        """
+        index_filters = []
+        record_filters = []
+        for (field, value) in (filters or []):
+            if field in SearchIndex.FIELDS:
+                index_filters.append((field, value))
+            else:
+                record_filters.append((field, fold(value)))
+
+        result = []
+        while True:
+            remaining = limit - len(result) if limit else None
+            (refs, cursor) = self.search_index.search(keys, index_filters, remaining, cursor, fuzzy)
+            cache_keys = list(collections.OrderedDict.fromkeys(k for (k, _) in refs))
+            cached = dict(zip(cache_keys, self.cache_get_many(cache_keys)))
+
+            for (cache_key, position) in refs:
+                value = cached[cache_key]
+                if isinstance(value, list):
+                    if position >= len(value):
+                        continue
+                    value = value[position]
+                if all(fold(value.get(field) or '').startswith(v) for (field, v) in record_filters):
+                    result.append(value)
+
+            # unindexed filters may have dropped records, keep paging to fill the limit
+            if not cursor or len(result) >= limit:
+                break
+        return (result, cursor)
+
 class CampaignType(object):
     type_name = None
     subtypes = []
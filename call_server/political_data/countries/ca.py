@@ -68,8 +68,7 @@ class CACampaignType_Parliament(CACampaignType):
         return (r['cache_key'] for r in filtered)
 
     def _filter_representatives(self, representatives, elected_office="MP", campaign_region=None):
-        for key in representatives:
-            rep = self.data_provider.cache_get(key, {})
+        for rep in self.data_provider.cache_get_many(representatives, {}):
             correct_office = rep['elected_office'].upper() == elected_office
             in_region = campaign_region is None or rep['district_name'].upper() == campaign_region.upper()
             if correct_office and in_region:
@@ -138,8 +137,7 @@ class CACampaignType_Province(CACampaignType):
         return (r['cache_key'] for r in filtered)
 
     def _filter_representatives(self, representatives, elected_office="MLA", district_name=None):
-        for key in representatives:
-            rep = self.data_provider.cache_get(key, {})
+        for rep in self.data_provider.cache_get_many(representatives, {}):
             correct_office = rep['elected_office'].upper() == elected_office
             in_region = district_name is None or rep['district_name'].upper() == district_name.upper()
             if correct_office and in_region:
@@ -209,7 +207,7 @@ class CADataProvider(DataProvider):
             cache_key = self.KEY_OPENNORTH.format(boundary=boundary_key)
             rep['boundary_key'] = boundary_key
             rep['cache_key'] = cache_key
-            self.cache_set(cache_key, rep)
+            self.cache_set_indexed(cache_key, rep)
             keys.append(cache_key)
 
         return keys
@@ -1,4 +1,3 @@
-import werkzeug.contrib.cache
 from flask_babel import gettext as _
 from graphqlclient import GraphQLClient
 
@@ -16,6 +15,7 @@ import csv
 import yaml
 import json
 import collections
+import itertools
 from datetime import datetime
 import logging
 log = logging.getLogger(__name__)
@@ -78,16 +78,20 @@ class USCampaignType_Congress(USCampaignType):
         return US_STATES
 
     def all_targets(self, location, campaign_region=None):
+        # look up districts once, and fetch all of their members in a single round trip
+        districts = self.data_provider.get_districts(location.postal)
+        members = self.data_provider.get_congress_members(districts)
+
         return {
             'upper': {
-                'all': self._get_senators(location),
-                'democrats': self._get_senate_party(location, 'Democrat'),
-                'republicans': self._get_congress_party(location, 'Republican')
+                'all': self._get_senators(districts, members),
+                'democrats': self._get_senate_party(districts, members, 'Democrat'),
+                'republicans': self._get_congress_party(districts, members, 'Republican')
             },
             'lower': {
-                'all': self._get_representative(location),
-                'democrats': self._get_congress_party(location, 'Democrat'),
-                'republicans': self._get_congress_party(location, 'Republican'),
+                'all': self._get_representative(districts, members),
+                'democrats': self._get_congress_party(districts, members, 'Democrat'),
+                'republicans': self._get_congress_party(districts, members, 'Republican'),
             }
         }
 
@@ -139,41 +143,38 @@ class USCampaignType_Congress(USCampaignType):
         elif subtype == 'exec':
             return exec_targets
 
-    def _get_senators(self, location):
-        districts = self.data_provider.get_districts(location.postal)
+    def _get_senators(self, districts, members):
         # This is a set because zipcodes may cross states
         states = set(d['state'] for d in districts)
 
         for state in states:
-            for senator in self.data_provider.get_senators(state):
+            for senator in members.get(self.data_provider.KEY_SENATE.format(state=state), []):
                 yield self.data_provider.KEY_BIOGUIDE.format(**senator)
 
-    def _get_representative(self, location):
-        districts = self.data_provider.get_districts(location.postal)
-
+    def _get_representative(self, districts, members):
         for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
+            rep = members.get(self.data_provider.KEY_HOUSE.format(
+                state=district['state'], district=district['house_district']))
             if rep:
                 yield self.data_provider.KEY_BIOGUIDE.format(**rep[0])
 
-    def _get_senate_party(self, location, party):
-        districts = self.data_provider.get_districts(location.postal)
+    def _get_senate_party(self, districts, members, party):
         # This is a set because zipcodes may cross states
         states = set(d['state'] for d in districts)
         matched_party = []
 
         for state in states:
-            for senator in self.data_provider.get_senators(state):
+            for senator in members.get(self.data_provider.KEY_SENATE.format(state=state), []):
                 if senator.get('party') == party:
                     matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**senator))
         return matched_party
 
-    def _get_congress_party(self, location, party):
-        districts = self.data_provider.get_districts(location.postal)
+    def _get_congress_party(self, districts, members, party):
         matched_party = []
         
         for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
+            rep = members.get(self.data_provider.KEY_HOUSE.format(
+                state=district['state'], district=district['house_district']))
             if rep and rep[0].get('party') == party:
                 matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**rep[0]))
         return matched_party
@@ -276,13 +277,11 @@ class USDataProvider(DataProvider):
     KEY_GOVERNOR = 'us_state:governor:{state}'
     KEY_ZIPCODE = 'us:zipcode:{zipcode}'
 
-    SORTED_SETS = ['us:house', 'us:senate', 'us_state:governor']
-
     def __init__(self, cache, api_cache=None, **kwargs):
         super(USDataProvider, self).__init__(**kwargs)
         self._cache = cache
         self._geocoder = Geocoder(country='US')
-        self._openstates = GraphQLClient('https://openstates.org/graphql')
+        self._openstates = GraphQLClient(os.environ.get('OPENSTATES_URL', 'https://openstates.org/graphql'))
         self._openstates.inject_token(os.environ.get('OPENSTATES_API_KEY'), 'x-api-key')
 
     def get_location(self, locate_by, raw, ignore_local_cache=False):
@@ -445,14 +444,10 @@ class USDataProvider(DataProvider):
         self.cache_set_many(legislators)
         self.cache_set_many(governors)
 
-        # if cache is redis, add lexigraphical index on states, names
-        if hasattr(self._cache, 'cache') and isinstance(self._cache.cache, werkzeug.contrib.cache.RedisCache):
-            redis = self._cache.cache._client
-            searchable_items = legislators.items() + governors.items()
-            for (key,record) in searchable_items:
-                for sorted_key in self.SORTED_SETS:
-                    if key.startswith(sorted_key):
-                        redis.zadd(sorted_key, key, 0)
+        # index legislators and governors for /political_data/search
+        # keeping state legislators already cached from OpenStates
+        self.search_index.build(itertools.chain(legislators.items(), governors.items()),
+            keep_prefixes=[self.KEY_OPENSTATES.format(id='')])
 
         success = [
             "%s zipcodes" % len(districts),
@@ -486,6 +481,18 @@ class USDataProvider(DataProvider):
         key = self.KEY_ZIPCODE.format(zipcode=zipcode)
         return self.cache_get(key)
 
+    def get_congress_members(self, districts):
+        """
+        Get senators and house members for a list of districts with a single cache_get_many
+        Returns a dictionary of senate and house cache keys to legislator lists
+        """
+        keys = []
+        for district in districts:
+            keys.append(self.KEY_SENATE.format(state=district['state']))
+            keys.append(self.KEY_HOUSE.format(state=district['state'], district=district['house_district']))
+        keys = list(collections.OrderedDict.fromkeys(keys))
+        return dict(zip(keys, self.cache_get_many(keys)))
+
     def get_state_governor(self, state):
         key = self.KEY_GOVERNOR.format(state=state)
         return self.cache_get(key)
@@ -548,7 +555,7 @@ class USDataProvider(DataProvider):
 
             key = self.KEY_OPENSTATES.format(id=leg['id'])
             leg['cache_key'] = key
-            self.cache_set(key, leg)
+            self.cache_set_indexed(key, leg)
             legislators.append(leg)
 
         return legislators
@@ -606,7 +613,7 @@ class USDataProvider(DataProvider):
             leg['title'] = role_title
 
             leg['cache_key'] = key
-            self.cache_set(key, leg)
+            self.cache_set_indexed(key, leg)
         return leg
 
     def search_state_leg(self, state, chamber, name):
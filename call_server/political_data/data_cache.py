@@ -4,9 +4,23 @@ from ..political_data.adapters import adapt_by_key
 from .countries.us import USDataProvider
 
 def check_political_data_cache(key, cache=cache):
+    return check_political_data_cache_many([key], cache)[0]
+
+def check_political_data_cache_many(keys, cache=cache):
+    """
+    Look up multiple target keys with a single cache round trip
+    Returns a list of adapted target data, in the same order as keys
+    """
+    adapted_keys = [adapt_by_key(key).key(key)[0] for key in keys]
+    if hasattr(cache, 'get_many'):
+        cached_objs = cache.get_many(*adapted_keys)
+    else:
+        cached_objs = [cache.get(k) for k in adapted_keys]
+    return [_adapt_cached_obj(key, adapted_key, cached_obj, cache)
+            for (key, adapted_key, cached_obj) in zip(keys, adapted_keys, cached_objs)]
+
+def _adapt_cached_obj(key, adapted_key, cached_obj, cache):
     adapter = adapt_by_key(key)
-    adapted_key, adapter_suffix = adapter.key(key)
-    cached_obj = cache.get(adapted_key)
 
     if not cached_obj:
         # some keys may not be in our local cache
@@ -2,6 +2,7 @@ import geopy
 import os
 
 from .constants import US_STATE_NAME_DICT, CA_PROVINCE_NAME_DICT
+from ..instrumentation import timed_function
 
 GOOGLE_SERVICE = 'GoogleV3'
 SMARTYSTREETS_SERVICE = 'LiveAddress'
@@ -150,18 +151,23 @@ class Geocoder(object):
 
         service = geopy.geocoders.get_geocoder_for_service(API_NAME)
         self.country = country
+        # point the provider at another host, like a local fake for load tests
+        endpoint = {}
+        if os.environ.get('GEOCODE_DOMAIN'):
+            endpoint['domain'] = os.environ['GEOCODE_DOMAIN']
+            endpoint['scheme'] = os.environ.get('GEOCODE_SCHEME', 'https')
 
         if API_NAME == 'nominatim':
                 # nominatim sets country bias at init
                 # has no API_KEY, but does request a user agent
-                self.client = service(country_bias=country, timeout=5, user_agent="CallPower")
+                self.client = service(country_bias=country, timeout=5, user_agent="CallPower", **endpoint)
         elif API_NAME == 'liveaddress':
             AUTH_TOKEN = os.environ.get('GEOCODE_API_TOKEN', None)
             self.client = service(API_KEY, AUTH_TOKEN, timeout=3)
             # SmartyStreets has a separate US Zipcode endpoint
             self.client_uszipcode = SmartystreetsUSZipcode(API_KEY, AUTH_TOKEN)
         elif API_KEY:
-            self.client = service(api_key=API_KEY, timeout=3)
+            self.client = service(api_key=API_KEY, timeout=3, **endpoint)
         else:
             raise LocationError('configure your geocoder with environment variables GEOCODE_PROVIDER and GEOCODE_API_KEY')
             
@@ -182,6 +188,7 @@ class Geocoder(object):
         # fallback to geocoder if cache unavailable
         return self.geocode(code, postal_only=True)
 
+    @timed_function('geocode')
     def geocode(self, address, postal_only=False):
         service = self.get_service_name()
 
@@ -226,6 +233,7 @@ class Geocoder(object):
             result.service = "Timeout"
         return result
 
+    @timed_function('geocode')
     def reverse(self, latlon):
         if type(latlon) == tuple:
             lat = latlon[0]
@@ -0,0 +1,323 @@
+from bisect import bisect_left, bisect_right
+import base64
+import collections
+import re
+import uuid
+
+from flask_caching.backends.rediscache import RedisCache
+
+from ..utils import ignore_accents
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def fold(value):
+    """ Normalize a value for index comparison, ignoring case and accents """
+    return ignore_accents(str(value)).lower()
+
+
+def name_tokens(value):
+    """ Split a folded name into words, ignoring punctuation """
+    return [t for t in re.split(r'[^a-z0-9]+', fold(value)) if t]
+
+
+def trigrams(tokens):
+    """ Trigrams of each word, padded like pg_trgm so short names and word starts still match """
+    grams = set()
+    for t in tokens:
+        padded = u'  ' + t + u' '
+        grams.update(padded[i:i+3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex(object):
+    """
+    Lexicographic index over cached political data records, built at load_data time
+
+    Each record gets one entry per searchable value, formatted as
+        {kind}:{value}|{cache_key}|{position}
+    eg  key:us:senate:CA|us:senate:CA|1 or last_name:feinstein|us:senate:CA|1
+    so a prefix range over {kind}:{value} returns matching record references without touching the cache.
+
+    Names are folded once here, into name entries for first, last and full name tokens,
+    and trigram entries for fuzzy matching.
+
+    Stored as a redis sorted set (queried with ZRANGEBYLEX) when the cache is redis,
+    otherwise as a sorted list in the cache (queried with bisect)
+    """
+    KEY_INDEX = 'political_data:index:{country}'
+    KEY_VERSION = 'political_data:index:{country}:version'
+    FIELDS = ['first_name', 'last_name', 'state', 'name']
+    # OpenStates records use different name fields
+    FIELD_ALIASES = {
+        'first_name': ['first_name', 'givenName'],
+        'last_name': ['last_name', 'familyName'],
+    }
+    SEPARATOR = '|'
+    FUZZY_THRESHOLD = 0.5
+
+    # unpickled list indexes for non-redis caches, by index key
+    _local_indexes = {}
+
+    def __init__(self, cache, country_code):
+        self._cache = cache
+        self.index_key = self.KEY_INDEX.format(country=country_code)
+        self.version_key = self.KEY_VERSION.format(country=country_code)
+
+    @property
+    def _redis_backend(self):
+        backend = getattr(self._cache, 'cache', None)
+        if isinstance(backend, RedisCache):
+            return backend
+        return None
+
+    def _field_value(self, record, field):
+        for f in self.FIELD_ALIASES.get(field, [field]):
+            if record.get(f):
+                return record[f]
+        return None
+
+    def record_names(self, record):
+        """
+        @return  folded first, last and full name tokens for a record
+        """
+        first = name_tokens(self._field_value(record, 'first_name') or '')
+        last = name_tokens(self._field_value(record, 'last_name') or '')
+        if record.get('name'):
+            full = name_tokens(record['name'])
+        else:
+            full = first + last
+        return (first, last, full)
+
+    def record_entries(self, cache_key, position, record):
+        """
+        @return  a list of index entries for a single record
+        """
+        values = [('key', cache_key)]
+        for field in self.FIELDS:
+            if field == 'name':
+                continue
+            value = self._field_value(record, field)
+            if value:
+                values.append((field, fold(value)))
+
+        (first, last, full) = self.record_names(record)
+        names = set(first + last + full)
+        if full:
+            names.add(u' '.join(full))
+        values.extend(('name', n) for n in names)
+        values.extend(('trigram', t) for t in trigrams(full))
+
+        ref = self.SEPARATOR.join([cache_key, str(position)])
+        return [u'{}:{}{}{}'.format(kind, value, self.SEPARATOR, ref) for (kind, value) in values]
+
+    def _items_entries(self, items):
+        entries = set()
+        for (cache_key, records) in items:
+            if isinstance(records, dict):
+                records = [records]
+            for (position, record) in enumerate(records):
+                entries.update(self.record_entries(cache_key, position, record))
+        return entries
+
+    def _set_list(self, entries):
+        if hasattr(self._cache, 'set'):
+            self._cache.set(self.index_key, entries)
+            self._cache.set(self.version_key, uuid.uuid4().hex)
+        elif hasattr(self._cache, 'update'):
+            self._cache.update({self.index_key: entries, self.version_key: uuid.uuid4().hex})
+        else:
+            raise AttributeError('cache does not appear to be dict-like')
+
+    def _get_list(self):
+        # only unpickle the list when another process has changed it
+        version = self._cache.get(self.version_key)
+        local = self._local_indexes.get(self.index_key)
+        if local and local[0] == version:
+            return local[1]
+        index = self._cache.get(self.index_key) or []
+        self._local_indexes[self.index_key] = (version, index)
+        return index
+
+    def build(self, items, keep_prefixes=()):
+        """
+        Replaces the index with entries for each (cache_key, records) pair in items
+        records may be a list of dicts, or a single dict
+        Records already indexed under keep_prefixes are re-indexed from the cache, instead of dropped
+        @return  the number of index entries
+        """
+        items = list(items)
+        for p in keep_prefixes:
+            kept_keys = list(collections.OrderedDict.fromkeys(k for (k, _) in self.prefix_range('key', p)))
+            kept_values = [self._cache.get(k) for k in kept_keys]
+            items.extend((k, v) for (k, v) in zip(kept_keys, kept_values) if v)
+        entries = self._items_entries(items)
+
+        redis_backend = self._redis_backend
+        if redis_backend:
+            # build under a temporary key and swap it in, so searches never see a partial index
+            index_key = redis_backend.key_prefix + self.index_key
+            building_key = index_key + ':building'
+            pipe = redis_backend._write_client.pipeline()
+            pipe.delete(building_key)
+            if entries:
+                pipe.zadd(building_key, dict.fromkeys(entries, 0))
+                pipe.rename(building_key, index_key)
+            else:
+                pipe.delete(index_key)
+            pipe.execute()
+        else:
+            self._set_list(sorted(entries))
+
+        log.info('indexed %d entries in %s' % (len(entries), self.index_key))
+        return len(entries)
+
+    def add(self, items):
+        """
+        Adds entries for each (cache_key, records) pair in items to the existing index
+        Used for records cached on demand, like OpenStates and OpenNorth lookups
+        """
+        entries = self._items_entries(items)
+        if not entries:
+            return 0
+
+        redis_backend = self._redis_backend
+        if redis_backend:
+            index_key = redis_backend.key_prefix + self.index_key
+            redis_backend._write_client.zadd(index_key, dict.fromkeys(entries, 0))
+        else:
+            index = self._get_list()
+            if entries.issubset(index):
+                return 0
+            self._set_list(sorted(entries.union(index)))
+        return len(entries)
+
+    def _range(self, min_value, max_value, count=None):
+        """
+        @return  index entries between min_value and max_value, using redis lex range syntax
+        ie [value is inclusive, (value is exclusive
+        """
+        redis_backend = self._redis_backend
+        if redis_backend:
+            index_key = redis_backend.key_prefix + self.index_key
+            if count is None:
+                entries = redis_backend._read_clients.zrangebylex(index_key, min_value, max_value)
+            else:
+                entries = redis_backend._read_clients.zrangebylex(index_key, min_value, max_value, start=0, num=count)
+            return [e.decode('utf-8') for e in entries]
+
+        index = self._get_list()
+        if min_value.startswith('('):
+            lo = bisect_right(index, min_value[1:])
+        else:
+            lo = bisect_left(index, min_value[1:])
+        if max_value.startswith('('):
+            hi = bisect_left(index, max_value[1:])
+        else:
+            hi = bisect_right(index, max_value[1:])
+        if count is not None:
+            hi = min(hi, lo + count)
+        return index[lo:hi]
+
+    def _parse(self, entry):
+        (_, cache_key, position) = entry.rsplit(self.SEPARATOR, 2)
+        return (cache_key, int(position))
+
+    def _key_entry(self, ref):
+        (cache_key, position) = ref
+        return self.SEPARATOR.join([u'key:' + cache_key, cache_key, str(position)])
+
+    def prefix_range(self, kind, prefix):
+        """
+        @return  a list of (cache_key, position) references, for entries of kind starting with prefix
+        """
+        start = u'{}:{}'.format(kind, prefix)
+        # weird redis syntax for min/max
+        return [self._parse(e) for e in self._range(u'[' + start, u'(' + start + u'\xff')]
+
+    def match_name(self, query, fuzzy=False):
+        """
+        Matches records by name, either by a prefix of any name token or the full name,
+        or fuzzily by the share of query trigrams found in the record name
+        @return  a set of (cache_key, position) references
+        """
+        tokens = name_tokens(query)
+        if not tokens:
+            return set()
+        if not fuzzy:
+            return set(self.prefix_range('name', u' '.join(tokens)))
+
+        query_trigrams = trigrams(tokens)
+        counts = collections.Counter()
+        for t in query_trigrams:
+            counts.update(set(self.prefix_range('trigram', t + self.SEPARATOR)))
+        return set(ref for (ref, n) in counts.items()
+            if float(n) / len(query_trigrams) >= self.FUZZY_THRESHOLD)
+
+    def encode_cursor(self, entry):
+        return base64.urlsafe_b64encode(entry.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        except (ValueError, UnicodeError):
+            raise ValueError('invalid cursor %s' % cursor)
+
+    def search(self, prefixes, filters=None, limit=None, cursor=None, fuzzy=False):
+        """
+        Finds records with cache keys starting with any of prefixes,
+        matching all (field, value) prefix filters on indexed fields
+        The name field matches any name token, or fuzzily if fuzzy is set
+
+        Results are ordered by key, and paged by limit with an opaque cursor
+        @return  a list of (cache_key, position) references, and the cursor for the next page or None
+        """
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        prefixes = sorted(set(prefixes))
+        after = self.decode_cursor(cursor) if cursor else None
+        # fetch one extra entry to know if there is a next page
+        count = limit + 1 if limit else None
+
+        if filters:
+            # drive from the filtered references, which are bounded by the filter prefixes
+            matched = None
+            for (field, value) in filters:
+                if field not in self.FIELDS:
+                    raise ValueError('field %s is not indexed' % field)
+                if field == 'name':
+                    refs = self.match_name(value, fuzzy)
+                else:
+                    refs = set(self.prefix_range(field, fold(value)))
+                matched = refs if matched is None else matched & refs
+            entries = sorted(self._key_entry(r) for r in matched
+                if any(r[0].startswith(p) for p in prefixes))
+            if after:
+                entries = entries[bisect_right(entries, after):]
+            if count:
+                entries = entries[:count]
+        else:
+            # walk the key ranges in order, reading only as many entries as needed
+            entries = []
+            for p in prefixes:
+                start = u'key:' + p
+                end = start + u'\xff'
+                if after and after >= end:
+                    continue
+                if after and after >= start:
+                    min_value = u'(' + after
+                else:
+                    min_value = u'[' + start
+                remaining = count - len(entries) if count else None
+                entries.extend(self._range(min_value, u'(' + end, remaining))
+                if entries:
+                    after = entries[-1]
+                if count and len(entries) >= count:
+                    break
+
+        next_cursor = None
+        if count and len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = self.encode_cursor(entries[-1])
+        return ([self._parse(e) for e in entries], next_cursor)
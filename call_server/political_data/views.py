@@ -2,7 +2,6 @@ from flask import (Blueprint, request, jsonify)
 from flask_login import login_required
 
 from ..extensions import cache
-from ..utils import ignore_accents
 from . import get_country_data
 
 import logging
@@ -10,6 +9,9 @@ import logging
 log = logging.getLogger(__name__)
 political_data = Blueprint('political_data', __name__, url_prefix='/political_data')
 
+SEARCH_LIMIT = 100
+SEARCH_LIMIT_MAX = 500
+
 # all political_data routes require login
 @political_data.before_request
 @login_required
@@ -25,28 +27,49 @@ def search():
         return jsonify({'status': 'error',
                         'message': 'unable to search '+country})
 
-    keys = request.args.getlist('key')
+    # search by name across all keys, unless limited
+    name = request.args.get('name')
+    keys = request.args.getlist('key') or ([''] if name else [])
     if not keys:
         return jsonify({'status': 'error',
-                        'message': 'no key provided'})
-
-    results = []
-    for k in keys:
-        results.extend(data_provider.cache_search(k))
+                        'message': 'no key or name provided'})
 
-    filters = request.args.getlist('filter')
-    for f in filters:
+    filters = []
+    for f in request.args.getlist('filter'):
         try:
             field, value = f.split('=')
-            value = ignore_accents(value.lower()) # ensure comparison ignores accented characters
-            results = [d for d in results if ignore_accents(d[field]).lower().startswith(value)]
+            filters.append((field, value))
         except ValueError as e:
           log.error(e)
           continue
+    if name:
+        filters.append(('name', name))
+    fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true')
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', SEARCH_LIMIT)), SEARCH_LIMIT_MAX))
+    except ValueError:
+        return jsonify({'status': 'error',
+                        'message': 'limit must be a number'})
+    cursor = request.args.get('cursor')
+
+    # matched against the search index, built by loadpoliticaldata
+    try:
+        results, next_cursor = data_provider.cache_search_page(keys, filters, limit, cursor, fuzzy)
+    except ValueError as e:
+        return jsonify({'status': 'error',
+                        'message': str(e)})
+
+    # limit response to requested fields
+    fields = request.args.get('fields')
+    if fields:
+        fields = fields.split(',')
+        results = [dict((f, r[f]) for f in fields if f in r) for r in results]
 
     return jsonify({
         'status': 'ok',
-        'results': results
+        'results': results,
+        'next_cursor': next_cursor
     })
 
 @political_data.route('/search/openstates')
@@ -0,0 +1,146 @@
+from datetime import datetime, time, timedelta
+import random
+
+from flask import current_app
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
+from sqlalchemy import or_
+
+from ..extensions import db, cache, rq
+from ..caching import acquire_lock, release_lock
+from ..campaign.models import Campaign
+from ..campaign.constants import STATUS_LIVE
+
+from ..call.service import CallDeferred
+from .models import ScheduleCall, place_scheduled_call
+
+# the last minute dispatched, so a late or missed tick picks up where the previous one stopped
+KEY_DISPATCHED_THROUGH = 'schedule:dispatched_through'
+DISPATCHER_NAME = 'schedule:dispatch_scheduled_calls'
+# scheduled calls are placed monday to friday, UTC
+WEEKDAYS = (0, 1, 2, 3, 4)
+
+
+def due_windows(start, end):
+    """
+    Split the minutes from start through end into (time_from, time_to) windows for each day,
+    skipping days that aren't WEEKDAYS
+    """
+    windows = []
+    day_start = start
+    while day_start <= end:
+        day_end = min(end, datetime.combine(day_start.date(), time(23, 59)))
+        if day_start.weekday() in WEEKDAYS:
+            windows.append((day_start.time(), day_end.time().replace(second=59, microsecond=999999)))
+        day_start = datetime.combine(day_start.date() + timedelta(days=1), time(0, 0))
+    return windows
+
+
+def due_calls(windows):
+    # uses the index on time_to_call, so each tick only reads calls due in its window
+    return (db.session.query(ScheduleCall.id)
+        .join(Campaign)
+        .filter(ScheduleCall.subscribed == True)
+        # calls with a job_id are still placed by their own cron job, until migrate_legacy_jobs runs
+        .filter(ScheduleCall.job_id == None)
+        .filter(Campaign.status_code == STATUS_LIVE)
+        .filter(or_(*[ScheduleCall.time_to_call.between(time_from, time_to)
+                      for (time_from, time_to) in windows])))
+
+
+@rq.job(timeout=10*60)
+def dispatch_scheduled_calls(now=None):
+    """
+    Runs every minute, and enqueues scheduled calls due since the last run in batches
+    Batches after the first are delayed by up to SCHEDULE_DISPATCH_JITTER seconds, to spread the load
+    Only one tick dispatches at a time, a tick that runs alongside it does nothing and the next one catches up
+    """
+    now = (now or datetime.utcnow()).replace(second=0, microsecond=0)
+    catchup = timedelta(minutes=current_app.config.get('SCHEDULE_DISPATCH_CATCHUP', 10))
+    token = acquire_lock(DISPATCHER_NAME, catchup.total_seconds())
+    if not token:
+        current_app.logger.info('another tick is dispatching scheduled calls, skipping %s' % now)
+        return 0
+    try:
+        return _dispatch(now, catchup)
+    finally:
+        release_lock(DISPATCHER_NAME, token)
+
+
+def _dispatch(now, catchup):
+    dispatched_through = cache.get(KEY_DISPATCHED_THROUGH)
+    if dispatched_through and dispatched_through >= now:
+        # already ran for this minute
+        return 0
+    start = max(dispatched_through + timedelta(minutes=1), now - catchup) if dispatched_through else now
+    cache.set(KEY_DISPATCHED_THROUGH, now, timeout=catchup.total_seconds() * 2)
+
+    windows = due_windows(start, now)
+    if not windows:
+        return 0
+    schedule_call_ids = [row.id for row in due_calls(windows)]
+    random.shuffle(schedule_call_ids)
+
+    batch_size = current_app.config.get('SCHEDULE_DISPATCH_BATCH_SIZE', 50)
+    jitter = current_app.config.get('SCHEDULE_DISPATCH_JITTER', 30)
+    for n in range(0, len(schedule_call_ids), batch_size):
+        batch = schedule_call_ids[n:n+batch_size]
+        if n == 0 or not jitter:
+            create_scheduled_calls.queue(batch)
+        else:
+            create_scheduled_calls.schedule(timedelta(seconds=random.uniform(0, jitter)), batch)
+
+    current_app.logger.info('dispatched %d scheduled calls for %s through %s' % (len(schedule_call_ids), start, now))
+    return len(schedule_call_ids)
+
+
+@rq.job(timeout=10*60)
+def create_scheduled_calls(schedule_call_ids):
+    placed = 0
+    scheduled_calls = (ScheduleCall.query
+        .filter(ScheduleCall.id.in_(schedule_call_ids))
+        .filter(ScheduleCall.subscribed == True)
+        .all())
+    for (n, scheduled_call) in enumerate(scheduled_calls):
+        try:
+            if place_scheduled_call(scheduled_call):
+                placed += 1
+        except CallDeferred as e:
+            # the dial queue is backed up, so put the rest of the batch back for later
+            remaining = [sc.id for sc in scheduled_calls[n:]]
+            current_app.logger.info('deferring %d scheduled calls for %.1fs' % (len(remaining), e.retry_after))
+            create_scheduled_calls.schedule(timedelta(seconds=e.retry_after), remaining)
+            break
+    return placed
+
+
+def migrate_legacy_jobs(campaign=None):
+    """
+    Move subscribed calls from their own cron jobs to the dispatcher
+    keeping the location from the old job arguments
+    Returns the number of calls moved
+    """
+    scheduled_calls = (ScheduleCall.query
+        .filter(ScheduleCall.subscribed == True)
+        .filter(ScheduleCall.job_id != None))
+    if campaign:
+        scheduled_calls = scheduled_calls.filter(ScheduleCall.campaign_id == campaign.id)
+
+    moved = 0
+    for sc in scheduled_calls.all():
+        try:
+            legacy_job = Job.fetch(sc.job_id, connection=rq.connection)
+            location = legacy_job.args[2] if len(legacy_job.args) > 2 else None
+        except NoSuchJobError:
+            location = None
+        current_app.logger.info('moving job %s to the dispatcher' % sc.job_id)
+        sc.start_job(location=location)
+        db.session.add(sc)
+        moved += 1
+    db.session.commit()
+    return moved
+
+
+def schedule_dispatcher():
+    # cron jobs are named, so rescheduling replaces the existing job
+    return dispatch_scheduled_calls.cron('* * * * *', DISPATCHER_NAME)
@@ -1,8 +1,7 @@
-from flask import url_for
-import requests
 import logging
 
 from ..campaign.models import Campaign
+from ..campaign.constants import STRING_LEN
 from ..utils import utc_now
 from ..extensions import db, rq
 from sqlalchemy_utils.types import phone_number
@@ -16,7 +15,7 @@ class ScheduleCall(db.Model):
     created_at = db.Column(db.DateTime(timezone=True))
     subscribed = db.Column(db.Boolean, default=True)
 
-    time_to_call = db.Column(db.Time()) # should be UTC
+    time_to_call = db.Column(db.Time(), index=True) # should be UTC
     last_called  = db.Column(db.DateTime(timezone=True))
     num_calls = db.Column(db.Integer, default=0)
 
@@ -24,8 +23,9 @@ class ScheduleCall(db.Model):
     campaign = db.relationship('Campaign', backref=db.backref('scheduled_call_subscribed', lazy='dynamic'))
 
     phone_number = db.Column(phone_number.PhoneNumberType())
+    location = db.Column(db.String(STRING_LEN))
 
-    job_id = db.Column(db.String(36)) # UUID4
+    job_id = db.Column(db.String(36)) # UUID4, only set for calls scheduled before the dispatcher
 
     def __init__(self, campaign_id, phone_number, time):
         self.created_at = utc_now()
@@ -44,32 +44,27 @@ class ScheduleCall(db.Model):
         return self.phone_number.e164
 
     def start_job(self, location=None):
+        # subscribed calls are placed by the minute dispatcher, at time_to_call on weekdays
+        # see schedule.jobs.dispatch_scheduled_calls
         self.subscribed = True
-        weekdays = 'mon,tue,wed,thu,fri'
-        minute = self.time_to_call.minute
-        hour = self.time_to_call.hour
-        # TODO, set a max limit on the number of executions?
-        crontab = '{minute} {hour} {day_of_month} {month} {days_of_week}'.format(
-            minute=minute,
-            hour=hour,
-            day_of_month='*',
-            month='*',
-            days_of_week=weekdays)
-        cron_job = create_call.cron(crontab, self._function_name, self.campaign_id, self.phone_number.e164, location)
-        self.job_id = cron_job.id
+        if location:
+            self.location = location
+        self.cancel_legacy_job()
 
     def stop_job(self):
         self.subscribed = False
-        rq.get_scheduler().cancel(self.job_id)
+        self.cancel_legacy_job()
+
+    def cancel_legacy_job(self):
+        # calls used to be scheduled with one cron job each
+        if self.job_id:
+            rq.get_scheduler().cancel(self.job_id)
+            self.job_id = None
+
 
 @rq.job
 def create_call(campaign_id, phone, location):
-    params = {
-        'campaignId': campaign_id,
-        'userPhone': phone,
-        'userLocation': location,
-        'scheduled': True
-    }
+    # kept for cron jobs scheduled before the dispatcher
     campaign = Campaign.query.get(campaign_id)
     if campaign.status != 'live':
         # do not place scheduled calls for paused or archived campaigns
@@ -78,21 +73,38 @@ def create_call(campaign_id, phone, location):
     scheduled_call = ScheduleCall.query.filter_by(campaign_id=campaign.id, phone_number=phone, subscribed=True).first()
     if not scheduled_call:
         return None
+    return place_scheduled_call(scheduled_call, location)
+
+
+def place_scheduled_call(scheduled_call, location=None):
+    # dial the user directly from the worker, through the same call service as /call/create
+    from ..call.service import place_call, call_params, CallError, CallDeferred
+    from ..call.dial_queue import PRIORITY_SCHEDULED
+    from ..admin.models import is_admin_phone
+
+    phone = scheduled_call.user_phone()
+    params = call_params(scheduled_call.campaign, phone,
+        user_location=location or scheduled_call.location,
+        scheduled=True)
+    # this happens outside request context, so can't get the logger from current_app
+    logger = logging.getLogger("rq.worker")
+    try:
+        placed = place_call(scheduled_call.campaign, params,
+            rate_limit_exempt=is_admin_phone(phone),
+            priority=PRIORITY_SCHEDULED)
+    except CallDeferred:
+        # let the caller try again later
+        raise
+    except CallError as e:
+        logger.error('unable to place scheduled call for %s: %s' % (scheduled_call, e.message))
+        return False
 
-    from ..admin.models import Blocklist
-    if Blocklist.user_blocked(phone, user_ip=None):
-        # the calls are coming from inside the building...
+    if placed.status == 'failed':
+        logger.error('scheduled call for %s failed' % scheduled_call)
         return False
 
-    resp = requests.get(url_for('call.create', _external=True, **params))
-    if resp.status_code == 200:
-        scheduled_call.num_calls += 1
-        scheduled_call.last_called = utc_now()
-        db.session.add(scheduled_call)
-        db.session.commit()
-        return True
-    else:
-        # this happens outside application context, so can't get the logger from current_app
-        logger = logging.getLogger("rq.worker")
-        logger.error('unable to execute scheduled create_call: %s "%s"' % (resp.url, resp.content))
-        return False
\ No newline at end of file
+    scheduled_call.num_calls += 1
+    scheduled_call.last_called = utc_now()
+    db.session.add(scheduled_call)
+    db.session.commit()
+    return True
@@ -1,11 +1,16 @@
 from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
+from ..phones import PhoneResolver
+
 class CRMIntegration(object):
     BATCH_ALL_CALLS_IN_SESSION = False
 
     def __init__(self, *args, **kwargs):
         self.twilio_client = current_app.config['TWILIO_CLIENT']
+        # caches get_phone results for this integration instance
+        self.phone_resolver = PhoneResolver(self)
 
     def get_phone(self, twilio_sid):
         """Gets the dialed phone for a Session from Twilio in e164 format"""
@@ -29,6 +34,35 @@ class CRMIntegration(object):
         Returns a tuple of (boolean status, string message)"""
         raise NotImplementedError()
 
+    def save_actions(self, batch, crm_campaign_id, crm_campaign_key=None):
+        """Given a list of (call, crm_user) tuples, crm_campaign_id and optional crm_campaign_key
+        Save each call to the CRM, with concurrent requests
+        Returns a list of (status, message) tuples in batch order, with status None if saving raised an error"""
+        app = current_app._get_current_object()
+
+        def save(item):
+            (call, crm_user) = item
+            with app.app_context():
+                try:
+                    return self.save_action(call, crm_campaign_id, crm_user, crm_campaign_key)
+                except Exception as e:
+                    current_app.logger.error('unable to save action for call %s: %s' % (call.id, e))
+                    return (None, str(e))
+
+        # sync_calls already hands us one batch at a time, so post it all at once
+        workers = current_app.config.get('CRM_SYNC_WORKERS', 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(save, batch))
+
+    def pool_connections(self, session):
+        """Size a requests session's connection pool to the sync workers,
+        so concurrent posts reuse keep-alive connections instead of opening new ones"""
+        workers = current_app.config.get('CRM_SYNC_WORKERS', 4)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def save_campaign_meta(self, crm_campaign_id, meta):
         """Given a crm_campaign
         Save aggregate call counts to the CRM
@@ -1,5 +1,8 @@
 from flask import current_app
+import requests
+import threading
 
+from ...extensions import cache
 from . import CRMIntegration
 from actionkit.rest import ActionKit
 from actionkit.xmlrpc import ActionKitXML
@@ -9,9 +12,21 @@ import logging
 logger = logging.getLogger("rq.worker")
 
 class ActionKitIntegration(CRMIntegration):
+    # (country, state, type, first, last) to target id, one entry per target shared between sync runs
+    # so concurrent syncs each add their new targets without overwriting the others
+    KEY_TARGET_ID = 'sync:actionkit:target_id:{key}'
+    # set once the full target list has been loaded into the entries above
+    KEY_TARGET_IDS_LOADED = 'sync:actionkit:target_ids_loaded'
+    TARGET_IDS_TIMEOUT = 60*60*24
+    TARGET_PAGE_SIZE = 100
 
     def __init__(self, domain, username, api_key=None, password=None):
         super(ActionKitIntegration, self).__init__()
+        self._target_ids = None  # loaded on first use
+        self._target_data = {}
+        self._data_providers = {}
+        self._target_lock = threading.Lock()
+
         if api_key:
             self.ak_client = ActionKit(instance=domain, username=username, api_key=api_key)
             self.ak_rpc = ActionKitXML(instance=domain, username=username, api_key=api_key)
@@ -21,6 +36,11 @@ class ActionKitIntegration(CRMIntegration):
         else:
             raise Exception('unable to authenticate to ActionKit')
 
+        # keep-alive connections for concurrent save_actions, if the client exposes its session
+        ak_session = getattr(self.ak_client, 'session', None)
+        if isinstance(ak_session, requests.Session):
+            self.pool_connections(ak_session)
+
     def get_user(self, phone_number):
         """Gets a user from ActionKit with the given phone number
         Returns user dict"""
@@ -39,17 +59,30 @@ class ActionKitIntegration(CRMIntegration):
         else:
             return None
 
+    def _get_data_provider(self, campaign):
+        # one data provider per country, instead of per call
+        if campaign.country_code not in self._data_providers:
+            self._data_providers[campaign.country_code] = campaign.get_country_data()
+        return self._data_providers[campaign.country_code]
+
     def _match_ak_target_data(self, campaign, target):
         """Look up a target in our political_data cache
-        Returns a tuple to match actionkit's target.type and state values"""
+        Returns a tuple to match actionkit's target.type and state values
+        Memoized by target for this sync run"""
+        if target.id in self._target_data:
+            return self._target_data[target.id]
+
         target_type = None
         target_state = None
 
         if campaign.country_code.upper() == 'US':
             # look up target in political_data
-            data_provider = campaign.get_country_data()
+            data_provider = self._get_data_provider(campaign)
             target_data = data_provider.cache_get(target.key)
-            
+            if isinstance(target_data, list):
+                # bioguide keys are cached as a list of records
+                target_data = target_data[0] if target_data else {}
+
             if campaign.campaign_type == 'congress':
                 target_state = target_data.get('state', '')
 
@@ -71,38 +104,70 @@ class ActionKitIntegration(CRMIntegration):
         if not target_state:
             target_state = ''
 
-        return (campaign.country_code, target_state, target_type, target.name)
-
+        self._target_data[target.id] = (campaign.country_code, target_state, target_type, target.name)
+        return self._target_data[target.id]
+
+    def _target_key(self, country, state, target_type, first_name, last_name):
+        return u'|'.join([country or '', state or '', target_type or '', first_name or '', last_name or '']).lower()
+
+    def _load_target_ids(self):
+        """Loads a map of target keys to ActionKit target ids
+        Empty if the cache was already warmed, otherwise with one paged list of all targets"""
+        if cache.get(self.KEY_TARGET_IDS_LOADED):
+            return {}
+
+        target_ids = {}
+        offset = 0
+        while True:
+            response = self.ak_client.target.list(_limit=self.TARGET_PAGE_SIZE, _offset=offset)
+            for t in response['objects']:
+                key = self._target_key(t.get('country'), t.get('state'), t.get('type'), t.get('first'), t.get('last'))
+                target_ids[key] = t['id']
+            if not response.get('meta', {}).get('next'):
+                break
+            offset += self.TARGET_PAGE_SIZE
+        logger.info("loaded %d targets from actionkit" % len(target_ids))
+
+        cache.set_many(dict((self.KEY_TARGET_ID.format(key=key), target_id)
+                            for (key, target_id) in target_ids.items()),
+                       timeout=self.TARGET_IDS_TIMEOUT)
+        cache.set(self.KEY_TARGET_IDS_LOADED, True, timeout=self.TARGET_IDS_TIMEOUT)
+        return target_ids
 
     def _get_target_id(self, country, state, target_type, target_name):
         """Gets a target from ActionKit in the given country, state, type (senate, house, custom), and first/last name
         Returns a target ID"""
 
-        # match in actionkit by country, state and type
-        # these are the only indexed fields
-        target_data = {'country': country,
-                       'state': state,
-                       'type': target_type}
-        ak_targets_list = self.ak_client.target.list(**target_data)['objects']
-
-        # check list of possible matches from actionkit by first+last name
         first_name, last_name = target_name.split(' ')
-        ak_target = None
-        for t in ak_targets_list:
-            if t['last'] == last_name and t['first'] == first_name:
-                ak_target = t
-                logger.info("found target: %s" % target_name) 
-        if not ak_target:
-            # it doesn't exist, create it
-            target_data['last'] = last_name
-            target_data['first'] = first_name
-            if target_type == 'parliament':
-                target_data['title'] = 'MP'
-            if target_type == 'governor':
-                target_data['title'] = 'Governor'
-            logger.info("creating target: %s" % target_data)
-            ak_target = self.ak_client.target.create(target_data)
-        return ak_target['id']
+        key = self._target_key(country, state, target_type, first_name, last_name)
+
+        # workers share the target map, and must not create the same target twice
+        with self._target_lock:
+            if self._target_ids is None:
+                self._target_ids = self._load_target_ids()
+
+            target_id = self._target_ids.get(key)
+            if target_id is None:
+                # may have been loaded or created by another sync run
+                target_id = cache.get(self.KEY_TARGET_ID.format(key=key))
+            if target_id is None:
+                # it doesn't exist, create it
+                target_data = {'country': country,
+                               'state': state,
+                               'type': target_type,
+                               'last': last_name,
+                               'first': first_name}
+                if target_type == 'parliament':
+                    target_data['title'] = 'MP'
+                if target_type == 'governor':
+                    target_data['title'] = 'Governor'
+                logger.info("creating target: %s" % target_data)
+                ak_target = self.ak_client.target.create(target_data)
+                target_id = ak_target['id']
+                cache.set(self.KEY_TARGET_ID.format(key=key), target_id, timeout=self.TARGET_IDS_TIMEOUT)
+
+            self._target_ids[key] = target_id
+        return target_id
 
 
     def save_action(self, call, crm_campaign_id, crm_user, crm_campaign_key=None):
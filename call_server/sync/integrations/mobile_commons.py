@@ -1,5 +1,7 @@
 from flask import current_app
 
+import io
+import threading
 import requests
 from xml.etree import ElementTree
 from requests.auth import HTTPBasicAuth
@@ -8,6 +10,8 @@ import dateutil.parser
 
 from call_server.utils import utc_now
 
+from ...extensions import cache
+from ...call.models import Session
 from . import CRMIntegration
 
 import logging
@@ -17,11 +21,18 @@ class MobileCommonsIntegration(CRMIntegration):
     BATCH_ALL_CALLS_IN_SESSION = True
     # this forces the SyncCampaign to save only the first call in a session, to avoid duplicates
 
+    # profile status and subscriptions to one campaign, kept briefly for repeat callers
+    # keyed by the hashed phone, like call sessions, so numbers don't end up in key names
+    KEY_PROFILE = 'sync:mobilecommons:profile:{phone_hash}:{campaign_id}'
+    PROFILE_TIMEOUT = 60*10
+
     def __init__(self, username, password):
         super(MobileCommonsIntegration, self).__init__()
+        self._lock = threading.Lock()
+        self._profile_locks = {}
         if username and password:
-            self.mc_api = sessions.BaseUrlSession(
-                base_url='https://secure.mcommons.com')
+            self.mc_api = self.pool_connections(sessions.BaseUrlSession(
+                base_url='https://secure.mcommons.com'))
             self.mc_api.auth = HTTPBasicAuth(username, password)
         else:
             raise Exception('unable to authenticate to MobileCommons')
@@ -34,12 +45,48 @@ class MobileCommonsIntegration(CRMIntegration):
             'phone': phone_number
         }
 
-    def ok_to_subscribe_user(self, crm_campaign_id, crm_user):
-        # check user profile for existing subscription or opt-out
-        # returns (bool, message)
-        # True to go ahead
-        # False if we should stop
-        # None if there isn't an existing user in the CRM
+    def _profile_lock(self, key):
+        with self._lock:
+            return self._profile_locks.setdefault(key, threading.Lock())
+
+    def _parse_profile(self, content, crm_campaign_id):
+        """Parse an /api/profile response incrementally
+        Returns a dict of profile status and the subscriptions for crm_campaign_id only,
+        or None if there is no profile"""
+        state = None
+        path = []  # tags from the response root to the current element
+        for (event, elem) in ElementTree.iterparse(io.BytesIO(content), events=('start', 'end')):
+            if event == 'start':
+                path.append(elem.tag)
+                if path[1:] == ['profile']:
+                    state = {'status': None, 'subscriptions': []}
+                continue
+
+            if path[1:] == ['profile', 'status']:
+                state['status'] = elem.text
+            elif path[1:] == ['profile', 'subscriptions', 'subscription']:
+                if elem.get('campaign_id') == crm_campaign_id:
+                    state['subscriptions'].append({
+                        'created_at': dateutil.parser.isoparse(elem.get('created_at')),
+                        'status': elem.get('status')
+                    })
+                # don't keep subscriptions to other campaigns in the tree
+                elem.clear()
+            path.pop()
+        return state
+
+    def _profile_key(self, crm_campaign_id, crm_user):
+        return self.KEY_PROFILE.format(phone_hash=Session.hash_phone(crm_user['phone']), campaign_id=crm_campaign_id)
+
+    def get_profile(self, crm_campaign_id, crm_user):
+        """Get the user's profile status and subscriptions to crm_campaign_id
+        Cached briefly by phone and campaign, so repeat callers only hit /api/profile once
+        Returns (state, message), with state False if the response could not be parsed"""
+        key = self._profile_key(crm_campaign_id, crm_user)
+        state = cache.get(key)
+        if state is not None:
+            return (state, None)
+
         data = {
             'phone_number': crm_user['phone'],
             'company': current_app.config.get('MOBILE_COMMONS_COMPANY')
@@ -47,31 +94,31 @@ class MobileCommonsIntegration(CRMIntegration):
 
         response = self.mc_api.get('/api/profile', params=data)
         try:
-            results = ElementTree.fromstring(response.content)
+            profile = self._parse_profile(response.content, crm_campaign_id)
             logger.debug('mobilecommons /api/profile response %s' % response.content)
         except ElementTree.ParseError:
             logger.info('get mobilecommons /api/profile %s' % data)
             logger.error('unable to parse response: %s' % response.content)
             return (False, 'parse error')
 
-        user_profile = results.find('profile')
-        if user_profile is None:
-            # not yet subscribed, ok to go ahead
-            return (True, None)
+        # cache an empty profile too, so new users aren't looked up again
+        state = profile or {'status': None, 'subscriptions': []}
+        cache.set(key, state, timeout=self.PROFILE_TIMEOUT)
+        return (state, None)
 
-        user_status = user_profile.find('status').text
-        profile_subscriptions = user_profile.find('subscriptions')
-        campaign_subscriptions = []
-        for s in profile_subscriptions:
-            if s.get('campaign_id') == crm_campaign_id:
-                # copy matching subscriptions to a local list, so we can sort and reverse
-                campaign_subscriptions.append({
-                    'created_at': dateutil.parser.isoparse(s.get('created_at')),
-                    'status': s.get('status')    
-                })
+    def ok_to_subscribe_user(self, crm_campaign_id, crm_user):
+        # check user profile for existing subscription or opt-out
+        # returns (bool, message)
+        # True to go ahead
+        # False if we should stop
+        # None if there isn't an existing user in the CRM
+        (state, message) = self.get_profile(crm_campaign_id, crm_user)
+        if state is False:
+            return (False, message)
 
+        campaign_subscriptions = state['subscriptions']
         if not campaign_subscriptions:
-            # no current subscriptions, no need to check further
+            # not yet subscribed, or no current subscriptions, no need to check further
             return (True, None)
 
         # should already be ordered by created_at, double check tho
@@ -99,6 +146,14 @@ class MobileCommonsIntegration(CRMIntegration):
         # no flags? go ahead
         return (True, None)
 
+    def _record_prompt(self, crm_campaign_id, crm_user):
+        # update the cached profile in place after a successful profile_update,
+        # instead of fetching it again for the user's next call
+        key = self._profile_key(crm_campaign_id, crm_user)
+        state = cache.get(key) or {'status': None, 'subscriptions': []}
+        state['subscriptions'].append({'created_at': utc_now(), 'status': None})
+        cache.set(key, state, timeout=self.PROFILE_TIMEOUT)
+
 
     def save_action(self, call, crm_campaign_id, crm_user, crm_campaign_key):
         """Given a crm_user and crm_campaign_id (opt in path)
@@ -107,6 +162,11 @@ class MobileCommonsIntegration(CRMIntegration):
 
         logger.debug('save_action (%s) to campaign (%s)' % (crm_user['phone'], crm_campaign_id))
 
+        # one worker at a time per phone and campaign, so repeat callers see the updated profile
+        with self._profile_lock((crm_user['phone'], crm_campaign_id)):
+            return self._save_action(crm_campaign_id, crm_user, crm_campaign_key)
+
+    def _save_action(self, crm_campaign_id, crm_user, crm_campaign_key):
         (ok, message) = self.ok_to_subscribe_user(crm_campaign_id, crm_user)
         if not ok:
             logger.info('not ok to subscribe user (%s) to campaign (%s)' % (crm_user['phone'], crm_campaign_id))
@@ -128,7 +188,9 @@ class MobileCommonsIntegration(CRMIntegration):
             return (False, 'parse error')
 
         success = (results.get('success') == 'true')
-        if not success:
+        if success:
+            self._record_prompt(crm_campaign_id, crm_user)
+        else:
             message = results.find('error').get('message')
 
         return (success, message)
@@ -14,8 +14,10 @@ class RogueIntegration(CRMIntegration):
     def __init__(self, domain, api_key):
         super(RogueIntegration, self).__init__()
         if api_key:
-            self.rogue_session = sessions.BaseUrlSession(
-                base_url='https://'+domain)
+            # domain may include a scheme, otherwise https
+            base_url = domain if '://' in domain else 'https://'+domain
+            self.rogue_session = self.pool_connections(sessions.BaseUrlSession(
+                base_url=base_url))
             self.rogue_session.headers={
                 'X-DS-Importer-API-Key': api_key,
                 'Accept': 'application/json'
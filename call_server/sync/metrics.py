@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from ..extensions import cache
+
+# recent runs per campaign, newest first
+KEY_SYNC_METRICS = 'sync:metrics:{campaign_id}'
+SYNC_METRICS_HISTORY = 24
+SYNC_METRICS_TIMEOUT = 60*60*24*7
+
+
+def run_metrics(campaign_id, stats):
+    """
+    Summarize the stats from one SyncCampaign.sync_calls run
+    Time is grouped by where it went: twilio, crm and db
+    """
+    seconds = stats['seconds']
+    lag_count = stats.get('lag_count', 0)
+    return {
+        'campaign_id': campaign_id,
+        'finished_at': datetime.utcnow(),
+        'examined': stats['examined'],
+        'synced': stats['saved'],
+        'not_saved': stats['calls'] - stats['saved'],
+        'skipped': stats['skipped'],
+        'failed': stats['errors'],
+        'retries': stats['retries'],
+        'retry_queue': stats.get('retry_queue', 0),
+        'batches': stats['batches'],
+        'twilio_requests': stats['twilio_requests'],
+        'seconds': {
+            'twilio': seconds['twilio'],
+            'crm': seconds['crm_user'] + seconds['crm_action'],
+            'db': seconds['query'] + seconds['commit'],
+            'total': seconds['total'],
+        },
+        # seconds between each synced call's timestamp and this run
+        'lag': {
+            'mean': stats.get('lag_total', 0) / lag_count if lag_count else None,
+            'max': stats.get('lag_max') if lag_count else None,
+        },
+        'calls_per_second': stats['examined'] / seconds['total'] if seconds['total'] else None,
+    }
+
+
+def record_sync_metrics(campaign_id, stats):
+    metrics = run_metrics(campaign_id, stats)
+    key = KEY_SYNC_METRICS.format(campaign_id=campaign_id)
+    history = cache.get(key) or []
+    cache.set(key, [metrics] + history[:SYNC_METRICS_HISTORY-1], timeout=SYNC_METRICS_TIMEOUT)
+    return metrics
+
+
+def get_sync_metrics(campaign_id):
+    """Returns metrics for the recent sync runs of a campaign, newest first"""
+    return cache.get(KEY_SYNC_METRICS.format(campaign_id=campaign_id)) or []
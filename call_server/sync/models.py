@@ -1,13 +1,21 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import collections
+import pytz
+import time
 
 from flask import current_app
+from sqlalchemy.orm import joinedload
 
 from ..extensions import db, rq
+from ..utils import utc_now
 
 from ..call.models import Call
 from ..campaign.models import Campaign
 
 from .integrations import get_crm_integration
+from .metrics import record_sync_metrics
 from .constants import SCHEDULE_IMMEDIATE, SCHEDULE_HOURLY, SCHEDULE_NIGHTLY
 
 class SyncCampaign(db.Model):
@@ -24,6 +32,7 @@ class SyncCampaign(db.Model):
 
     crm_id = db.Column(db.String(40), nullable=True) # id of the campaign in the CRM
     crm_key = db.Column(db.String(40), nullable=True) # some CRMs require a per-campaign key to post
+    last_call_id = db.Column(db.Integer, nullable=True) # high-water mark, calls up to here have been read
 
     def __init__(self, campaign_id):
         self.campaign_id = campaign_id
@@ -71,45 +80,112 @@ class SyncCampaign(db.Model):
             return False
 
     def sync_calls(self):
-        # sync all calls for campaign which don't already have a SyncCall
+        # sync new calls for campaign, above the last_call_id watermark, and retry failed ones
+        # in id-ordered batches, with the Twilio and CRM user lookups spread over a pool of worker threads
+        # and each batch of actions saved together with integration.save_actions
 
         # currently integration is global
         # TBD, should it be configurable per SyncCampaign
         integration = get_crm_integration()
 
-        unsynced_calls = Call.query.filter_by(campaign=self.campaign, sync_call=None)
-        if len(unsynced_calls.all()) == 0:
-            current_app.logger.info('no calls to sync, exiting early')
-            return None
-        else:
-            current_app.logger.info('{} calls to sync'.format(len(unsynced_calls.all())))
-        for call in unsynced_calls:
-            # guard for changes after unsynced_call query
-            if call.sync_call.first():
-                current_app.logger.info('{} has an existing sync_call, continuing'.format(call.id))
-                continue
-
-            sync_call = SyncCall(call.id)
-            result = sync_call.save_to_crm(self, integration)
-            if result:
-                db.session.add(sync_call)
-
-            if integration.BATCH_ALL_CALLS_IN_SESSION:
-                # get all the other calls in this session
-                # create SyncCalls for them too, but skip save_to_crm
-                other_calls_in_session = Call.query.filter(
-                    Call.session_id==call.session_id,
-                    Call.campaign_id==self.campaign.id,
-                    Call.id!=call.id
-                )
-                for other_call in other_calls_in_session:
-                    skip_sync = SyncCall(other_call.id)
-                    # don't save_to_crm here
-                    skip_sync.saved = False
-                    db.session.add(skip_sync)
-            db.session.commit()
-
-        completed_calls = Call.query.filter_by(campaign=self, status='completed')
+        batch_size = current_app.config.get('CRM_SYNC_BATCH_SIZE', 100)
+        workers = current_app.config.get('CRM_SYNC_WORKERS', 4)
+        app = current_app._get_current_object()
+
+        # query, dispatch, crm_action and commit are wall clock seconds
+        # twilio and crm_user are summed across workers
+        stats = {'examined': 0, 'calls': 0, 'saved': 0, 'skipped': 0, 'errors': 0, 'retries': 0, 'batches': 0,
+                 'twilio_requests': 0, 'lag_total': 0, 'lag_max': 0, 'lag_count': 0, 'seconds': collections.Counter()}
+        sync_started = time.time()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # first the retry queue, which only holds calls that failed on earlier runs
+            last_sync_call_id = 0
+            while True:
+                with stage_timer(stats['seconds'], 'query'):
+                    retry_calls = (SyncCall.query
+                        .join(SyncCall.call)
+                        .filter(Call.campaign_id == self.campaign_id)
+                        .filter(SyncCall.retry == True)
+                        .filter(SyncCall.id > last_sync_call_id)
+                        .options(joinedload(SyncCall.call).joinedload(Call.campaign),
+                                 joinedload(SyncCall.call).joinedload(Call.target),
+                                 joinedload(SyncCall.call).joinedload(Call.session))
+                        .order_by(SyncCall.id)
+                        .limit(batch_size)
+                        .all())
+                if not retry_calls:
+                    break
+                last_sync_call_id = retry_calls[-1].id
+                stats['batches'] += 1
+                stats['retries'] += len(retry_calls)
+                stats['examined'] += len(retry_calls)
+
+                self._sync_batch(retry_calls, integration, executor, app, stats)
+                with stage_timer(stats['seconds'], 'commit'):
+                    db.session.commit()
+
+            # then new calls, so each run only reads calls above the watermark
+            # less a window of ids below it, because ids are assigned before commit
+            # and a call committed late may have a lower id than ones already synced
+            window = current_app.config.get('CRM_SYNC_WATERMARK_WINDOW', 500)
+            last_call_id = max(0, (self.last_call_id or 0) - window)
+            while True:
+                with stage_timer(stats['seconds'], 'query'):
+                    # load everything save_action reads, so workers never lazy load from the session
+                    # (this also refreshes our own crm_id and crm_key, expired by the last commit)
+                    calls = (Call.query
+                        .filter(Call.campaign_id == self.campaign_id)
+                        .filter(Call.id > last_call_id)
+                        .filter(~Call.sync_call.any())
+                        .options(joinedload(Call.campaign), joinedload(Call.target), joinedload(Call.session))
+                        .order_by(Call.id)
+                        .limit(batch_size)
+                        .all())
+                if not calls:
+                    break
+                last_call_id = calls[-1].id
+                stats['batches'] += 1
+                stats['examined'] += len(calls)
+
+                if integration.BATCH_ALL_CALLS_IN_SESSION:
+                    # only save the first call in each session
+                    calls_to_save = []
+                    seen_sessions = set()
+                    for call in calls:
+                        if call.session_id is None or call.session_id not in seen_sessions:
+                            calls_to_save.append(call)
+                            seen_sessions.add(call.session_id)
+                else:
+                    calls_to_save = calls
+
+                sync_calls = [SyncCall(call.id, call) for call in calls_to_save]
+                self._sync_batch(sync_calls, integration, executor, app, stats)
+
+                with stage_timer(stats['seconds'], 'commit'):
+                    if integration.BATCH_ALL_CALLS_IN_SESSION:
+                        # create SyncCalls for the other calls in these sessions too, but skip save_to_crm
+                        session_ids = set(sc.call.session_id for sc in sync_calls)
+                        session_ids.discard(None)
+                        if session_ids:
+                            other_calls_in_session = (Call.query
+                                .filter(Call.session_id.in_(session_ids))
+                                .filter(Call.campaign_id == self.campaign_id)
+                                .filter(~Call.sync_call.any())
+                                .filter(~Call.id.in_([sc.call_id for sc in sync_calls]))
+                            )
+                            for other_call in other_calls_in_session:
+                                skip_sync = SyncCall(other_call.id, other_call)
+                                # don't save_to_crm here
+                                skip_sync.saved = False
+                                db.session.add(skip_sync)
+                                stats['skipped'] += 1
+
+                    # every call up to here has a SyncCall now, saved or queued for retry
+                    self.last_call_id = max(self.last_call_id or 0, last_call_id)
+                    db.session.commit()
+
+        completed_calls = Call.query.filter_by(campaign_id=self.campaign_id, status='completed')
         try:
             integration.save_campaign_meta(self.crm_id, {'count': completed_calls.count()})
         except NotImplementedError:
@@ -118,6 +194,104 @@ class SyncCampaign(db.Model):
         db.session.add(self)
         db.session.commit()
 
+        stats['retry_queue'] = (SyncCall.query
+            .join(SyncCall.call)
+            .filter(Call.campaign_id == self.campaign_id)
+            .filter(SyncCall.retry == True)
+            .count())
+        stats['twilio_requests'] = integration.phone_resolver.twilio_requests
+        stats['seconds']['total'] = time.time() - sync_started
+        record_sync_metrics(self.campaign_id, stats)
+        current_app.logger.info('synced campaign {}: {calls} calls in {batches} batches, {saved} saved, {skipped} skipped, {errors} errors, {retries} retries, {twilio_requests} twilio requests'.format(
+            self.campaign_id, **stats))
+        current_app.logger.info('sync timings: {}'.format(
+            ', '.join('{}={:.2f}s'.format(stage, t) for (stage, t) in sorted(stats['seconds'].items()))))
+        return stats
+
+    def _sync_batch(self, sync_calls, integration, executor, app, stats):
+        # look up users in the worker pool, then save the batch of actions together
+        # however the integration prefers
+        with stage_timer(stats['seconds'], 'dispatch'):
+            users = list(executor.map(
+                lambda sync_call: _get_crm_user_in_context(app, sync_call, integration),
+                sync_calls))
+
+        to_save = []
+        errors = {}
+        for (sync_call, (crm_user, error, timings)) in zip(sync_calls, users):
+            stats['seconds'].update(timings)
+            if error:
+                errors[sync_call] = error
+            elif crm_user:
+                to_save.append((sync_call, crm_user))
+            else:
+                # the caller may be matched later, so try again like an error, up to the same attempts
+                errors[sync_call] = 'no crm user found'
+        if to_save:
+            with stage_timer(stats['seconds'], 'crm_action'):
+                actions = integration.save_actions([(sc.call, crm_user) for (sc, crm_user) in to_save],
+                    self.crm_id, self.crm_key)
+            for ((sync_call, crm_user), (saved, message)) in zip(to_save, actions):
+                if saved is None:
+                    errors[sync_call] = message
+                    continue
+                (sync_call.saved, sync_call.crm_message) = (saved, message)
+                current_app.logger.info('synced call %s by %s. action saved=%s' % (sync_call.call.id, crm_user['id'], saved))
+
+        max_attempts = current_app.config.get('CRM_SYNC_MAX_ATTEMPTS', 5)
+        for sync_call in sync_calls:
+            sync_call.attempts = (sync_call.attempts or 0) + 1
+            if sync_call in errors:
+                # raised an error, queue to try again next time, unless we've run out of attempts
+                sync_call.saved = False
+                sync_call.crm_message = errors[sync_call]
+                sync_call.retry = sync_call.attempts < max_attempts
+                stats['errors'] += 1
+            else:
+                sync_call.retry = False
+                stats['calls'] += 1
+                if sync_call.saved:
+                    stats['saved'] += 1
+                    lag = sync_lag(sync_call.call)
+                    if lag is not None:
+                        stats['lag_total'] += lag
+                        stats['lag_max'] = max(stats['lag_max'], lag)
+                        stats['lag_count'] += 1
+            db.session.add(sync_call)
+
+
+@contextmanager
+def stage_timer(timings, stage):
+    started = time.time()
+    try:
+        yield
+    finally:
+        timings[stage] += time.time() - started
+
+
+def sync_lag(call):
+    # seconds from the call to now, call timestamps are stored in UTC
+    if not call.timestamp:
+        return None
+    timestamp = call.timestamp
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=pytz.utc)
+    return (utc_now() - timestamp).total_seconds()
+
+
+def _get_crm_user_in_context(app, sync_call, integration):
+    # runs in a worker thread
+    # returns (crm_user, error message, per-stage timings), with crm_user None if not found or the lookup raised an error
+    timings = collections.Counter()
+    error = None
+    with app.app_context():
+        try:
+            crm_user = sync_call.get_crm_user(integration, timings)
+        except Exception as e:
+            current_app.logger.error('unable to sync call %s: %s' % (sync_call.call_id, e))
+            (crm_user, error) = (None, str(e) or e.__class__.__name__)
+    return (crm_user, error, timings)
+
 
 class SyncCall(db.Model):
     __tablename__ = 'sync_call'
@@ -125,36 +299,54 @@ class SyncCall(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     created_time = db.Column(db.DateTime, default=datetime.utcnow)
 
-    call_id = db.Column(db.ForeignKey('calls.id'))
+    call_id = db.Column(db.ForeignKey('calls.id'), index=True)
     call = db.relationship('Call', backref=db.backref('sync_call', lazy='dynamic'))
 
     saved = db.Column(db.Boolean, default=False)
     crm_message = db.Column(db.String())
 
-    def __init__(self, call_id):
+    # failed calls stay queued for the next sync, up to CRM_SYNC_MAX_ATTEMPTS
+    retry = db.Column(db.Boolean, default=False, index=True)
+    attempts = db.Column(db.Integer, default=0)
+
+    def __init__(self, call_id, call=None):
         self.call_id = call_id
-        self.call = Call.query.get(self.call_id)
+        self.call = call or Call.query.get(self.call_id)
 
-    def save_to_crm(self, sync_campaign, integration):
+    def get_crm_user(self, integration, timings=None):
         # we only keep a hash of the phone locally, for privacy
-        # so hit twilio to get the actual phone to match to the CRM
-        
+        # so hit twilio to get the actual phone to match to the CRM, once per session
+        if timings is None:
+            timings = collections.Counter()
+
         if self.call:
             twilio_sid = self.call.call_id
-            user_phone = integration.get_phone(twilio_sid)
+            with stage_timer(timings, 'twilio'):
+                user_phone = integration.phone_resolver.get_phone(self.call)
         else:
             current_app.logger.warning('unable to get twilio_sid for call: %s' % self.call)
-            return False
+            return None
 
         if not user_phone:
             current_app.logger.warning('unable to get user_phone for twilio_sid: %s' % twilio_sid)
-            return False
+            return None
 
-        crm_user = integration.get_user(user_phone)
+        with stage_timer(timings, 'crm_user'):
+            crm_user = integration.get_user(user_phone)
         if not crm_user:
             current_app.logger.warning('unable to get crm user for phone: %s' % user_phone)
+            return None
+        return crm_user
+
+    def save_to_crm(self, sync_campaign, integration, timings=None):
+        if timings is None:
+            timings = collections.Counter()
+
+        crm_user = self.get_crm_user(integration, timings)
+        if not crm_user:
             return False
 
-        (self.saved, self.crm_message) = integration.save_action(self.call, sync_campaign.crm_id, crm_user, sync_campaign.crm_key)
+        with stage_timer(timings, 'crm_action'):
+            (self.saved, self.crm_message) = integration.save_action(self.call, sync_campaign.crm_id, crm_user, sync_campaign.crm_key)
         current_app.logger.info('synced call %s by %s. action saved=%s' % (self.call.id, crm_user['id'], self.saved))
         return True
@@ -0,0 +1,86 @@
+from flask import current_app
+import threading
+
+from ..extensions import cache
+
+import logging
+logger = logging.getLogger("rq.worker")
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    logger.info('install cryptography to keep encrypted phone numbers between CRM syncs')
+    Fernet = None
+
+
+class PhoneResolver(object):
+    """
+    Resolves the user phone number for synced calls, with at most one Twilio request per session
+
+    All calls in a session share the parent CallSid of the user's call, so results are kept
+    by session id and by call sid for the length of a sync run.
+    If LOG_PHONE_NUMBERS and PHONE_ENCRYPTION_KEY are set, they are also kept encrypted in the cache,
+    so later syncs don't need to hit Twilio again.
+    """
+    KEY_PHONE = 'sync:phone:{sid}'
+
+    def __init__(self, integration):
+        self.integration = integration
+        self.by_session = {}
+        self.by_sid = {}
+        self.twilio_requests = 0
+        self._lock = threading.Lock()
+        self._sid_locks = {}
+
+        self.fernet = None
+        encryption_key = current_app.config.get('PHONE_ENCRYPTION_KEY')
+        if current_app.config.get('LOG_PHONE_NUMBERS') and encryption_key and Fernet:
+            self.fernet = Fernet(encryption_key)
+        self.timeout = current_app.config.get('PHONE_ENCRYPTION_TIMEOUT')
+
+    def _sid_lock(self, twilio_sid):
+        with self._lock:
+            return self._sid_locks.setdefault(twilio_sid, threading.Lock())
+
+    def _get_encrypted(self, twilio_sid):
+        if not self.fernet:
+            return None
+        token = cache.get(self.KEY_PHONE.format(sid=twilio_sid))
+        if not token:
+            return None
+        try:
+            return self.fernet.decrypt(token).decode('utf-8')
+        except InvalidToken:
+            logger.warning('unable to decrypt phone for twilio_sid: %s' % twilio_sid)
+            return None
+
+    def _set_encrypted(self, twilio_sid, phone):
+        if self.fernet:
+            token = self.fernet.encrypt(phone.encode('utf-8'))
+            cache.set(self.KEY_PHONE.format(sid=twilio_sid), token, timeout=self.timeout)
+
+    def get_phone(self, call):
+        """Gets the user phone for a call in e164 format, or None"""
+        phone = self.by_session.get(call.session_id) or self.by_sid.get(call.call_id)
+        if phone:
+            return phone
+
+        twilio_sid = call.call_id
+        if not twilio_sid:
+            return None
+
+        # only one worker fetches each sid, others wait for its result
+        with self._sid_lock(twilio_sid):
+            phone = self.by_sid.get(twilio_sid) or self._get_encrypted(twilio_sid)
+            if not phone:
+                with self._lock:
+                    self.twilio_requests += 1
+                phone = self.integration.get_phone(twilio_sid)
+                if phone:
+                    self._set_encrypted(twilio_sid, phone)
+
+            if phone:
+                self.by_sid[twilio_sid] = phone
+                if call.session_id:
+                    self.by_session[call.session_id] = phone
+        return phone
@@ -4,6 +4,8 @@ from flask_login import login_required
 from datetime import datetime, timedelta
 
 from .jobs import sync_campaigns
+from .models import SyncCampaign
+from .metrics import get_sync_metrics
 
 sync = Blueprint('sync', __name__, url_prefix='/admin/crmsync')
 
@@ -21,4 +23,19 @@ def manual_job(campaign_id):
     start_time = datetime.now() + timedelta(seconds=1)
     sync_campaigns.schedule(start_time, campaign_id, timeout=60*60)
 
-    return jsonify({'scheduled_start_time': start_time})
\ No newline at end of file
+    return jsonify({'scheduled_start_time': start_time})
+
+
+@sync.route('/metrics.json', methods=['GET'])
+def metrics():
+    # most recent run for each synced campaign
+    latest = {}
+    for sync_campaign in SyncCampaign.query.all():
+        runs = get_sync_metrics(sync_campaign.campaign_id)
+        latest[sync_campaign.campaign_id] = runs[0] if runs else None
+    return jsonify({'campaigns': latest})
+
+
+@sync.route('/<int:campaign_id>/metrics.json', methods=['GET'])
+def campaign_metrics(campaign_id):
+    return jsonify({'campaign_id': campaign_id, 'runs': get_sync_metrics(campaign_id)})
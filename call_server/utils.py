@@ -3,7 +3,10 @@ from flask import current_app, flash
 
 import itertools
 import json
+import os
+import pickle
 import pytz
+import tempfile
 import unicodedata
 import yaml
 import yaml.constructor
@@ -173,3 +176,36 @@ class OrderedDictYAMLLoader(yaml.Loader):
             value = self.construct_object(value_node, deep=deep)
             mapping[key] = value
         return mapping
+
+
+def load_instance_yaml(app, filename):
+    """
+    Loads a YAML file from the instance folder into ordered dicts
+    Compiled once to a pickle alongside it, which is used while the YAML is unchanged
+    """
+    path = os.path.join(app.instance_path, filename)
+    compiled_path = os.path.join(app.instance_path, '.%s.pickle' % filename)
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    try:
+        with open(compiled_path, 'rb') as f:
+            (compiled_version, data) = pickle.load(f)
+        if compiled_version == version:
+            return data
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    with open(path, 'rb') as f:
+        data = yaml.load(f.read(), Loader=OrderedDictYAMLLoader)
+    # written to a temp file and moved into place, so workers starting together never read half a pickle
+    temp_path = None
+    try:
+        (fd, temp_path) = tempfile.mkstemp(prefix='.%s.' % filename, dir=app.instance_path)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((version, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, compiled_path)
+    except (IOError, OSError):
+        app.logger.info('unable to save compiled %s' % filename)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+    return data
@@ -7,7 +7,7 @@ import alembic
 import alembic.config, alembic.command
 
 from call_server.app import create_app
-from call_server.extensions import assets, db, cache, rq
+from call_server.extensions import assets, db, cache
 from call_server import political_data
 from call_server import sync
 from call_server.user import User, USER_ADMIN, USER_ACTIVE
@@ -75,10 +75,11 @@ def stop_scheduled_calls(campaign_id, date):
 @click.argument('campaign_id', default='all')
 @click.option('--accept_all', default=False, help='skip ')
 def restart_scheduled_calls(campaign_id, accept_all=False):
-    # rebind outgoing recurring calls
+    # move outgoing recurring calls from their own cron jobs to the dispatcher
     from call_server.campaign import Campaign
     from call_server.campaign.constants import STATUS_LIVE
     from call_server.schedule import ScheduleCall
+    from call_server.schedule.jobs import migrate_legacy_jobs, schedule_dispatcher
 
     if campaign_id == 'all':
         campaigns = Campaign.query.filter_by(prompt_schedule=True, status_code=STATUS_LIVE).all()
@@ -92,18 +93,32 @@ def restart_scheduled_calls(campaign_id, accept_all=False):
         confirm = input('Confirm (Y/N): ')
     if confirm == 'Y':
         for campaign in campaigns:
-            scheduled_calls = ScheduleCall.query.filter_by(campaign=campaign, subscribed=True).all()
-            print('Scheduled calls for {}: {}'.format(campaign.name, len(scheduled_calls)))
-            rq_scheduler = rq.get_scheduler()
-            for sc in scheduled_calls:
-                if not sc.job_id in rq_scheduler:
-                    print("resetting job", sc.job_id)
-                    sc.start_job()
-                    db.session.add(sc)
-            db.session.commit()
-            print("done")
-        else:
-            print("exit")
+            scheduled_calls = ScheduleCall.query.filter_by(campaign=campaign, subscribed=True).count()
+            print('Scheduled calls for {}: {}'.format(campaign.name, scheduled_calls))
+            print('moved {} jobs'.format(migrate_legacy_jobs(campaign)))
+        job = schedule_dispatcher()
+        print("scheduled", job.id)
+        print("done")
+    else:
+        print("exit")
+
+@app.cli.command()
+def scheduledispatcher():
+    """Schedule the dispatcher for recurring calls, and move any calls left on their own cron jobs to it"""
+    from call_server.schedule.jobs import migrate_legacy_jobs, schedule_dispatcher
+    with app.app_context():
+        moved = migrate_legacy_jobs()
+        job = schedule_dispatcher()
+    app.logger.info("moved %d legacy jobs, scheduled %s" % (moved, job.id))
+
+@app.cli.command()
+def dashboardmetrics():
+    """Schedule periodic refresh of admin dashboard call counts"""
+    from call_server.admin.jobs import schedule_dashboard_metrics, refresh_dashboard_metrics
+    with app.app_context():
+        job = schedule_dashboard_metrics()
+        refresh_dashboard_metrics()
+    app.logger.info("scheduled %s" % job.id)
 
 @app.cli.command()
 @click.argument('campaigns', default='all')
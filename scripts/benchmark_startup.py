@@ -0,0 +1,58 @@
+"""
+Measures cold start time of the app, each run in a fresh python process
+Reports median and best seconds to import call_server.app, run create_app, and run a `flask` CLI command
+
+    python scripts/benchmark_startup.py [--runs 10] [--config call_server.config.TestingConfig]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = """
+import json, time
+started = time.time()
+from call_server.app import create_app
+imported = time.time()
+app = create_app(%(config)r)
+created = time.time()
+print(json.dumps({'import': imported - started, 'create_app': created - imported}))
+"""
+
+
+def run_once(config):
+    output = subprocess.check_output([sys.executable, '-c', MEASURE % {'config': config}],
+                                     cwd=ROOT, stderr=subprocess.DEVNULL)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def run_cli(command):
+    started = time.time()
+    subprocess.check_call(['flask'] + command, cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.time() - started
+
+
+def summary(name, timings):
+    return '%-12s median %.3fs  best %.3fs' % (name, statistics.median(timings), min(timings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--config', default='call_server.config.TestingConfig')
+    parser.add_argument('--cli', default='routes', help='flask command to time, empty to skip')
+    args = parser.parse_args()
+
+    runs = [run_once(args.config) for n in range(args.runs)]
+    print(summary('import', [r['import'] for r in runs]))
+    print(summary('create_app', [r['create_app'] for r in runs]))
+    print(summary('total', [r['import'] + r['create_app'] for r in runs]))
+    if args.cli:
+        os.environ.setdefault('FLASK_APP', 'manager.py')
+        print(summary('flask ' + args.cli, [run_cli(args.cli.split()) for n in range(args.runs)]))
@@ -0,0 +1,194 @@
+"""
+Replays the Twilio webhook sequence of a call for each campaign type against the app, with the Flask test client
+/call/create, then connection, make_calls, make_single and complete for each target, and status_callback as the
+call rings and completes. Twilio is the in-process fake, target lookup is stubbed, the database is seeded fresh,
+and redis is fakeredis when it can run lua
+
+Reports p50/p95/p99 latency and the most queries a request ran by endpoint, after a warm-up call that isn't counted,
+and exits 1 on a regression from the baseline
+Latencies depend on the machine, so update the baseline on the one that checks it
+
+    python scripts/benchmark_webhooks.py [--runs 50] [--database-uri sqlite://] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from call_server.app import create_app
+from call_server.config import TestingConfig
+from call_server.extensions import db, cache
+from call_server.instrumentation import QueryCounter
+from call_server.fake_twilio import FakeTwilioClient, TwilioDriver
+from call_server.campaign.models import Campaign, Target, TwilioPhoneNumber
+from call_server.campaign.constants import (STATUS_LIVE, SEGMENT_BY_CUSTOM, SEGMENT_BY_LOCATION,
+                                            LOCATION_POSTAL)
+
+BASELINE = os.path.join(ROOT, 'scripts', 'benchmark_webhooks_baseline.json')
+ENDPOINTS = ('create', 'connection', 'make_calls', 'make_single', 'complete', 'status_callback')
+N_TARGETS = 3
+
+
+def use_fakeredis(app):
+    """Swap the cache for a redis backend on fakeredis, if it can run the dial queue's lua scripts"""
+    try:
+        import fakeredis
+        from flask_caching.backends.rediscache import RedisCache
+    except ImportError:
+        return False
+    client = fakeredis.FakeStrictRedis()
+    try:
+        client.eval('return 1', 0)
+    except Exception:
+        return False
+    backend = RedisCache(key_prefix='benchmark:')
+    backend._write_client = backend._read_clients = client
+    app.extensions['cache'][cache] = backend
+    return True
+
+
+def seed(scenario):
+    """A live campaign with targets, segmented for the scenario"""
+    targets = []
+    for n in range(N_TARGETS):
+        target = Target(key='custom:benchmark-%d' % n, name='Target %d' % n, title='Rep',
+                        number='+1415555%04d' % n, location='capitol')
+        db.session.add(target)
+        targets.append(target)
+    campaign = Campaign(name='Benchmark %s' % scenario, country_code='us', campaign_language='en',
+                        campaign_type='custom', status_code=STATUS_LIVE)
+    if scenario == 'location':
+        campaign.segment_by = SEGMENT_BY_LOCATION
+        campaign.locate_by = LOCATION_POSTAL
+    else:
+        campaign.segment_by = SEGMENT_BY_CUSTOM
+        campaign.target_set = targets
+    campaign.phone_number_set = [TwilioPhoneNumber(number='+14155550100')]
+    db.session.add(campaign)
+    db.session.commit()
+    return (campaign, [t.key for t in targets])
+
+
+class Recorder(TwilioDriver):
+    """Latency and query count of each request, by endpoint"""
+
+    def __init__(self, client, twilio_client):
+        super(Recorder, self).__init__(client, twilio_client)
+        self.query_counts = defaultdict(list)
+
+    def post(self, url, data):
+        with QueryCounter() as queries:
+            body = super(Recorder, self).post(url, data)
+        self.query_counts[self.webhook_name(url)].append(queries.count)
+        return body
+
+
+def replay_call(recorder, campaign, user_phone):
+    recorder.post('/call/create', {'campaignId': campaign.id, 'userPhone': user_phone, 'userLocation': '94110'})
+    recorder.run_queued()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(recorder):
+    results = {}
+    for endpoint in ENDPOINTS:
+        timings = recorder.timings[endpoint]
+        results[endpoint] = {
+            'requests': len(timings),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+            'queries': max(recorder.query_counts[endpoint]),
+        }
+    return results
+
+
+def benchmark_app(database_uri):
+    config = type('BenchmarkConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'INSTRUMENTATION': False,
+    })
+    app = create_app(config)
+    app.ADMIN_PHONES_LIST = set()
+    app.config['TWILIO_CLIENT'] = FakeTwilioClient()
+    return app
+
+
+def run_scenario(app, scenario, runs):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+        (campaign, target_keys) = seed(scenario)
+
+        recorder = Recorder(app.test_client(), app.config['TWILIO_CLIENT'])
+        with mock.patch('call_server.call.views.locate_targets', return_value=target_keys):
+            # the first call runs one-off queries against cold caches, so it isn't counted
+            replay_call(Recorder(app.test_client(), app.config['TWILIO_CLIENT']), campaign, '+14156669999')
+            for n in range(runs):
+                replay_call(recorder, campaign, '+1415666%04d' % n)
+        db.session.remove()
+        db.drop_all()
+    return summarize(recorder)
+
+
+def regressions(results, baseline, tolerance):
+    """Endpoints slower than the baseline p95 by more than tolerance, or running more queries"""
+    found = []
+    for (scenario, endpoints) in results.items():
+        for (endpoint, result) in endpoints.items():
+            expected = baseline.get(scenario, {}).get(endpoint)
+            if not expected:
+                continue
+            if result['queries'] > expected['queries']:
+                found.append('%s %s: %d queries, baseline %d' % (
+                    scenario, endpoint, result['queries'], expected['queries']))
+            # a millisecond of slack, so the fastest endpoints don't fail on noise
+            if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + 1:
+                found.append('%s %s: p95 %.2fms, baseline %.2fms' % (
+                    scenario, endpoint, result['p95_ms'], expected['p95_ms']))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=50, help='calls to replay for each campaign type')
+    parser.add_argument('--scenarios', default='custom,location')
+    parser.add_argument('--database-uri', default='sqlite://', help='emptied before and after each scenario')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed p95 slowdown, as a fraction')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    app = benchmark_app(args.database_uri)
+    redis = use_fakeredis(app)
+    results = {}
+    for scenario in args.scenarios.split(','):
+        results[scenario] = run_scenario(app, scenario, args.runs)
+        print('%s campaign, %d calls, %s cache' % (scenario, args.runs, 'fakeredis' if redis else 'simple'))
+        for endpoint in ENDPOINTS:
+            print('  %-16s p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %2d queries' % (
+                (endpoint,) + tuple(results[scenario][endpoint][k] for k in ('p50_ms', 'p95_ms', 'p99_ms', 'queries'))))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % args.baseline)
+        sys.exit(0)
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        if found:
+            print('regressions from baseline:\n  ' + '\n  '.join(found))
+            sys.exit(1)
+        print('no regressions from baseline')
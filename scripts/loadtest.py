@@ -0,0 +1,439 @@
+"""
+Simulates campaign launch traffic against a locally running app, to size its workers, threads and database pool
+Simulated users load the embed script and count, or place a call and answer Twilio's webhooks for it, in --mix
+Twilio, the geocoder and OpenStates are replaced by one local fake server, with --latency added to each
+
+The app has to send its Twilio, geocoder and OpenStates requests to the fake server, so either let this start it
+
+    python scripts/loadtest.py --campaign 1 --app-command "gunicorn call_server.wsgi:application -c gunicorn.conf"
+
+or start it yourself with the environment printed by --print-env, and point --host at it
+
+Calls the dial queue defers are placed by a worker, so run `flask rq worker` against the app too
+
+Reports throughput, errors and latency by request, and from the app's /api/metrics the database pool's peak use
+against its capacity and redis commands per call. Those are counted in each worker, so scrape a single worker for
+exact numbers, or pass --redis-url to count every redis command from the server
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+from twilio.base.exceptions import TwilioRestException
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from call_server.fake_twilio import FakeTwilioClient, TwilioDriver, TwilioDriverError
+
+# REST api query parameters the fake can filter calls by
+CALL_FILTERS = {'To': 'to', 'From': 'from_', 'Status': 'status', 'ParentCallSid': 'parent_call_sid'}
+
+# a state legislator for location campaigns, in the shape of the openstates graphql api
+FAKE_LEGISLATOR = {
+    'id': 'ocd-person/00000000-0000-0000-0000-000000000001',
+    'name': 'Pat Loadtest', 'givenName': 'Pat', 'familyName': 'Loadtest',
+    'chamber': [{
+        'post': {'label': '11', 'role': 'Senator', 'division': {'id': 'ocd-division/country:us/state:ca/sldu:11'}},
+        'organization': {'name': 'Senate', 'classification': 'upper'},
+    }],
+    'contactDetails': [{'value': '415-555-0199', 'note': 'Capitol Office', 'type': 'voice'}],
+}
+FAKE_PLACE = {
+    'place_id': 1, 'lat': '37.7749', 'lon': '-122.4194', 'display_name': 'San Francisco, California, USA',
+    'address': {'city': 'San Francisco', 'state': 'California', 'postcode': '94110',
+                'country': 'USA', 'country_code': 'us'},
+}
+
+
+class FakeServices(object):
+    """
+    Twilio's REST api, the Nominatim geocoder and the OpenStates graphql api on one local port
+    Twilio's api is served from a FakeTwilioClient, so users can find and answer the calls made to them
+    """
+
+    def __init__(self, port=0, latency=None):
+        self.latency = latency or {}
+        self.twilio = FakeTwilioClient(latency=self.latency.get('twilio', 0))
+        self._created = threading.Condition()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def environ(self):
+        """Environment for the app to use these services"""
+        return {
+            'TWILIO_API_BASE_URL': self.url,
+            'GEOCODE_PROVIDER': 'nominatim',
+            'GEOCODE_DOMAIN': self.url.split('://')[1],
+            'GEOCODE_SCHEME': 'http',
+            'OPENSTATES_URL': self.url + '/graphql',
+        }
+
+    def wait(self, service):
+        (low, high) = self.latency.get(service, (0, 0))
+        if high:
+            time.sleep(random.uniform(low, high))
+
+    def create_call(self, params):
+        call = self.twilio.calls.create(to=params.get('To', [None])[0], from_=params.get('From', [None])[0],
+                                        url=params.get('Url', [None])[0],
+                                        status_callback=params.get('StatusCallback', [None])[0],
+                                        status_callback_event=params.get('StatusCallbackEvent'))
+        with self._created:
+            self._created.notify_all()
+        return call
+
+    def call_to(self, phone, timeout=10):
+        """The call created to phone, once nobody has answered it, waiting for it up to timeout seconds"""
+        deadline = time.time() + timeout
+        with self._created:
+            call = self.twilio.calls.pop_queued(to=phone)
+            while call is None and time.time() < deadline:
+                self._created.wait(deadline - time.time())
+                call = self.twilio.calls.pop_queued(to=phone)
+            return call
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, data, status=200):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path.startswith('/2010-04-01/'):
+                    match = re.search(r'/(Calls|IncomingPhoneNumbers)/(\w+)\.json$', url.path)
+                    resources = (services.twilio.calls if 'Calls' in url.path
+                                 else services.twilio.incoming_phone_numbers)
+                    if match:
+                        try:
+                            return self.respond(resources.get(match.group(2)).to_json())
+                        except TwilioRestException:
+                            return self.respond({'status': 404}, 404)
+                    filters = dict((CALL_FILTERS[k], v[0]) for (k, v) in parse_qs(url.query).items()
+                                   if k in CALL_FILTERS)
+                    key = 'calls' if 'Calls' in url.path else 'incoming_phone_numbers'
+                    items = [i.to_json() for i in resources.list(**filters)]
+                    return self.respond({key: items, 'meta': {'key': key, 'next_page_url': None}})
+                if url.path in ('/search', '/reverse'):
+                    services.wait('geocode')
+                    place = dict(FAKE_PLACE)
+                    postcode = parse_qs(url.query).get('q', [''])[0]
+                    if postcode.isdigit():
+                        place['address'] = dict(place['address'], postcode=postcode)
+                    return self.respond([place] if url.path == '/search' else place)
+                self.respond({'status': 404}, 404)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                body = self.read_body()
+                if re.match(r'/2010-04-01/Accounts/(\w+)/Calls\.json$', url.path):
+                    return self.respond(services.create_call(parse_qs(body)).to_json(), 201)
+                if url.path == '/graphql':
+                    services.wait('openstates')
+                    query = json.loads(body or '{}').get('query', '')
+                    if 'people(' in query:
+                        data = {'people': {'edges': [{'node': dict(FAKE_LEGISLATOR)}]}}
+                    elif 'person(' in query:
+                        data = {'person': dict(FAKE_LEGISLATOR)}
+                    else:
+                        data = {}
+                    return self.respond({'data': data})
+                self.respond({'status': 404}, 404)
+
+        return Handler
+
+
+class Stats(object):
+    """Latency, errors and deferrals by request name, from every user thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.deferred = defaultdict(int)
+        self.calls = 0
+        self.failed_calls = 0
+
+    def record(self, name, elapsed, status):
+        with self._lock:
+            self.timings[name].append(elapsed)
+            if status in (429, 503):
+                self.deferred[name] += 1
+            elif status is None or status >= 400:
+                self.errors[name] += 1
+
+    def call_done(self, ok):
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.failed_calls += 1
+
+
+class User(object):
+    """One visitor to the campaign page, with its own connection"""
+
+    def __init__(self, host, campaign_id, stats, services, zipcode, timeout):
+        self.host = host.rstrip('/')
+        self.campaign_id = campaign_id
+        self.stats = stats
+        self.services = services
+        self.zipcode = zipcode
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, url, name, data=None):
+        if url.startswith('/'):
+            url = self.host + url
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, data=data, timeout=self.timeout, allow_redirects=False)
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - started, None)
+            return None
+        self.stats.record(name, time.perf_counter() - started, response.status_code)
+        return response
+
+    def view_embed(self):
+        self.request('GET', '/api/campaign/%d/embed.js' % self.campaign_id, 'embed.js')
+        self.request('GET', '/api/campaign/%d/count.json' % self.campaign_id, 'count.json')
+
+    def place_call(self):
+        phone = '+1415%07d' % random.randrange(10 ** 7)
+        response = self.request('POST', '/call/create', 'create', {
+            'campaignId': self.campaign_id, 'userPhone': phone, 'userCountry': 'US', 'userLocation': self.zipcode})
+        if response is None or response.status_code != 200:
+            # rate limited or failed, either way twilio never calls
+            return self.stats.call_done(response is not None and response.status_code in (429, 503))
+
+        call = self.services.call_to(phone)
+        if call is None:
+            return self.stats.call_done(False)
+        try:
+            Driver(self).run(call)
+        except TwilioDriverError:
+            return self.stats.call_done(False)
+        self.stats.call_done(True)
+
+
+class Driver(TwilioDriver):
+    """Answers a user's call over http, keeping each webhook in the run's stats"""
+
+    def __init__(self, user):
+        super(Driver, self).__init__(user.session, user.services.twilio, location=user.zipcode)
+        self.user = user
+
+    def post(self, url, data):
+        response = self.user.request('POST', url, self.webhook_name(url), data)
+        if response is None or response.status_code != 200:
+            raise TwilioDriverError(url)
+        return response.content
+
+    def wait(self):
+        self.user.services.wait('twilio')
+
+
+def run_users(args, services, stats):
+    (embed_weight, call_weight) = args.mix
+    stop = time.time() + args.duration
+
+    def loop(user):
+        while time.time() < stop:
+            if random.random() * (embed_weight + call_weight) < embed_weight:
+                user.view_embed()
+            else:
+                user.place_call()
+            if args.wait:
+                time.sleep(random.uniform(0, 2 * args.wait))
+
+    threads = []
+    for n in range(args.users):
+        user = User(args.host, args.campaign, stats, services, args.zipcode, args.timeout)
+        thread = threading.Thread(target=loop, args=(user,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        if args.spawn_rate:
+            time.sleep(1.0 / args.spawn_rate)
+    for thread in threads:
+        thread.join(args.duration + args.timeout * 20)
+
+
+def scrape_metrics(host, api_key):
+    """Sums of the app's prometheus metrics by name and labels, or None without an api key"""
+    if not api_key:
+        return None
+    try:
+        response = requests.get(host.rstrip('/') + '/api/metrics', params={'api_key': api_key}, timeout=10)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print('could not read /api/metrics: %s' % e)
+        return None
+    values = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith('#'):
+            (name, value) = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+def redis_commands(redis_url):
+    if not redis_url:
+        return None
+    import redis
+    return redis.StrictRedis.from_url(redis_url).info('stats')['total_commands_processed']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def report(stats, elapsed, before, after, redis_before, redis_after):
+    total = sum(len(t) for t in stats.timings.values())
+    errors = sum(stats.errors.values())
+    print('\n%d requests in %.1fs, %.1f/s, %d errors (%.2f%%), %d deferred by the dial queue' % (
+        total, elapsed, total / elapsed, errors, 100.0 * errors / max(total, 1), sum(stats.deferred.values())))
+    print('%d calls, %.2f/s, %d failed\n' % (stats.calls, stats.calls / elapsed, stats.failed_calls))
+    print('  %-18s %8s %8s %8s %9s %9s %9s' % ('request', 'count', 'errors', 'deferred', 'p50', 'p95', 'p99'))
+    for (name, timings) in sorted(stats.timings.items()):
+        print('  %-18s %8d %8d %8d %7.1fms %7.1fms %7.1fms' % (
+            name, len(timings), stats.errors[name], stats.deferred[name], percentile(timings, 0.5) * 1000,
+            percentile(timings, 0.95) * 1000, percentile(timings, 0.99) * 1000))
+
+    if after:
+        peak = after.get('callpower_db_pool_checked_out_peak')
+        capacity = after.get('callpower_db_pool_capacity')
+        if peak is not None:
+            print('\ndatabase pool: peak %d connections checked out of %s%s' % (
+                peak, '%d' % capacity if capacity else 'an unlimited pool',
+                ', saturated' if capacity and peak >= capacity else ''))
+
+        redis_by_endpoint = defaultdict(float)
+        for (name, value) in after.items():
+            match = re.match(r'callpower_request_component_calls_total\{component="redis",endpoint="([^"]+)"\}',
+                             name)
+            if match:
+                redis_by_endpoint[match.group(1)] += value - (before or {}).get(name, 0)
+        call_redis = sum(v for (endpoint, v) in redis_by_endpoint.items() if endpoint.startswith('call.'))
+        if stats.calls:
+            print('redis: %.1f commands per call in the call flow, as counted by the scraped worker' % (
+                call_redis / stats.calls))
+        for (endpoint, value) in sorted(redis_by_endpoint.items()):
+            print('  %-28s %d' % (endpoint, value))
+
+    if redis_after is not None and stats.calls:
+        print('redis server: %.1f commands per call, from every client' % (
+            (redis_after - redis_before) / stats.calls))
+
+
+def start_app(command, host, env):
+    """Start the app with env, and wait for it to answer"""
+    app = subprocess.Popen(shlex.split(command), cwd=ROOT, env=dict(os.environ, **env))
+    for n in range(60):
+        try:
+            requests.get(host, timeout=1)
+            return app
+        except requests.RequestException:
+            if app.poll() is not None:
+                sys.exit('app exited with %d' % app.returncode)
+            time.sleep(0.5)
+    app.terminate()
+    sys.exit('app did not answer at %s' % host)
+
+
+def parse_latency(value):
+    """twilio=0.2,geocode=0.05:0.3 as seconds, a single value or a low:high range"""
+    latency = {}
+    for part in filter(None, value.split(',')):
+        (service, seconds) = part.split('=')
+        (low, _, high) = seconds.partition(':')
+        latency[service] = (float(low), float(high or low))
+    return latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='http://127.0.0.1:5000')
+    parser.add_argument('--campaign', type=int, help='id of a live campaign with a phone number')
+    parser.add_argument('--users', type=int, default=20, help='simultaneous visitors')
+    parser.add_argument('--spawn-rate', type=float, default=5, help='visitors started per second')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--wait', type=float, default=1, help='mean seconds between a visitor\'s actions')
+    parser.add_argument('--mix', default='10:1', help='embed views to calls')
+    parser.add_argument('--zipcode', default='94110', help='entered for location campaigns')
+    parser.add_argument('--timeout', type=float, default=15, help='seconds, like the http-timeout of uwsgi.ini')
+    parser.add_argument('--latency', default='twilio=0.1:0.3,geocode=0.05:0.2,openstates=0.2:0.5',
+                        help='added by the fake services, in seconds or low:high ranges')
+    parser.add_argument('--fake-port', type=int, default=5901)
+    parser.add_argument('--api-key', default=os.environ.get('ADMIN_API_KEY'), help='to read /api/metrics')
+    parser.add_argument('--redis-url', help='to count the commands the redis server processed')
+    parser.add_argument('--app-command', help='start the app with the fake services\' environment')
+    parser.add_argument('--print-env', action='store_true', help='print the app\'s environment and exit')
+    args = parser.parse_args()
+    args.mix = tuple(float(n) for n in args.mix.split(':'))
+
+    services = FakeServices(args.fake_port, parse_latency(args.latency))
+    env = services.environ()
+    # let the dial queue keep up, so the load test measures the app and not the account's calls per second
+    env.update(TWILIO_CPS='1000', TWILIO_NUMBER_CPS='1000')
+    if args.print_env:
+        print('\n'.join('export %s=%s' % item for item in sorted(env.items())))
+        sys.exit(0)
+    if not args.campaign:
+        parser.error('--campaign is required')
+
+    services.start()
+    app = start_app(args.app_command, args.host, dict(env, ADMIN_API_KEY=args.api_key or '')) \
+        if args.app_command else None
+    try:
+        before = scrape_metrics(args.host, args.api_key)
+        redis_before = redis_commands(args.redis_url)
+        stats = Stats()
+        print('%d users for %ds against %s, fake services at %s' % (args.users, args.duration, args.host,
+                                                                    services.url))
+        started = time.time()
+        run_users(args, services, stats)
+        elapsed = time.time() - started
+        report(stats, elapsed, before, scrape_metrics(args.host, args.api_key),
+               redis_before, redis_commands(args.redis_url))
+    finally:
+        services.stop()
+        if app:
+            app.terminate()
+            app.wait()
@@ -0,0 +1,62 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+
+class MockCRMHandler(BaseHTTPRequestHandler):
+    # keep-alive, so tests can count connections reused by the integration
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        (status, response) = self.server.record(self, body)
+        payload = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # quiet logging
+        pass
+
+
+class MockCRMServer(ThreadingHTTPServer):
+    """
+    A local HTTP server recording the requests posted by CRM integrations
+    Responds with fail_status to any request whose JSON body matches fail_when
+    """
+    daemon_threads = True
+
+    def __init__(self, fail_when=None, fail_status=422):
+        super(MockCRMServer, self).__init__(('127.0.0.1', 0), MockCRMHandler)
+        self.fail_when = fail_when or {}
+        self.fail_status = fail_status
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def record(self, handler, body):
+        data = json.loads(body.decode('utf-8')) if body else {}
+        with self._lock:
+            self.requests.append((handler.path, data))
+            self.connections.add(handler.client_address)
+        if self.fail_when and all(data.get(k) == v for (k, v) in self.fail_when.items()):
+            return (self.fail_status, {'error': 'rejected'})
+        return (201, {'ok': True})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,48 @@
+import logging
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign
+from call_server.call.models import Call
+from call_server.admin.jobs import (DASHBOARD_METRICS_KEY, get_dashboard_metrics,
+    refresh_dashboard_metrics)
+
+
+class TestDashboardMetrics(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestDashboardMetrics, self).setUp(**kwargs)
+        cache.delete(DASHBOARD_METRICS_KEY)
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us')
+        db.session.add(self.campaign)
+        db.session.commit()
+
+        for status in ['completed', 'completed', 'busy']:
+            db.session.add(Call(None, self.campaign.id, None, status=status))
+        db.session.commit()
+
+    def test_refresh(self):
+        metrics = refresh_dashboard_metrics()
+        self.assertEqual(metrics['calls_by_campaign'], {self.campaign.id: 2})
+        self.assertEqual(metrics['calls_this_month'], 2)
+        self.assertEqual(sum(n for (day, n) in metrics['calls_by_day']), 2)
+        self.assertIsNotNone(metrics['computed_at'])
+
+    def test_served_from_cache(self):
+        metrics = get_dashboard_metrics()
+        self.assertEqual(metrics['calls_this_month'], 2)
+
+        # new calls are not counted until the next refresh
+        db.session.add(Call(None, self.campaign.id, None, status='completed'))
+        db.session.commit()
+        self.assertEqual(get_dashboard_metrics()['calls_this_month'], 2)
+
+        refresh_dashboard_metrics()
+        self.assertEqual(get_dashboard_metrics()['calls_this_month'], 3)
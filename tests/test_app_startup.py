@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.config import LazyTwilioClient
+from call_server.utils import load_instance_yaml
+from call_server.user.models import User
+from call_server.admin.models import admin_phones, is_admin_phone
+
+
+class TestAppStartup(BaseTestCase):
+
+    def test_instance_yaml_compiled_once(self):
+        instance_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, instance_path)
+        app = mock.Mock(instance_path=instance_path)
+        path = os.path.join(instance_path, 'defaults.yaml')
+        with open(path, 'w') as f:
+            f.write('b: 1\na: 2\n')
+
+        self.assertEqual(list(load_instance_yaml(app, 'defaults.yaml').items()), [('b', 1), ('a', 2)])
+        self.assertTrue(os.path.exists(os.path.join(instance_path, '.defaults.yaml.pickle')))
+        # written through a temp file, which isn't left behind
+        self.assertEqual(sorted(os.listdir(instance_path)), ['.defaults.yaml.pickle', 'defaults.yaml'])
+        with mock.patch('call_server.utils.yaml.load') as yaml_load:
+            self.assertEqual(load_instance_yaml(app, 'defaults.yaml')['a'], 2)
+        self.assertFalse(yaml_load.called)
+
+        # recompiled when the yaml changes
+        with open(path, 'w') as f:
+            f.write('a: 3\n')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(load_instance_yaml(app, 'defaults.yaml'), {'a': 3})
+
+    def test_twilio_client_built_on_first_use(self):
+        client = LazyTwilioClient('ACtest', 'token')
+        self.assertIsNone(client._client)
+        self.assertEqual(client.auth, ('ACtest', 'token'))
+        self.assertIsNotNone(client._client)
+
+    def test_twilio_client_base_url(self):
+        client = LazyTwilioClient('ACtest', 'token', 'http://127.0.0.1:5901')
+        with mock.patch('twilio.http.http_client.Session.send') as send:
+            send.return_value = mock.Mock(status_code=200, text='{"calls": [], "meta": {"key": "calls"}}')
+            client.calls.list(limit=1)
+        self.assertTrue(send.call_args[0][0].url.startswith('http://127.0.0.1:5901/2010-04-01/Accounts/ACtest/Calls.json'))
+
+    def test_admin_phones_loaded_lazily(self):
+        self.app.ADMIN_PHONES_LOADED_AT = None
+        user = User(name='admin', email='admin@example.com', password='password')
+        user.phone = '+14155551234'
+        db.session.add(user)
+        db.session.commit()
+
+        self.assertEqual(admin_phones(), set(['4155551234']))
+        self.assertTrue(is_admin_phone('(415) 555-1234'))
+
+        # changes outside the ORM are picked up when the ttl runs out
+        db.session.execute(User.__table__.update().values(phone='+14155550000'))
+        db.session.commit()
+        self.assertTrue(is_admin_phone('+14155551234'))
+        self.app.ADMIN_PHONES_LOADED_AT -= self.app.config['ADMIN_PHONES_TTL'] + 1
+        self.assertEqual(admin_phones(), set(['4155550000']))
+
+    def test_admin_phones_reloaded_when_users_change(self):
+        self.assertFalse(is_admin_phone('+14155551234'))
+        user = User(name='admin', email='admin@example.com', password='password')
+        user.phone = '+14155551234'
+        db.session.add(user)
+        db.session.commit()
+        self.assertTrue(is_admin_phone('+14155551234'))
+
+        db.session.delete(user)
+        db.session.commit()
+        self.assertFalse(is_admin_phone('+14155551234'))
@@ -0,0 +1,84 @@
+import threading
+import time
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import cache
+from call_server import caching
+from call_server.caching import cached, acquire_lock, release_lock, KEY_CACHED
+
+
+class TestCached(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCached, self).setUp(**kwargs)
+        cache.clear()
+        self.computed = []
+
+        @cached(timeout=60, key='test:{n}', name='test')
+        def square(n):
+            self.computed.append(n)
+            return n * n
+        self.square = square
+
+    def expire(self, key):
+        (value, expires) = cache.get(KEY_CACHED.format(key=key))
+        cache.set(KEY_CACHED.format(key=key), (value, time.time() - 1))
+
+    def test_hit_miss_and_stale(self):
+        self.assertEqual(self.square(n=3), 9)
+        self.assertEqual(self.square(n=3), 9)
+        self.assertEqual(self.computed, [3])
+
+        # expired values are served while they are refreshed
+        self.expire('test:3')
+        self.assertEqual(self.square(n=3), 9)
+        self.assertEqual(self.computed, [3, 3])
+        self.assertEqual(self.square(n=3), 9)
+
+        metrics = caching.metrics()['test']
+        self.assertEqual((metrics['hit'], metrics['miss'], metrics['stale']), (2, 1, 1))
+
+    def test_ttl_jittered(self):
+        self.app.config['CACHE_TTL_JITTER'] = 0.5
+        expiries = set()
+        for n in range(10):
+            self.square(n=n)
+            expiries.add(round(cache.get(KEY_CACHED.format(key='test:%d' % n))[1] - time.time()))
+        self.assertTrue(all(30 <= expiry <= 90 for expiry in expiries))
+        self.assertGreater(len(expiries), 1)
+
+    def test_one_thread_recomputes(self):
+        # another thread holds the lock, so we wait for its value instead of computing
+        token = acquire_lock('test:4', 30)
+
+        def other_thread():
+            time.sleep(0.2)
+            cache.set(KEY_CACHED.format(key='test:4'), (16, time.time() + 60))
+            release_lock('test:4', token)
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        self.assertEqual(self.square(n=4), 16)
+        thread.join()
+        self.assertEqual(self.computed, [])
+        self.assertEqual(caching.metrics()['test']['wait'], 1)
+
+    def test_stale_refresh_skipped_while_locked(self):
+        self.square(n=5)
+        self.expire('test:5')
+        acquire_lock('test:5', 30)
+        self.assertEqual(self.square(n=5), 25)
+        self.assertEqual(self.computed, [5])
+
+    def test_campaign_count_cached(self):
+        from call_server.campaign.models import Campaign
+        from call_server.extensions import db
+        campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom')
+        db.session.add(campaign)
+        db.session.commit()
+
+        with mock.patch('call_server.api.views.db.session.query', wraps=db.session.query) as query:
+            self.assertEqual(self.client.get('/api/campaign/%d/count.json' % campaign.id).json['completed'], 0)
+            self.assertEqual(self.client.get('/api/campaign/%d/count.json' % campaign.id).json['completed'], 0)
+        self.assertEqual(query.call_count, 2)
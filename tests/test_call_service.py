@@ -0,0 +1,127 @@
+import logging
+from datetime import time
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, limiter
+from call_server.campaign.models import Campaign, TwilioPhoneNumber
+from call_server.campaign.constants import STATUS_LIVE, SEGMENT_BY_CUSTOM
+from call_server.call.models import Session
+from call_server.call.service import place_call, call_params, CallBlocked, CallRateLimited, CallDeferred
+from call_server.call.dial_queue import DialQueue, DialQueueTimeout
+from call_server.call.jobs import place_deferred_call
+from call_server.admin.models import Blocklist
+from call_server.schedule.models import ScheduleCall, place_scheduled_call
+
+
+class TestCallService(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestCallService, self).setUp(**kwargs)
+        limiter.reset()
+        self.app.ADMIN_PHONES_LIST = set()
+        self.app.config['CALL_RATE_LIMIT'] = '1/hour'
+        self.twilio_client = mock.Mock()
+        self.twilio_client.calls.create.return_value = mock.Mock(status='queued')
+        self.app.config['TWILIO_CLIENT'] = self.twilio_client
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom',
+                                 segment_by=SEGMENT_BY_CUSTOM, status_code=STATUS_LIVE)
+        self.campaign.phone_number_set = [TwilioPhoneNumber(number='+14155550100')]
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.user_phone = '+14155551234'
+
+    def test_place_call(self):
+        placed = place_call(self.campaign, call_params(self.campaign, self.user_phone, user_location='94110'))
+        self.assertEqual(placed.status, 'queued')
+        self.assertEqual(placed.from_number, '+14155550100')
+        self.assertEqual(Session.query.get(placed.session.id).location, '94110')
+
+        kwargs = self.twilio_client.calls.create.call_args[1]
+        self.assertEqual(kwargs['to'], self.user_phone)
+        self.assertIn('sessionId=%d' % placed.session.id, kwargs['url'])
+
+    def test_blocked(self):
+        db.session.add(Blocklist(phone_number=self.user_phone))
+        db.session.commit()
+        with self.assertRaises(CallBlocked):
+            place_call(self.campaign, call_params(self.campaign, self.user_phone))
+        self.assertFalse(self.twilio_client.calls.create.called)
+
+    def test_scheduled_and_web_calls_share_rate_limit(self):
+        scheduled_call = ScheduleCall(self.campaign.id, self.user_phone, time(15, 30))
+        db.session.add(scheduled_call)
+        db.session.commit()
+
+        self.assertTrue(place_scheduled_call(scheduled_call))
+        self.assertEqual(scheduled_call.num_calls, 1)
+
+        response = self.client.get('/call/create', query_string={
+            'campaignId': self.campaign.id, 'userPhone': self.user_phone})
+        self.assertEqual(response.status_code, 429)
+
+        with self.assertRaises(CallRateLimited):
+            place_call(self.campaign, call_params(self.campaign, self.user_phone))
+        self.assertEqual(self.twilio_client.calls.create.call_count, 1)
+
+    def test_scheduled_admin_phone_exempt(self):
+        self.app.ADMIN_PHONES_LIST = set(['4155551234'])
+        scheduled_call = ScheduleCall(self.campaign.id, self.user_phone, time(15, 30))
+        db.session.add(scheduled_call)
+        db.session.commit()
+
+        self.assertTrue(place_scheduled_call(scheduled_call))
+        self.assertTrue(place_scheduled_call(scheduled_call))
+        self.assertEqual(scheduled_call.num_calls, 2)
+
+    def test_deferred_call_not_rate_limited(self):
+        with mock.patch('call_server.call.service.dial_queue.acquire_any', side_effect=DialQueueTimeout(2.5)), \
+             mock.patch('call_server.call.views.place_deferred_call') as place_deferred:
+            with self.assertRaises(CallDeferred):
+                place_call(self.campaign, call_params(self.campaign, self.user_phone))
+
+            response = self.client.get('/call/create', query_string={
+                'campaignId': self.campaign.id, 'userPhone': self.user_phone})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['call'], 'queued')
+            self.assertEqual(place_deferred.queue.call_count, 1)
+
+        # the deferred attempts didn't use up the caller's one call an hour
+        placed = place_call(self.campaign, call_params(self.campaign, self.user_phone))
+        self.assertEqual(placed.status, 'queued')
+
+    def test_burst_places_every_call(self):
+        # a bucket of 10.5 tokens, and web threads that don't wait for more
+        self.app.config.update(TWILIO_CPS=10, TWILIO_NUMBER_CPS=10, DIAL_QUEUE_MAX_WAIT=0,
+                               DIAL_QUEUE_MAX_WAIT_SCHEDULED=1)
+        DialQueue._local_buckets.clear()
+        self.addCleanup(DialQueue._local_buckets.clear)
+        jobs = []
+        queue_job = lambda *args, **kwargs: jobs.append((args, kwargs))
+        schedule_job = lambda delay, *args, **kwargs: jobs.append((args, kwargs))
+        with mock.patch.object(place_deferred_call, 'queue', side_effect=queue_job), \
+             mock.patch.object(place_deferred_call, 'schedule', side_effect=schedule_job):
+            for n in range(15):
+                response = self.client.post('/call/create', data={
+                    'campaignId': self.campaign.id, 'userPhone': '+1415555%04d' % n})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json['call'], 'queued')
+            self.assertTrue(jobs)
+
+            # the worker waits in the dial queue for the rest, putting back any that wait too long
+            for attempt in range(30):
+                if not jobs:
+                    break
+                (args, kwargs) = jobs.pop(0)
+                place_deferred_call(*args, **kwargs)
+            self.assertEqual(jobs, [])
+
+        self.assertEqual(self.twilio_client.calls.create.call_count, 15)
+        self.assertEqual(Session.query.count(), 15)
@@ -0,0 +1,92 @@
+import logging
+from unittest import mock
+
+import fakeredis
+from flask_caching.backends.rediscache import RedisCache
+
+from .run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, TwilioPhoneNumber
+from call_server.campaign.constants import STATUS_LIVE, SEGMENT_BY_CUSTOM
+from call_server.call.caller_id import CallerIdAllocator
+from call_server.call.service import place_call, call_params
+
+NUMBERS = ['+14155550100', '+14155550101', '+14155550102']
+
+
+class TestCallerId(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestCallerId, self).setUp(**kwargs)
+        CallerIdAllocator._local_in_flight.clear()
+        self.allocator = CallerIdAllocator(mock.Mock(cache=None))
+
+    def test_least_loaded_first(self):
+        self.allocator.start(NUMBERS[0], 1)
+        self.allocator.start(NUMBERS[0], 2)
+        self.allocator.start(NUMBERS[1], 3)
+        self.assertEqual(self.allocator.by_load(NUMBERS), [NUMBERS[2], NUMBERS[1], NUMBERS[0]])
+
+        self.allocator.finish(NUMBERS[0], 1)
+        self.allocator.finish(NUMBERS[0], 2)
+        self.assertEqual(self.allocator.by_load(NUMBERS)[-1], NUMBERS[1])
+
+    def test_stale_calls_age_out(self):
+        self.app.config['TWILIO_TIME_LIMIT'] = 0
+        self.allocator.start(NUMBERS[0], 1)
+        self.assertEqual(self.allocator.in_flight(NUMBERS[:1]), {NUMBERS[0]: 0})
+
+    def test_shared_in_redis(self):
+        backend = RedisCache(host=fakeredis.FakeStrictRedis(), key_prefix='test:')
+        web = CallerIdAllocator(mock.Mock(cache=backend))
+        worker = CallerIdAllocator(mock.Mock(cache=backend))
+
+        web.start(NUMBERS[0], 1)
+        self.assertEqual(worker.in_flight(NUMBERS[:2]), {NUMBERS[0]: 1, NUMBERS[1]: 0})
+        worker.finish(NUMBERS[0], 1)
+        self.assertEqual(web.in_flight(NUMBERS[:1]), {NUMBERS[0]: 0})
+
+
+class TestCampaignNumbers(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCampaignNumbers, self).setUp(**kwargs)
+        CallerIdAllocator._local_in_flight.clear()
+        self.app.config['TWILIO_CLIENT'] = mock.Mock()
+        self.app.config['TWILIO_CLIENT'].calls.create.return_value = mock.Mock(status='queued')
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom',
+                                 segment_by=SEGMENT_BY_CUSTOM, status_code=STATUS_LIVE)
+        self.campaign.phone_number_set = [TwilioPhoneNumber(number=n) for n in NUMBERS[:2]]
+        self.campaign.phone_number_set.append(TwilioPhoneNumber(number='+442071234567'))
+        db.session.add(self.campaign)
+        db.session.commit()
+
+    def test_numbers_by_region(self):
+        self.assertEqual(sorted(self.campaign.phone_numbers('us')), NUMBERS[:2])
+        self.assertEqual(self.campaign.phone_numbers('gb'), ['+442071234567'])
+        self.assertEqual(len(self.campaign.phone_numbers()), 3)
+
+        # cached until the campaign is saved
+        self.campaign.phone_number_set = [n for n in self.campaign.phone_number_set if n.number.e164 != NUMBERS[1]]
+        db.session.commit()
+        self.assertEqual(sorted(self.campaign.phone_numbers('us')), NUMBERS[:2])
+        self.campaign.clear_numbers_by_region()
+        self.assertEqual(self.campaign.phone_numbers('us'), NUMBERS[:1])
+
+    def test_calls_spread_over_numbers(self):
+        placed = [place_call(self.campaign, call_params(self.campaign, '+1415555123%d' % n)) for n in range(4)]
+        self.assertEqual(sorted(p.from_number for p in placed), sorted(NUMBERS[:2] * 2))
+
+        # a completed call frees its number
+        response = self.client.post('/call/status_callback', data=dict(call_params(self.campaign, '+14155551230',
+            sessionId=placed[0].session.id), CallStatus='completed', CallDuration=10))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(place_call(self.campaign, call_params(self.campaign, '+14155551234')).from_number,
+                         placed[0].from_number)
@@ -0,0 +1,57 @@
+import logging
+import time
+
+from .run import BaseTestCase
+
+from call_server.call.dial_queue import (DialQueue, DialQueueTimeout,
+    PRIORITY_INTERACTIVE, PRIORITY_SCHEDULED)
+
+
+class TestDialQueue(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestDialQueue, self).setUp(**kwargs)
+        self.app.config['TWILIO_CPS'] = 10
+        self.app.config['TWILIO_NUMBER_CPS'] = 5
+        self.app.config['DIAL_INTERACTIVE_RESERVE'] = 1
+        DialQueue._local_buckets.clear()
+        self.queue = DialQueue(MockCache())
+
+    def test_number_rate_limited(self):
+        # number bucket holds its rate plus the interactive reserve
+        for n in range(6):
+            self.assertLess(self.queue.acquire('+14155550100', PRIORITY_INTERACTIVE), 0.05)
+        started = time.time()
+        self.queue.acquire('+14155550100', PRIORITY_INTERACTIVE)
+        self.assertGreater(time.time() - started, 0.1)
+
+        # other numbers only share the account bucket
+        self.assertLess(self.queue.acquire('+14155550101', PRIORITY_INTERACTIVE), 0.05)
+
+    def test_interactive_reserve(self):
+        for n in range(5):
+            self.queue.acquire('+14155550100', PRIORITY_SCHEDULED)
+        # scheduled calls leave the reserve for interactive callers
+        with self.assertRaises(DialQueueTimeout):
+            self.queue.acquire('+14155550100', PRIORITY_SCHEDULED, max_wait=0)
+        self.assertLess(self.queue.acquire('+14155550100', PRIORITY_INTERACTIVE, max_wait=0), 0.05)
+
+    def test_metrics(self):
+        for n in range(7):
+            self.queue.acquire('+14155550100', PRIORITY_INTERACTIVE)
+        metrics = self.queue.metrics()[PRIORITY_INTERACTIVE]
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['dialed'], 7)
+        self.assertEqual(metrics['delayed'], 1)
+        self.assertGreater(metrics['mean_wait'], 0)
+
+
+class MockCache(dict):
+    # the counters the dial queue uses from the cache backend
+    def inc(self, key, delta=1):
+        self[key] = self.get(key, 0) + delta
@@ -0,0 +1,78 @@
+import logging
+import re
+import time
+from unittest import mock
+
+from werkzeug.exceptions import NotFound
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign
+from call_server.api.embed import get_embed, render_embeds, KEY_EMBED
+from call_server.caching import acquire_lock
+from call_server.campaign.constants import STATUS_LIVE
+
+
+class TestEmbedAssets(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestEmbedAssets, self).setUp(**kwargs)
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom',
+                                 status_code=STATUS_LIVE, embed={'type': 'custom', 'form_sel': '#call_form'})
+        db.session.add(self.campaign)
+        db.session.commit()
+
+    def test_etag_and_cache_headers(self):
+        response = self.client.get('/api/campaign/%d/embed.js' % self.campaign.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('#call_form', response.data.decode('utf-8'))
+        self.assertIn('max-age=300', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+
+        response = self.client.get('/api/campaign/%d/embed.js' % self.campaign.id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_iframe_links_versioned_js(self):
+        response = self.client.get('/api/campaign/%d/embed_iframe.html' % self.campaign.id)
+        self.assertEqual(response.status_code, 200)
+        versioned_url = re.search(r'src="http://localhost(/api/campaign/\d+/v/\w+/embed.js)"',
+                                  response.data.decode('utf-8')).group(1)
+
+        response = self.client.get(versioned_url)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        # an old version gets the current asset, without the long cache
+        response = self.client.get('/api/campaign/%d/v/0000/embed.js' % self.campaign.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+    def test_rerendered_when_campaign_saved(self):
+        etag = self.client.get('/api/campaign/%d/embed.js' % self.campaign.id).headers['ETag']
+
+        self.campaign.embed = {'type': 'custom', 'form_sel': '#new_form'}
+        db.session.commit()
+        response = self.client.get('/api/campaign/%d/embed.js' % self.campaign.id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('#new_form', response.data.decode('utf-8'))
+
+    def test_expires_in_a_process_cache(self):
+        # other workers can't clear a per-process cache when the campaign is saved, so it expires instead
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            render_embeds(self.campaign)
+        self.assertEqual(cache_set.call_args[1]['timeout'], self.app.config['EMBED_LOCAL_CACHE_TIMEOUT'])
+
+    def test_missing_campaign(self):
+        # not found before waiting on the render lock, even while another request holds it
+        acquire_lock(KEY_EMBED.format(campaign_id=999, name='embed.js'), 30)
+        started = time.time()
+        with self.assertRaises(NotFound):
+            get_embed(999, 'embed.js')
+        self.assertLess(time.time() - started, 1)
@@ -0,0 +1,63 @@
+from twilio.base.exceptions import TwilioRestException
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, limiter
+from call_server.config import LazyTwilioClient
+from call_server.campaign.models import Campaign, Target, TwilioPhoneNumber
+from call_server.campaign.constants import STATUS_LIVE, SEGMENT_BY_CUSTOM
+from call_server.call.models import Session
+from call_server.fake_twilio import FakeTwilioClient, TwilioDriver
+
+
+class TestFakeTwilio(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestFakeTwilio, self).setUp(**kwargs)
+        limiter.reset()
+        self.app.ADMIN_PHONES_LIST = set()
+        self.twilio = FakeTwilioClient(phone_numbers=['+14155550100'])
+        self.app.config['TWILIO_CLIENT'] = self.twilio
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom',
+                                 segment_by=SEGMENT_BY_CUSTOM, status_code=STATUS_LIVE)
+        self.campaign.target_set = [Target(key='custom:%d' % n, name='Target %d' % n, number='+1415555000%d' % n)
+                                    for n in range(2)]
+        self.campaign.phone_number_set = [TwilioPhoneNumber(number='+14155550100')]
+        db.session.add(self.campaign)
+        db.session.commit()
+
+    def test_call_lifecycle(self):
+        response = self.client.post('/call/create', data={'campaignId': self.campaign.id, 'userPhone': '+14155551234'})
+        self.assertEqual(response.json['call'], 'queued')
+
+        driver = TwilioDriver(self.client, self.twilio)
+        self.assertEqual(driver.run_queued(), 1)
+        self.assertEqual(driver.run_queued(), 0)
+        self.assertEqual(dict((name, len(t)) for (name, t) in driver.timings.items()), {
+            'connection': 1, 'make_calls': 1, 'make_single': 2, 'complete': 2, 'status_callback': 2})
+
+        call = self.twilio.calls.list(to='+14155551234')[0]
+        self.assertEqual(call.status, 'completed')
+        dialed = self.twilio.calls.list(parent_call_sid=call.sid)
+        self.assertEqual(sorted(c.to for c in dialed), ['+14155550000', '+14155550001'])
+        self.assertEqual(Session.query.one().status, 'completed')
+
+        self.app.config['ADMIN_API_KEY'] = 'test-key'
+        response = self.client.get('/api/twilio/calls/info/%s/?api_key=test-key' % call.sid)
+        self.assertEqual(len(response.json['objects']), 2)
+
+    def test_rest_resources(self):
+        number = self.twilio.incoming_phone_numbers.list()[0]
+        self.assertEqual(number.phone_number, '+14155550100')
+        self.assertEqual(self.twilio.incoming_phone_numbers(number.sid).fetch(), number)
+
+        call = self.twilio.calls.create(to='+14155551234', from_='+14155550100', url='http://localhost/call/connection')
+        self.assertEqual(self.twilio.calls.get(call.sid).fetch().to_json()['from'], '+14155550100')
+        with self.assertRaises(TwilioRestException):
+            self.twilio.calls.get('CA' + '0' * 32)
+
+    def test_lazy_client_fake(self):
+        client = LazyTwilioClient(None, None, fake=True)
+        self.assertEqual(client.calls.list(), [])
+        self.assertIsInstance(client._client, FakeTwilioClient)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import time
+
+from .run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign
+from call_server.instrumentation import metrics, Histogram, timed
+
+
+class TestInstrumentation(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestInstrumentation, self).setUp(**kwargs)
+        metrics.reset()
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom')
+        db.session.add(self.campaign)
+        db.session.commit()
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for n in range(100):
+            histogram.observe(0.001 if n < 90 else 0.3)
+        self.assertEqual(histogram.percentile(0.5), 0.005)
+        self.assertEqual(histogram.percentile(0.95), 0.5)
+        self.assertAlmostEqual(histogram.summary()['mean'], 0.0309)
+
+    def test_request_timed_by_component(self):
+        self.client.get('/api/campaign/%d/count.json' % self.campaign.id)
+        summary = metrics.summary()['api.campaign_count']
+        self.assertEqual(summary['count'], 1)
+        self.assertGreater(summary['queries_mean'], 0)
+        self.assertGreater(summary['components']['sql']['mean'], 0)
+        self.assertEqual(summary['components']['twilio']['count'], 1)
+
+        # time in explicitly timed blocks counts against the request's endpoint
+        with self.app.test_request_context('/api/metrics'):
+            self.app.preprocess_request()
+            with timed('geocode'):
+                time.sleep(0.01)
+            self.app.do_teardown_request()
+        self.assertGreaterEqual(metrics.summary()['api.prometheus_metrics']['components']['geocode']['mean'], 0.01)
+
+    def test_prometheus_requires_api_key(self):
+        self.client.get('/api/campaign/%d/count.json' % self.campaign.id)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+
+        self.app.config['ADMIN_API_KEY'] = 'test-key'
+        response = self.client.get('/api/metrics?api_key=test-key')
+        self.assertEqual(response.status_code, 200)
+        text = response.data.decode('utf-8')
+        self.assertIn('callpower_request_seconds_count{endpoint="api.campaign_count"} 1', text)
+        self.assertIn('callpower_request_component_seconds_bucket{component="sql",endpoint="api.campaign_count",le="+Inf"} 1', text)
+        self.assertIn('callpower_request_queries_total{endpoint="api.campaign_count"} %d'
+                      % metrics.queries['api.campaign_count'], text)
+        self.assertIn('callpower_request_component_calls_total{component="sql",endpoint="api.campaign_count"} %d'
+                      % metrics.queries['api.campaign_count'], text)
+        self.assertIn('callpower_db_pool_checked_out_peak 1', text)
+
+    def test_slow_requests_profiled(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.app.config.update(PROFILE_SAMPLE_RATE=1, PROFILE_SLOW_REQUEST=0, PROFILE_DIR=profile_dir)
+
+        self.client.get('/api/campaign/%d/count.json' % self.campaign.id)
+        profiles = os.listdir(profile_dir)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('api.campaign_count-'))
@@ -0,0 +1,72 @@
+import re
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, limiter
+from call_server.campaign.models import Campaign, Target, TwilioPhoneNumber
+from call_server.campaign.constants import STATUS_LIVE, SEGMENT_BY_CUSTOM
+from call_server.call import views as call_views
+from call_server.instrumentation import QueryCounter, QueryBudgetExceeded
+
+
+class TestQueryBudgets(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestQueryBudgets, self).setUp(**kwargs)
+        limiter.reset()
+        self.app.ADMIN_PHONES_LIST = set()
+        self.twilio_client = mock.Mock()
+        self.twilio_client.calls.create.return_value = mock.Mock(status='queued')
+        self.app.config['TWILIO_CLIENT'] = self.twilio_client
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom',
+                                 segment_by=SEGMENT_BY_CUSTOM, status_code=STATUS_LIVE)
+        self.campaign.target_set = [Target(key='custom:%d' % n, name='Target %d' % n, number='+1415555000%d' % n)
+                                    for n in range(2)]
+        self.campaign.phone_number_set = [TwilioPhoneNumber(number='+14155550100')]
+        db.session.add(self.campaign)
+        db.session.commit()
+
+    def post(self, url, data=None):
+        # views over their budget raise in tests, so each response is within it
+        response = self.client.post(re.sub('^http://localhost', '', url), data=data or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Query-Count', response.headers)
+        return response.data.decode('utf-8')
+
+    def test_call_flow_within_budgets(self):
+        self.post('/call/create', {'campaignId': self.campaign.id, 'userPhone': '+14155551234'})
+        twilio_kwargs = self.twilio_client.calls.create.call_args[1]
+        twiml = self.post(twilio_kwargs['url'])
+        twiml = self.post(re.search(r'action="([^"]+)"', twiml).group(1).replace('&amp;', '&'), {'Digits': '1'})
+
+        calls = 0
+        while '<Redirect>' in twiml:
+            twiml = self.post(re.search(r'<Redirect>([^<]+)', twiml).group(1).replace('&amp;', '&'))
+            twiml = self.post(re.search(r'action="([^"]+)"', twiml).group(1).replace('&amp;', '&'),
+                              {'DialCallStatus': 'completed', 'DialCallDuration': '30'})
+            calls += 1
+        self.assertEqual(calls, 2)
+
+        self.post(twilio_kwargs['status_callback'], {'CallStatus': 'completed', 'CallDuration': '60'})
+
+    def test_over_budget(self):
+        with mock.patch.object(call_views.connection, 'query_budget', 0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.post('/call/connection', data={'campaignId': self.campaign.id, 'userPhone': '+14155551234'})
+
+            self.app.config['QUERY_BUDGETS_STRICT'] = False
+            with mock.patch.object(self.app.logger, 'warning') as warning:
+                response = self.client.post('/call/connection',
+                                            data={'campaignId': self.campaign.id, 'userPhone': '+14155551234'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('over its budget of 0', warning.call_args[0][0])
+
+    def test_query_counter(self):
+        with QueryCounter() as outer:
+            Campaign.query.all()
+            with QueryCounter() as inner:
+                Campaign.query.all()
+        self.assertEqual((outer.count, inner.count), (2, 1))
+        self.assertGreater(outer.duration, 0)
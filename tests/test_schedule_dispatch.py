@@ -0,0 +1,110 @@
+import logging
+from datetime import datetime, time
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign
+from call_server.campaign.constants import STATUS_LIVE, STATUS_PAUSED
+from call_server.schedule.models import ScheduleCall
+from call_server.schedule import jobs
+from call_server.schedule.jobs import (KEY_DISPATCHED_THROUGH, due_windows, dispatch_scheduled_calls,
+    migrate_legacy_jobs)
+
+# a monday
+MONDAY = datetime(2020, 6, 1, 15, 30)
+
+
+class TestScheduleDispatch(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestScheduleDispatch, self).setUp(**kwargs)
+        cache.delete(KEY_DISPATCHED_THROUGH)
+        self.app.config['SCHEDULE_DISPATCH_BATCH_SIZE'] = 2
+
+        self.campaign = Campaign(name='Live Campaign', country_code='us', status_code=STATUS_LIVE)
+        paused = Campaign(name='Paused Campaign', country_code='us', status_code=STATUS_PAUSED)
+        db.session.add_all([self.campaign, paused])
+        db.session.commit()
+
+        self.due = []
+        for n in range(5):
+            sc = ScheduleCall(self.campaign.id, '+1415555000%d' % n, time(15, 30))
+            db.session.add(sc)
+            self.due.append(sc)
+        db.session.add(ScheduleCall(self.campaign.id, '+14155550010', time(15, 31)))
+        db.session.add(ScheduleCall(paused.id, '+14155550011', time(15, 30)))
+        unsubscribed = ScheduleCall(self.campaign.id, '+14155550012', time(15, 30))
+        unsubscribed.subscribed = False
+        db.session.add(unsubscribed)
+        db.session.commit()
+
+    def dispatch(self, now):
+        with mock.patch('call_server.schedule.jobs.create_scheduled_calls') as create_calls:
+            count = dispatch_scheduled_calls(now)
+        batches = [c[0][0] for c in create_calls.queue.call_args_list]
+        batches += [c[0][1] for c in create_calls.schedule.call_args_list]
+        return (count, batches)
+
+    def test_due_windows_skip_weekends(self):
+        friday_night = datetime(2020, 6, 5, 23, 58)
+        saturday = datetime(2020, 6, 6, 0, 1)
+        self.assertEqual(due_windows(friday_night, saturday),
+                         [(time(23, 58), time(23, 59, 59, 999999))])
+        self.assertEqual(due_windows(saturday, saturday), [])
+
+    def test_dispatch_due_calls_in_batches(self):
+        (count, batches) = self.dispatch(MONDAY)
+        self.assertEqual(count, 5)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(sorted(sum(batches, [])), sorted(sc.id for sc in self.due))
+
+        # only once per minute
+        self.assertEqual(self.dispatch(MONDAY)[0], 0)
+
+    def test_concurrent_ticks_dispatch_once(self):
+        # a second tick starting while the first is reading due calls skips, instead of dialing them again
+        other_tick = []
+        due_calls = jobs.due_calls
+
+        def slow_due_calls(windows):
+            if not other_tick:
+                other_tick.append(self.dispatch(MONDAY.replace(minute=31)))
+            return due_calls(windows)
+
+        with mock.patch('call_server.schedule.jobs.due_calls', side_effect=slow_due_calls):
+            (count, batches) = self.dispatch(MONDAY)
+        self.assertEqual(count, 5)
+        self.assertEqual(other_tick, [(0, [])])
+
+        # and the next tick picks up the minute the skipped one missed
+        self.assertEqual(self.dispatch(MONDAY.replace(minute=32))[0], 1)
+
+    def test_missed_minutes_caught_up(self):
+        self.dispatch(datetime(2020, 6, 1, 15, 28))
+        (count, batches) = self.dispatch(datetime(2020, 6, 1, 15, 32))
+        self.assertEqual(count, 6)
+
+    def test_legacy_jobs_skipped_until_migrated(self):
+        legacy = self.due[0]
+        legacy.job_id = 'legacy-job'
+        db.session.commit()
+        (count, batches) = self.dispatch(MONDAY)
+        self.assertEqual(count, 4)
+        self.assertNotIn(legacy.id, sum(batches, []))
+
+        legacy_job = mock.Mock(args=(self.campaign.id, legacy.phone_number.e164, '94110'))
+        with mock.patch('call_server.schedule.jobs.Job.fetch', return_value=legacy_job), \
+             mock.patch('call_server.schedule.models.rq.get_scheduler') as get_scheduler:
+            self.assertEqual(migrate_legacy_jobs(), 1)
+        get_scheduler.return_value.cancel.assert_called_once_with('legacy-job')
+        self.assertEqual((legacy.job_id, legacy.location), (None, '94110'))
+
+        cache.delete(KEY_DISPATCHED_THROUGH)
+        self.assertEqual(self.dispatch(MONDAY)[0], 5)
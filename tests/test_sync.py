@@ -0,0 +1,191 @@
+import logging
+from unittest import mock
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign
+from call_server.call.models import Call, Session
+from call_server.sync.models import SyncCampaign, SyncCall
+from call_server.sync.integrations import CRMIntegration
+from call_server.sync.metrics import KEY_SYNC_METRICS, get_sync_metrics
+
+
+class MockIntegration(CRMIntegration):
+    def __init__(self, fail_sids=(), fail_actions=(), unknown_phones=()):
+        super(MockIntegration, self).__init__()
+        self.fail_sids = fail_sids
+        self.fail_actions = fail_actions
+        self.unknown_phones = unknown_phones
+        self.saved_calls = []
+        self.phone_requests = []
+
+    def get_phone(self, twilio_sid):
+        self.phone_requests.append(twilio_sid)
+        if twilio_sid in self.fail_sids:
+            raise ValueError('twilio error')
+        return '+1415555%s' % twilio_sid[-4:]
+
+    def get_user(self, phone_number):
+        if phone_number in self.unknown_phones:
+            return None
+        return {'id': phone_number, 'phone': phone_number}
+
+    def save_action(self, call, crm_campaign_id, crm_user, crm_campaign_key=None):
+        if call.id in self.fail_actions:
+            raise ValueError('crm error')
+        self.saved_calls.append(call.id)
+        return (True, 'ok')
+
+
+class TestSyncCalls(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestSyncCalls, self).setUp(**kwargs)
+        self.app.config['CRM_SYNC_BATCH_SIZE'] = 2
+
+        self.campaign = Campaign(name='Test Campaign', country_code='us')
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.sync_campaign = SyncCampaign(self.campaign.id)
+        db.session.commit()
+        cache.delete(KEY_SYNC_METRICS.format(campaign_id=self.campaign.id))
+
+        # two sessions of two calls each, and one more on its own
+        self.calls = []
+        for n in range(5):
+            if n % 2 == 0:
+                session = Session(self.campaign.id, from_number='+14155550000')
+                db.session.add(session)
+                db.session.commit()
+            # calls in a session share the user's CallSid
+            call = Call(session.id, self.campaign.id, None, call_id='CA%04d' % session.id, status='completed')
+            db.session.add(call)
+            self.calls.append(call)
+        db.session.commit()
+
+    def sync(self, integration):
+        with mock.patch('call_server.sync.models.get_crm_integration', return_value=integration):
+            return self.sync_campaign.sync_calls()
+
+    def test_sync_in_batches(self):
+        integration = MockIntegration()
+        stats = self.sync(integration)
+
+        self.assertEqual(sorted(integration.saved_calls), [c.id for c in self.calls])
+        self.assertEqual(SyncCall.query.filter_by(saved=True).count(), len(self.calls))
+        self.assertEqual(stats['batches'], 3)
+        self.assertIn('crm_action', stats['seconds'])
+
+        # nothing left on the next run
+        self.assertEqual(self.sync(integration)['calls'], 0)
+
+    def test_sync_errors_are_retried(self):
+        stats = self.sync(MockIntegration(fail_sids=['CA0002']))
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual(SyncCall.query.filter_by(retry=True).count(), 2)
+
+        integration = MockIntegration()
+        stats = self.sync(integration)
+        self.assertEqual(sorted(integration.saved_calls), [self.calls[2].id, self.calls[3].id])
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(SyncCall.query.filter_by(retry=True).count(), 0)
+        self.assertEqual(SyncCall.query.filter_by(saved=True).count(), len(self.calls))
+
+    def test_unmatched_callers_are_retried(self):
+        # a caller who isn't in the crm yet is synced once they are
+        unmatched = self.calls[2]
+        self.sync(MockIntegration(unknown_phones=['+14155550002']))
+        sync_call = SyncCall.query.filter_by(call_id=unmatched.id).one()
+        self.assertEqual((sync_call.saved, sync_call.retry, sync_call.attempts), (False, True, 1))
+
+        integration = MockIntegration()
+        self.sync(integration)
+        self.assertIn(unmatched.id, integration.saved_calls)
+        sync_call = SyncCall.query.filter_by(call_id=unmatched.id).one()
+        self.assertEqual((sync_call.saved, sync_call.retry), (True, False))
+
+    def test_retries_stop_after_max_attempts(self):
+        self.app.config['CRM_SYNC_MAX_ATTEMPTS'] = 2
+        integration = MockIntegration(fail_sids=['CA0002'])
+        self.sync(integration)
+        self.assertEqual(self.sync(integration)['retries'], 2)
+        self.assertEqual(self.sync(integration)['retries'], 0)
+
+        failed = SyncCall.query.filter_by(call_id=self.calls[2].id).one()
+        self.assertEqual((failed.saved, failed.retry, failed.attempts), (False, False, 2))
+        self.assertEqual(failed.crm_message, 'twilio error')
+
+    def test_sync_reads_only_new_calls(self):
+        self.sync(MockIntegration())
+        self.assertEqual(self.sync_campaign.last_call_id, self.calls[-1].id)
+
+        session = Session(self.campaign.id, from_number='+14155550000')
+        db.session.add(session)
+        db.session.commit()
+        new_call = Call(session.id, self.campaign.id, None, call_id='CA%04d' % session.id, status='completed')
+        db.session.add(new_call)
+        db.session.commit()
+
+        integration = MockIntegration()
+        stats = self.sync(integration)
+        self.assertEqual(integration.saved_calls, [new_call.id])
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(self.sync_campaign.last_call_id, new_call.id)
+
+    def test_sync_reads_late_commits_below_watermark(self):
+        self.sync(MockIntegration())
+
+        session = Session(self.campaign.id, from_number='+14155550000')
+        db.session.add(session)
+        db.session.commit()
+        late_call = Call(session.id, self.campaign.id, None, call_id='CA%04d' % session.id, status='completed')
+        db.session.add(late_call)
+        db.session.commit()
+        # a call with a higher id committed and synced first
+        self.sync_campaign.last_call_id = late_call.id + 10
+        db.session.commit()
+
+        integration = MockIntegration()
+        self.sync(integration)
+        self.assertEqual(integration.saved_calls, [late_call.id])
+        self.assertEqual(self.sync_campaign.last_call_id, late_call.id + 10)
+
+    def test_save_action_errors_are_retried(self):
+        stats = self.sync(MockIntegration(fail_actions=[self.calls[1].id]))
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['saved'], len(self.calls) - 1)
+
+        integration = MockIntegration()
+        self.sync(integration)
+        self.assertEqual(integration.saved_calls, [self.calls[1].id])
+
+    def test_one_phone_request_per_session(self):
+        integration = MockIntegration()
+        stats = self.sync(integration)
+        self.assertEqual(sorted(integration.phone_requests), ['CA0001', 'CA0002', 'CA0003'])
+        self.assertEqual(stats['twilio_requests'], 3)
+
+    def test_sync_first_call_in_session(self):
+        integration = MockIntegration()
+        integration.BATCH_ALL_CALLS_IN_SESSION = True
+        stats = self.sync(integration)
+
+        self.assertEqual(integration.saved_calls, [self.calls[0].id, self.calls[2].id, self.calls[4].id])
+        self.assertEqual(stats['skipped'], 2)
+        self.assertEqual(SyncCall.query.count(), len(self.calls))
+
+    def test_run_metrics_recorded(self):
+        self.sync(MockIntegration(fail_sids=['CA0002']))
+        self.sync(MockIntegration())
+
+        (latest, first) = get_sync_metrics(self.campaign.id)
+        self.assertEqual((first['examined'], first['synced'], first['failed'], first['retry_queue']), (5, 3, 2, 2))
+        self.assertEqual((latest['examined'], latest['synced'], latest['retries'], latest['retry_queue']), (2, 2, 2, 0))
+        self.assertIsNotNone(latest['lag']['max'])
+        self.assertEqual(set(latest['seconds']), set(['twilio', 'crm', 'db', 'total']))
@@ -0,0 +1,91 @@
+import logging
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign, Target
+from call_server.sync.integrations.actionkit_crm import ActionKitIntegration
+
+
+class MockTargetEndpoint(object):
+    def __init__(self, targets):
+        self.targets = targets
+        self.list_calls = 0
+
+    def list(self, _limit=100, _offset=0, **kwargs):
+        self.list_calls += 1
+        page = self.targets[_offset:_offset+_limit]
+        next_page = '/rest/v1/target/?_offset=%d' % (_offset+_limit) if _offset+_limit < len(self.targets) else None
+        return {'objects': page, 'meta': {'next': next_page}}
+
+    def create(self, data):
+        target = dict(data, id=len(self.targets) + 1)
+        self.targets.append(target)
+        return target
+
+
+class MockActionKit(object):
+    def __init__(self, targets):
+        self.target = MockTargetEndpoint(targets)
+
+
+class TestActionKitTargets(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestActionKitTargets, self).setUp(**kwargs)
+        cache.clear()
+
+        self.targets = [{'id': n + 1, 'country': 'us', 'state': 'CA', 'type': 'house',
+                         'first': 'Rep', 'last': 'Number%d' % n} for n in range(250)]
+        self.integration = self.get_integration()
+
+    def get_integration(self):
+        integration = ActionKitIntegration('actionkit.example.com', 'test', api_key='test')
+        integration.ak_client = MockActionKit(self.targets)
+        return integration
+
+    def test_warmed_by_paged_list(self):
+        for n in range(250):
+            self.assertEqual(self.integration._get_target_id('us', 'CA', 'house', 'Rep Number%d' % n), n + 1)
+        # three pages of 100, for all lookups
+        self.assertEqual(self.integration.ak_client.target.list_calls, 3)
+
+    def test_create_missing_target(self):
+        target_id = self.integration._get_target_id('us', 'NY', 'senate', 'New Senator')
+        self.assertEqual(target_id, 251)
+        self.assertEqual(self.integration._get_target_id('us', 'NY', 'senate', 'New Senator'), target_id)
+        self.assertEqual(len(self.targets), 251)
+
+        # persisted for the next sync run
+        next_run = self.get_integration()
+        self.assertEqual(next_run._get_target_id('us', 'NY', 'senate', 'New Senator'), target_id)
+        self.assertEqual(next_run.ak_client.target.list_calls, 0)
+
+    def test_concurrent_runs_keep_created_targets(self):
+        # two syncs loaded at the same time, each creating a different target
+        other_run = self.get_integration()
+        self.integration._get_target_id('us', 'CA', 'house', 'Rep Number0')
+        other_run._get_target_id('us', 'CA', 'house', 'Rep Number0')
+
+        first_id = self.integration._get_target_id('us', 'NY', 'senate', 'First Senator')
+        second_id = other_run._get_target_id('us', 'TX', 'senate', 'Second Senator')
+
+        next_run = self.get_integration()
+        self.assertEqual(next_run._get_target_id('us', 'NY', 'senate', 'First Senator'), first_id)
+        self.assertEqual(next_run._get_target_id('us', 'TX', 'senate', 'Second Senator'), second_id)
+        self.assertEqual(len(self.targets), 252)
+
+    def test_match_target_data_memoized(self):
+        campaign = Campaign(name='Test Campaign', country_code='us', campaign_type='custom')
+        target = Target(key='custom:1', title='Mayor', name='Test Mayor')
+        db.session.add_all([campaign, target])
+        db.session.commit()
+
+        match = self.integration._match_ak_target_data(campaign, target)
+        self.assertEqual(match, ('us', '', 'other', 'Test Mayor'))
+        self.assertIn(target.id, self.integration._target_data)
@@ -0,0 +1,93 @@
+import logging
+
+from .run import BaseTestCase
+
+from call_server.extensions import cache
+from call_server.call.models import Session
+from call_server.sync.integrations.mobile_commons import MobileCommonsIntegration
+
+PROFILE_XML = b"""<response success="true">
+  <profile id="1">
+    <status>Active Subscriber</status>
+    <subscriptions>
+      <subscription campaign_id="100" created_at="2020-01-01T00:00:00Z" status="Opted-Out"/>
+      <subscription campaign_id="200" created_at="2020-02-01T00:00:00Z" status="Active"/>
+    </subscriptions>
+  </profile>
+</response>"""
+
+NO_PROFILE_XML = b"""<response success="false"><error id="5" message="Invalid phone number"/></response>"""
+
+UPDATE_XML = b"""<response success="true"></response>"""
+
+
+class MockResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+
+class MockMobileCommonsAPI(object):
+    def __init__(self, profile_xml):
+        self.profile_xml = profile_xml
+        self.requests = []
+
+    def get(self, path, params=None):
+        self.requests.append(('GET', path))
+        return MockResponse(self.profile_xml)
+
+    def post(self, path, data=None):
+        self.requests.append(('POST', path))
+        return MockResponse(UPDATE_XML)
+
+
+class TestMobileCommonsProfiles(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestMobileCommonsProfiles, self).setUp(**kwargs)
+        cache.clear()
+        self.crm_user = {'id': '+14155551234', 'phone': '+14155551234'}
+
+    def get_integration(self, profile_xml):
+        integration = MobileCommonsIntegration('test', 'test')
+        integration.mc_api = MockMobileCommonsAPI(profile_xml)
+        return integration
+
+    def test_only_campaign_subscriptions_kept(self):
+        integration = self.get_integration(PROFILE_XML)
+        (state, message) = integration.get_profile('200', self.crm_user)
+        self.assertEqual(state['status'], 'Active Subscriber')
+        self.assertEqual([s['status'] for s in state['subscriptions']], ['Active'])
+
+        self.assertEqual(integration.ok_to_subscribe_user('100', self.crm_user), (False, 'opted out'))
+        self.assertEqual(integration.ok_to_subscribe_user('200', self.crm_user), (False, 'already subscribed'))
+
+    def test_profile_cached_by_phone_hash(self):
+        integration = self.get_integration(PROFILE_XML)
+        integration.get_profile('200', self.crm_user)
+        self.assertTrue(cache.get(integration.KEY_PROFILE.format(
+            phone_hash=Session.hash_phone(self.crm_user['phone']), campaign_id='200')))
+        self.assertFalse([key for key in cache.cache._cache if '4155551234' in key])
+
+    def test_repeat_caller_uses_cached_profile(self):
+        integration = self.get_integration(NO_PROFILE_XML)
+        self.assertEqual(integration.save_action(None, '300', self.crm_user, 'opt-in-key'), (True, None))
+
+        # the cached profile was updated with the prompt, so no second lookup or update
+        self.assertEqual(integration.save_action(None, '300', self.crm_user, 'opt-in-key'), (False, 'already prompted'))
+        self.assertEqual(integration.mc_api.requests, [('GET', '/api/profile'), ('POST', '/api/profile_update')])
+
+        # shared with the next sync run
+        next_run = self.get_integration(NO_PROFILE_XML)
+        self.assertEqual(next_run.ok_to_subscribe_user('300', self.crm_user), (False, 'already prompted'))
+        self.assertEqual(next_run.mc_api.requests, [])
+
+    def test_parse_error_not_cached(self):
+        integration = self.get_integration(b'<response')
+        self.assertEqual(integration.ok_to_subscribe_user('300', self.crm_user), (False, 'parse error'))
+        self.assertEqual(integration.ok_to_subscribe_user('300', self.crm_user), (False, 'parse error'))
+        self.assertEqual(len(integration.mc_api.requests), 2)
@@ -0,0 +1,74 @@
+import logging
+
+from .run import BaseTestCase
+from .mock_crm import MockCRMServer
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.sync.integrations.rogue_crm import RogueIntegration
+
+
+class TestRogueSaveActions(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestRogueSaveActions, self).setUp(**kwargs)
+        self.app.config['CRM_SYNC_WORKERS'] = 4
+
+        campaign = Campaign(name='Test Campaign', country_code='us')
+        target = Target(key='custom:1', title='Mayor', name='Test Mayor')
+        db.session.add_all([campaign, target])
+        db.session.commit()
+        session = Session(campaign.id, from_number='+14155550000')
+        db.session.add(session)
+        db.session.commit()
+
+        self.batch = []
+        for n in range(20):
+            call = Call(session.id, campaign.id, target.id, call_id='CA%04d' % n, status='completed', duration=n)
+            db.session.add(call)
+            phone = '+1415555%04d' % n
+            self.batch.append((call, {'id': phone, 'phone': phone}))
+        db.session.commit()
+
+    def save_actions(self, server):
+        integration = RogueIntegration(server.url, 'test')
+        return integration.save_actions(self.batch, 'crm-campaign')
+
+    def test_save_actions_reuses_connections(self):
+        server = MockCRMServer().start()
+        try:
+            results = self.save_actions(server)
+        finally:
+            server.stop()
+
+        self.assertEqual([status for (status, message) in results], [True] * len(self.batch))
+        self.assertEqual(sorted(data['mobile'] for (path, data) in server.requests),
+                         [crm_user['phone'] for (call, crm_user) in self.batch])
+        self.assertTrue(all(path == '/api/v1/callpower/call' for (path, data) in server.requests))
+        # one keep-alive connection per worker at most, not one per call
+        self.assertLessEqual(len(server.connections), self.app.config['CRM_SYNC_WORKERS'])
+
+    def test_save_actions_in_batch_order(self):
+        server = MockCRMServer(fail_when={'call_duration': 3}).start()
+        try:
+            results = self.save_actions(server)
+        finally:
+            server.stop()
+
+        self.assertEqual(len(results), len(self.batch))
+        self.assertFalse(results[3][0])
+        self.assertIn('rejected', results[3][1])
+        self.assertTrue(all(status for (status, message) in results[:3] + results[4:]))
+
+    def test_save_actions_connection_error(self):
+        server = MockCRMServer()
+        server.server_close()  # nothing listening
+
+        results = self.save_actions(server)
+        self.assertEqual([status for (status, message) in results], [None] * len(self.batch))
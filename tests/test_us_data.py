@@ -102,6 +102,72 @@ class TestUSData(BaseTestCase):
         self.assertEqual(rep['district'], '0')
         self.assertGreater(len(rep['offices']), 1)
 
+    def test_cache_get_many(self):
+        keys = ['us:senate:CA', 'us:senate:DC', 'us:house:CA:13']
+        (senators, no_senators, house) = self.us_data.cache_get_many(keys)
+        self.assertEqual(senators, self.us_data.get_senators('CA'))
+        self.assertEqual(no_senators, [])
+        self.assertEqual(house, self.us_data.get_house_members('CA', '13'))
+
+        self.assertEqual(self.us_data.cache_get_many([]), [])
+
+    def test_cache_search(self):
+        senators = self.us_data.get_senators('CA')
+        self.assertEqual(self.us_data.cache_search('us:senate:CA'), senators)
+        self.assertEqual(self.us_data.cache_search('us:senate:ZZ'), [])
+
+        # indexed filters ignore case
+        last_name = senators[0]['last_name']
+        results = self.us_data.cache_search('us:senate:', [('last_name', last_name.upper())])
+        self.assertIn(senators[0], results)
+        for r in results:
+            self.assertTrue(r['last_name'].lower().startswith(last_name.lower()))
+
+        # unindexed filters are checked against matching records
+        self.assertEqual(self.us_data.cache_search('us:senate:CA', [('chamber', 'house')]), [])
+
+    def test_cache_search_page(self):
+        keys = ['us:senate:CA', 'us:house:CA']
+        everything = self.us_data.cache_search('us:house:CA') + self.us_data.cache_search('us:senate:CA')
+
+        paged = []
+        cursor = None
+        while True:
+            (results, cursor) = self.us_data.cache_search_page(keys, limit=10, cursor=cursor)
+            self.assertLessEqual(len(results), 10)
+            paged.extend(results)
+            if not cursor:
+                break
+        self.assertEqual(paged, everything)
+
+        # filters are applied before paging
+        (results, cursor) = self.us_data.cache_search_page(['us:'], [('state', 'ca'), ('chamber', 'senate')], limit=1)
+        self.assertEqual(len(results), 1)
+        (more_results, cursor) = self.us_data.cache_search_page(['us:'], [('state', 'ca'), ('chamber', 'senate')], limit=10, cursor=cursor)
+        self.assertEqual([r['chamber'] for r in results + more_results], ['senate'] * len(results + more_results))
+        self.assertIsNone(cursor)
+
+    def test_cache_search_name(self):
+        senator = self.us_data.get_senators('CA')[0]
+        full_name = '%s %s' % (senator['first_name'], senator['last_name'])
+        self.assertIn(senator, self.us_data.cache_search('us:senate:', [('name', full_name.upper())]))
+        self.assertIn(senator, self.us_data.cache_search('us:senate:', [('name', senator['last_name'][:3])]))
+
+        # fuzzy matching tolerates typos and missing accents
+        (results, _) = self.us_data.cache_search_page(['us:house:'], [('name', 'Nydia Velasquez')], fuzzy=True)
+        self.assertEqual([r['last_name'] for r in results], [u'Velázquez'])
+
+    def test_cache_search_indexed_on_demand(self):
+        leg = {'id': 'ocd-person/test', 'name': u'José Test', 'givenName': u'José', 'familyName': 'Test', 'state': 'CA'}
+        self.us_data.cache_set_indexed('us_state:openstates:ocd-person/test', leg)
+        self.assertEqual(self.us_data.cache_search('us_state:openstates:', [('first_name', 'jose')]), [leg])
+        self.assertEqual(self.us_data.cache_search('', [('name', 'jose test')]), [leg])
+
+    def test_cache_search_accents(self):
+        results = self.us_data.cache_search('us:bioguide:', [('last_name', 'cardenas')])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['last_name'], u'Cárdenas')
+
     def test_locate_targets(self):
         uids = locate_targets(self.mock_location, self.CONGRESS_CAMPAIGN, cache=self.mock_cache)
         # returns a list of target uids